@@ -0,0 +1,363 @@
+"""
+Asset Garbage Collection
+
+Background sweeper that keeps the asset store and the `asset` collection in
+step. Deleting a document never deletes a file directly: stored content may
+be shared by several assets (see storage.py), so files are only removed by
+the orphan pass, once nothing refers to them any more.
+
+Each sweep runs these passes in order:
+
+    intermediates   asset documents marked `retention: intermediate` (stems,
+                    guides, vocal takes) older than ASSET_INTERMEDIATE_TTL_SEC
+                    are deleted
+    quotas          projects whose assets exceed ASSET_PROJECT_QUOTA_BYTES
+                    lose their oldest intermediate assets until they fit;
+                    projects still over quota are reported by `over_quota()`
+                    and get no new jobs
+    dangling        asset documents whose file is gone from the store are
+                    deleted; each sweep checks the next ASSET_GC_DANGLING_PER_SWEEP
+                    documents in _id order (wrapping around), so the cost of a
+                    sweep (one HEAD request per document on S3) stays bounded
+                    however large the library grows
+    orphans         stored files no asset or voice profile refers to are
+                    deleted, along with abandoned staging files
+
+Documents and files younger than ASSET_GC_GRACE_SEC are never touched, so a
+render that has been stored but not yet registered is safe. Deletions go out
+in batches of ASSET_GC_BATCH with a pause after each, so a sweep stays in the
+background behind renders and uploads. Only one process sweeps at a time
+(a lock document in the `sweeper` collection, which also keeps the dangling
+pass's position); the lock is extended while a sweep makes progress, and a
+sweep that finds it has lost the lock stops.
+
+Flat, pre-content-addressed files are left alone unless ASSET_GC_LEGACY=true:
+older job results may still link to them.
+
+Configuration (environment):
+    ASSET_GC_INTERVAL_SEC         time between sweeps; 0 disables (default 3600)
+    ASSET_GC_GRACE_SEC            minimum age of anything deleted (default 3600)
+    ASSET_INTERMEDIATE_TTL_SEC    lifetime of intermediate assets; 0 keeps them (default 604800)
+    ASSET_PROJECT_QUOTA_BYTES     per-project asset bytes; 0 is unlimited (default 0)
+    ASSET_GC_BATCH                documents or files per batch (default 200)
+    ASSET_GC_BATCH_PAUSE_SEC      pause after every batch (default 0.2)
+    ASSET_GC_DANGLING_PER_SWEEP   asset documents checked for a missing file per sweep (default 5000)
+    ASSET_GC_LEGACY               also collect flat legacy files (default false)
+"""
+
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Set
+
+from pymongo.errors import DuplicateKeyError
+
+from database import adb
+from storage import AssetStore, key_from_url
+
+logger = logging.getLogger(__name__)
+
+_LOCK_ID = 'asset_gc'
+
+
+class LockLost(Exception):
+    """Another process took over the sweep lock (ours expired mid-sweep)."""
+
+
+class AssetSweeper:
+    """Periodic retention, quota and orphan sweeps over the asset store."""
+
+    def __init__(self, store: AssetStore, owner: str, interval: float = 3600.0, grace_sec: float = 3600.0,
+                 intermediate_ttl_sec: float = 7 * 86400, project_quota_bytes: int = 0, batch_size: int = 200,
+                 batch_pause_sec: float = 0.2, include_legacy: bool = False, dangling_per_sweep: int = 5000):
+        self.store = store
+        self.owner = owner
+        self.interval = interval
+        self.grace_sec = grace_sec
+        self.intermediate_ttl_sec = intermediate_ttl_sec
+        self.project_quota_bytes = project_quota_bytes
+        self.batch_size = max(1, batch_size)
+        self.batch_pause_sec = batch_pause_sec
+        self.include_legacy = include_legacy
+        self.dangling_per_sweep = max(1, dangling_per_sweep)
+        self.lock_ttl_sec = max(600.0, interval)
+        self._renewed_at = 0.0
+        self._locked = False
+        self._task: Optional[asyncio.Task] = None
+        self._over_quota: Dict[str, int] = {}
+        self.sweeps = 0
+        self.skipped = 0
+        self.failures = 0
+        self.last_report: Dict[str, Any] = {}
+        self.totals = {'intermediates': 0, 'quota_evictions': 0, 'dangling': 0, 'orphan_files': 0,
+                       'orphan_bytes': 0, 'staging_files': 0}
+
+    @classmethod
+    def from_env(cls, store: AssetStore, owner: str, **kwargs) -> 'AssetSweeper':
+        return cls(
+            store, owner,
+            interval=float(os.getenv("ASSET_GC_INTERVAL_SEC", "3600")),
+            grace_sec=float(os.getenv("ASSET_GC_GRACE_SEC", "3600")),
+            intermediate_ttl_sec=float(os.getenv("ASSET_INTERMEDIATE_TTL_SEC", str(7 * 86400))),
+            project_quota_bytes=int(os.getenv("ASSET_PROJECT_QUOTA_BYTES", "0")),
+            batch_size=int(os.getenv("ASSET_GC_BATCH", "200")),
+            batch_pause_sec=float(os.getenv("ASSET_GC_BATCH_PAUSE_SEC", "0.2")),
+            include_legacy=os.getenv("ASSET_GC_LEGACY", "false").lower() == "true",
+            dangling_per_sweep=int(os.getenv("ASSET_GC_DANGLING_PER_SWEEP", "5000")),
+            **kwargs,
+        )
+
+    # ---- lifecycle ----
+
+    def start(self):
+        if self.interval <= 0:
+            return
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name="asset-gc")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.sweep()
+            except Exception:
+                self.failures += 1
+                logger.exception("Asset sweep failed")
+
+    async def _acquire(self) -> bool:
+        now = datetime.utcnow()
+        try:
+            # Matches a free or expired lock (or ours); a held lock makes the upsert collide on _id.
+            await adb['sweeper'].find_one_and_update(
+                {'_id': _LOCK_ID, '$or': [{'locked_until': {'$lte': now}}, {'owner': self.owner}]},
+                {'$set': {'owner': self.owner, 'locked_until': now + timedelta(seconds=self.lock_ttl_sec)}},
+                upsert=True)
+        except DuplicateKeyError:
+            return False
+        self._renewed_at = time.monotonic()
+        self._locked = True
+        return True
+
+    async def _renew(self):
+        """Extend the lock (at most every tenth of its TTL); raises LockLost if it is no longer ours."""
+        if not self._locked or time.monotonic() - self._renewed_at < self.lock_ttl_sec / 10:
+            return
+        res = await adb['sweeper'].update_one(
+            {'_id': _LOCK_ID, 'owner': self.owner},
+            {'$set': {'locked_until': datetime.utcnow() + timedelta(seconds=self.lock_ttl_sec)}})
+        if res.matched_count == 0:
+            raise LockLost()
+        self._renewed_at = time.monotonic()
+
+    async def _release(self):
+        self._locked = False
+        await adb['sweeper'].update_one({'_id': _LOCK_ID, 'owner': self.owner},
+                                        {'$set': {'locked_until': datetime.utcnow()}})
+
+    async def _pause(self):
+        """Called after every batch: keep the lock, then yield to renders and uploads."""
+        await self._renew()
+        if self.batch_pause_sec > 0:
+            await asyncio.sleep(self.batch_pause_sec)
+
+    # ---- sweep ----
+
+    async def sweep(self) -> Dict[str, Any]:
+        """Run every pass once; returns what was deleted (empty if another process is sweeping)."""
+        if not await self._acquire():
+            self.skipped += 1
+            return {}
+        t0 = time.monotonic()
+        try:
+            report = {
+                'intermediates': await self.expire_intermediates(),
+                'quota_evictions': await self.enforce_quotas(),
+                'dangling': await self.delete_dangling(),
+            }
+            report.update(await self.delete_orphans())
+        except LockLost:
+            logger.warning("Asset sweep lost its lock to another process; stopping")
+            return {}
+        finally:
+            await self._release()
+        for k, v in report.items():
+            self.totals[k] += v
+        report['elapsed_sec'] = round(time.monotonic() - t0, 2)
+        self.sweeps += 1
+        self.last_report = report
+        logger.info("Asset sweep: %s", report)
+        return report
+
+    def _cutoff(self, age_sec: float) -> datetime:
+        return datetime.utcnow() - timedelta(seconds=max(age_sec, self.grace_sec))
+
+    async def _delete_docs(self, ids: List[Any]) -> int:
+        deleted = 0
+        for i in range(0, len(ids), self.batch_size):
+            res = await adb['asset'].delete_many({'_id': {'$in': ids[i:i + self.batch_size]}})
+            deleted += res.deleted_count
+            await self._pause()
+        return deleted
+
+    async def expire_intermediates(self) -> int:
+        if self.intermediate_ttl_sec <= 0:
+            return 0
+        query = {'retention': 'intermediate', 'created_at': {'$lt': self._cutoff(self.intermediate_ttl_sec)}}
+        deleted = 0
+        while True:
+            docs = await adb['asset'].find(query, {'_id': 1}, limit=self.batch_size)
+            if not docs:
+                return deleted
+            deleted += await self._delete_docs([d['_id'] for d in docs])
+
+    async def enforce_quotas(self) -> int:
+        if self.project_quota_bytes <= 0:
+            self._over_quota = {}
+            return 0
+        usage = await adb['asset'].aggregate([
+            {'$match': {'project_id': {'$ne': None}}},
+            {'$group': {'_id': '$project_id', 'bytes': {'$sum': {'$ifNull': ['$size', 0]}}}},
+            {'$match': {'bytes': {'$gt': self.project_quota_bytes}}},
+        ])
+        evicted = 0
+        over: Dict[str, int] = {}
+        for row in usage:
+            project_id, excess = row['_id'], row['bytes'] - self.project_quota_bytes
+            candidates = await adb['asset'].find(
+                {'project_id': project_id, 'retention': 'intermediate', 'created_at': {'$lt': self._cutoff(0)}},
+                {'_id': 1, 'size': 1}, sort=[('created_at', 1)])
+            victims = []
+            for doc in candidates:
+                if excess <= 0:
+                    break
+                victims.append(doc['_id'])
+                excess -= doc.get('size') or 0
+            evicted += await self._delete_docs(victims)
+            if excess > 0:
+                over[project_id] = excess
+        self._over_quota = over
+        if over:
+            logger.warning("Projects over their asset quota after eviction: %s", over)
+        return evicted
+
+    def over_quota(self, project_id: Optional[str]) -> int:
+        """Bytes by which a project exceeded its quota at the last sweep (0 if within it)."""
+        return self._over_quota.get(project_id, 0) if project_id else 0
+
+    async def delete_dangling(self) -> int:
+        """Check the next `dangling_per_sweep` documents after where the last sweep stopped."""
+        loop = asyncio.get_running_loop()
+        cutoff = self._cutoff(0)
+        lock = await adb['sweeper'].find_one({'_id': _LOCK_ID}, {'dangling_after': 1})
+        start = last_id = (lock or {}).get('dangling_after')
+        wrapped = False
+        deleted = checked = 0
+        while checked < self.dangling_per_sweep:
+            query: Dict[str, Any] = {'created_at': {'$lt': cutoff}}
+            id_range: Dict[str, Any] = {}
+            if last_id is not None:
+                id_range['$gt'] = last_id
+            if wrapped:
+                id_range['$lte'] = start  # second lap: stop where this sweep began
+            if id_range:
+                query['_id'] = id_range
+            docs = await adb['asset'].find(query, {'url': 1, 'storage_key': 1}, sort=[('_id', 1)],
+                                           limit=min(self.batch_size, self.dangling_per_sweep - checked))
+            if not docs:
+                if start is None or wrapped:
+                    last_id = start
+                    break
+                last_id, wrapped = None, True  # end of the collection: continue from the start
+                continue
+            checked += len(docs)
+            last_id = docs[-1]['_id']
+            missing = await loop.run_in_executor(None, self._missing, docs)
+            if missing:
+                deleted += await self._delete_docs(missing)
+            else:
+                await self._pause()
+        await adb['sweeper'].update_one({'_id': _LOCK_ID, 'owner': self.owner},
+                                        {'$set': {'dangling_after': last_id}})
+        return deleted
+
+    def _missing(self, docs: List[Dict[str, Any]]) -> List[Any]:
+        missing = []
+        for doc in docs:
+            try:
+                key = doc.get('storage_key') or key_from_url(doc.get('url') or '')
+            except ValueError:
+                continue  # not ours to judge
+            if not self.store.exists(key):
+                missing.append(doc['_id'])
+        return missing
+
+    async def _referenced(self, urls: List[str]) -> Set[str]:
+        refs = {d['url'] for d in await adb['asset'].find({'url': {'$in': urls}}, {'url': 1})}
+        profiles = await adb['voiceprofile'].find(
+            {'$or': [{'files': {'$in': urls}}, {'demo_url': {'$in': urls}}]}, {'files': 1, 'demo_url': 1})
+        for p in profiles:
+            refs.update(p.get('files') or [])
+            refs.add(p.get('demo_url'))
+        return refs
+
+    async def delete_orphans(self) -> Dict[str, int]:
+        loop = asyncio.get_running_loop()
+        cutoff = time.time() - self.grace_sec
+        keys = iter(self.store.iter_keys(self.include_legacy))
+        files = size = 0
+        while True:
+            # The listing itself touches the disk/bucket, so it is pulled a batch at a time off the loop.
+            batch = await loop.run_in_executor(None, _take, keys, self.batch_size)
+            if not batch:
+                break
+            old = {self.store.url(k): k for k, mtime in batch if mtime < cutoff}
+            if not old:
+                await self._renew()
+                continue
+            refs = await self._referenced(list(old))
+            orphans = [k for url, k in old.items() if url not in refs]
+            if orphans:
+                removed = await loop.run_in_executor(None, self._delete_files, orphans)
+                files += len(orphans)
+                size += removed
+                await self._pause()
+        staging = await loop.run_in_executor(None, self.store.sweep_staging, cutoff)
+        return {'orphan_files': files, 'orphan_bytes': size, 'staging_files': staging}
+
+    def _delete_files(self, keys: List[str]) -> int:
+        size = 0
+        for key in keys:
+            try:
+                size += os.path.getsize(self.store.cache_path(key))
+            except OSError:
+                pass
+            self.store.delete(key)
+        return size
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'interval_sec': self.interval,
+            'sweeps': self.sweeps,
+            'skipped': self.skipped,
+            'failures': self.failures,
+            'totals': dict(self.totals),
+            'last': self.last_report,
+            'over_quota': dict(self._over_quota),
+        }
+
+
+def _take(it, n: int) -> List[Any]:
+    out = []
+    for item in it:
+        out.append(item)
+        if len(out) >= n:
+            break
+    return out
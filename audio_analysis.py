@@ -0,0 +1,203 @@
+"""
+Voice Clip Analysis
+
+Quality analysis for uploaded voice samples. Each clip is decoded to a
+memory-mapped sample buffer and measured in fixed-size frames with NumPy:
+
+    rms_dbfs / peak_dbfs    overall level and sample peak
+    clipping_ratio          share of samples at or beyond full scale
+    noise_floor_dbfs        level of the background noise (see below), or None
+    snr_db                  95th percentile of frame RMS over the noise floor, or None
+    silence_ratio           share of frames below SILENCE_DBFS
+    loudness_lufs           BS.1770 integrated loudness
+
+The noise floor is the median level of the gaps: frames at least
+QUIET_GAP_DB below the signal. A clip without gaps (continuous singing, a
+test tone) has no frame of noise alone, so each frame's noise is estimated
+from its spectrum instead: tones and harmonics fill a few FFT bins, broadband
+noise fills them all, so the median bin power stands for the noise. Clips
+too short for a single frame get None for both fields and are not flagged.
+
+`analyze_clip` is a render stage: all clips of an upload are analysed in
+parallel on the shared render pool (see render.py). MP3/AMR clips are
+decoded through ffmpeg when it is on PATH; otherwise they only get the
+header-level fields.
+"""
+
+import contextlib
+import os
+import shutil
+import subprocess
+import tempfile
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+import dsp
+
+FRAME_SIZE = 2048
+FRAMES_PER_BLOCK = 64
+SILENCE_DBFS = -50.0
+CLIP_LEVEL = 0.999
+# Frames this far below the signal level are gaps, i.e. background noise only.
+QUIET_GAP_DB = 12.0
+MIN_QUIET_FRAMES = 3
+
+# Thresholds used to flag clips in the report.
+MAX_CLIPPING_RATIO = 0.001
+MIN_SNR_DB = 15.0
+MAX_SILENCE_RATIO = 0.6
+
+def _decode_to_wav(path: str) -> Optional[str]:
+    ffmpeg = shutil.which('ffmpeg')
+    if ffmpeg is None:
+        return None
+    fd, out = tempfile.mkstemp(suffix='.wav')
+    os.close(fd)
+    proc = subprocess.run([ffmpeg, '-v', 'error', '-y', '-i', path, '-acodec', 'pcm_s16le', out],
+                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=60)
+    if proc.returncode != 0:
+        os.remove(out)
+        return None
+    return out
+
+
+def _noise_share_db(frames: np.ndarray) -> np.ndarray:
+    """Estimated share of each row's power that is broadband noise, in dB (<= 0).
+
+    Noise power per bin is exponentially distributed, so its mean is the median
+    bin power / ln 2; spectral peaks (tones, harmonics) barely move the median.
+    """
+    power = np.abs(np.fft.rfft(frames * np.hanning(frames.shape[1]), axis=1)) ** 2
+    total = power.sum(axis=1)
+    noise = np.median(power, axis=1) / np.log(2) * power.shape[1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        share = np.where(total > 0, np.clip(noise / total, 1e-12, 1.0), 1.0)
+    return 10 * np.log10(share)
+
+
+def _noise_floor(wav: dsp.WavData, rms_db: np.ndarray, signal: float) -> Optional[float]:
+    quiet = rms_db <= signal - QUIET_GAP_DB
+    if np.count_nonzero(quiet) >= MIN_QUIET_FRAMES:
+        return float(np.median(rms_db[quiet]))
+    # No gaps: a second pass over the (mapped) samples for the spectral estimate.
+    shares = []
+    for block in dsp.iter_blocks(wav, FRAME_SIZE * FRAMES_PER_BLOCK):
+        mono = block.mean(axis=1) if block.shape[1] > 1 else block[:, 0]
+        n = len(mono) // FRAME_SIZE
+        if n:
+            shares.append(_noise_share_db(mono[:n * FRAME_SIZE].reshape(n, FRAME_SIZE).astype(np.float64)))
+    if not shares:
+        return None  # shorter than one frame
+    shares = np.concatenate(shares)
+    return float(np.median(rms_db[:len(shares)] + shares))
+
+
+def measure(wav: dsp.WavData) -> Dict[str, Any]:
+    """Frame-based level statistics over a memory-mapped WAV buffer."""
+    frame_rms: List[np.ndarray] = []
+    peak = 0.0
+    clipped = 0
+    sum_sq = 0.0
+    meter = dsp.LoudnessMeter(wav.samplerate, wav.channels)
+    for block in dsp.iter_blocks(wav, FRAME_SIZE * FRAMES_PER_BLOCK):
+        meter.feed(block)
+        mono = block.mean(axis=1) if block.shape[1] > 1 else block[:, 0]
+        absval = np.abs(block)
+        peak = max(peak, float(absval.max()))
+        clipped += int(np.count_nonzero(absval >= CLIP_LEVEL))
+        sq = mono.astype(np.float64) ** 2
+        sum_sq += float(sq.sum())
+        n = len(sq) // FRAME_SIZE
+        if n:
+            frame_rms.append(np.sqrt(sq[:n * FRAME_SIZE].reshape(n, FRAME_SIZE).mean(axis=1)))
+        if len(sq) % FRAME_SIZE:
+            frame_rms.append(np.sqrt(np.atleast_1d(sq[n * FRAME_SIZE:].mean())))
+    total = wav.frames * max(1, wav.channels)
+    if not frame_rms:
+        return {'rms_dbfs': -120.0, 'peak_dbfs': -120.0, 'clipping_ratio': 0.0, 'noise_floor_dbfs': None,
+                'snr_db': None, 'silence_ratio': 1.0, 'loudness_lufs': None}
+    rms = np.concatenate(frame_rms)
+    with np.errstate(divide='ignore'):
+        rms_db = np.maximum(20 * np.log10(rms), -120.0)
+    signal = float(np.percentile(rms_db, 95))
+    noise_floor = _noise_floor(wav, rms_db, signal)
+    loudness = meter.integrated()
+    return {
+        'rms_dbfs': round(dsp.db(np.sqrt(sum_sq / wav.frames)), 2),
+        'peak_dbfs': round(dsp.db(peak), 2),
+        'clipping_ratio': round(clipped / total, 6),
+        'noise_floor_dbfs': round(noise_floor, 2) if noise_floor is not None else None,
+        'snr_db': round(signal - noise_floor, 2) if noise_floor is not None else None,
+        'silence_ratio': round(float(np.mean(rms_db < SILENCE_DBFS)), 4),
+        'loudness_lufs': round(loudness, 2) if loudness is not None else None,
+    }
+
+
+def _issues(m: Dict[str, Any]) -> List[str]:
+    issues = []
+    if m['clipping_ratio'] > MAX_CLIPPING_RATIO:
+        issues.append('clipping')
+    if m['silence_ratio'] >= 1.0:
+        issues.append('silent')
+    else:
+        if m['snr_db'] is not None and m['snr_db'] < MIN_SNR_DB:
+            issues.append('noisy')
+        if m['silence_ratio'] > MAX_SILENCE_RATIO:
+            issues.append('mostly_silence')
+    return issues
+
+
+def analyze_clip(path: str, url: str) -> Dict[str, Any]:
+    """Full report for one clip; runs inside a pool worker process."""
+    ext = os.path.splitext(path)[1].lower()
+    report: Dict[str, Any] = {
+        'file': url, 'channels': 0, 'sample_rate': 0, 'duration_sec': 0,
+        'mono_ok': False, 'sr_ok': False, 'converted': ext in ['.mp3', '.amr'],
+        'decoded': False, 'metrics': {}, 'issues': [],
+    }
+    decoded = None
+    try:
+        source = path
+        if ext != '.wav':
+            decoded = _decode_to_wav(path)
+            if decoded is None:
+                return report
+            source = decoded
+        wav = dsp.open_wav(source)
+        report.update({
+            'channels': wav.channels, 'sample_rate': wav.samplerate,
+            'duration_sec': round(wav.duration_sec, 2),
+            'mono_ok': wav.channels == 1,
+            'sr_ok': 16000 <= wav.samplerate <= 48000,
+            'decoded': True,
+        })
+        report['metrics'] = measure(wav)
+        report['issues'] = _issues(report['metrics'])
+        del wav
+    except Exception as e:
+        report['error'] = str(e)[:200]
+    finally:
+        if decoded:
+            with contextlib.suppress(OSError):
+                os.remove(decoded)
+    return report
+
+
+def build_report(clips: List[Dict[str, Any]]) -> Dict[str, Any]:
+    quality_ok = all(((c['mono_ok'] and c['sr_ok']) or c['converted']) and not c['issues'] for c in clips)
+    report: Dict[str, Any] = {'clips': clips, 'quality_ok': quality_ok}
+    measured = [c['metrics'] for c in clips if c.get('metrics')]
+    if measured:
+        loudness = [m['loudness_lufs'] for m in measured if m['loudness_lufs'] is not None]
+        snr = [m['snr_db'] for m in measured if m['snr_db'] is not None]
+        report['summary'] = {
+            'clips_measured': len(measured),
+            'total_duration_sec': round(sum(c['duration_sec'] for c in clips), 2),
+            'min_snr_db': min(snr) if snr else None,
+            'max_clipping_ratio': max(m['clipping_ratio'] for m in measured),
+            'mean_silence_ratio': round(sum(m['silence_ratio'] for m in measured) / len(measured), 4),
+            'loudness_range_lufs': [min(loudness), max(loudness)] if loudness else None,
+            'issues': sorted({i for c in clips for i in c['issues']}),
+        }
+    return report
@@ -0,0 +1,156 @@
+"""
+Asset delivery benchmark: concurrent range requests against /assets.
+
+Writes a test master (WAV-sized random data) into a scratch directory,
+serves it with uvicorn in a separate process, and fires concurrent random
+`Range` requests at it, the way seeking players do. Reports requests/s,
+MB/s and latency percentiles, then the cost of a revalidation (304)
+compared with a full re-download.
+
+Usage:
+    python benchmarks/bench_assets.py [--impl assets|static] [--size-mb 50]
+                                      [--concurrency 32] [--requests 2000]
+                                      [--range-kb 256]
+
+--impl static runs the same load against Starlette's StaticFiles (which
+ignores Range and answers every request with the whole file) for comparison.
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def serve(impl: str, directory: str, port: int):
+    import uvicorn
+    from starlette.applications import Starlette
+    from starlette.routing import Mount
+
+    if impl == 'static':
+        from starlette.staticfiles import StaticFiles
+        files = StaticFiles(directory=directory)
+    else:
+        from delivery import AssetFiles
+        files = AssetFiles.from_env(directory)
+    app = Starlette(routes=[Mount('/assets', app=files)])
+    uvicorn.run(app, host='127.0.0.1', port=port, log_level='warning')
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+async def _wait_up(client, url: str, timeout: float = 15.0):
+    t0 = time.perf_counter()
+    while True:
+        try:
+            await client.head(url)
+            return
+        except Exception:
+            if time.perf_counter() - t0 > timeout:
+                raise
+            await asyncio.sleep(0.1)
+
+
+def _pct(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def load(args, base: str, size: int):
+    import httpx
+
+    url = f'{base}/assets/master.wav'
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=60) as client:
+        await _wait_up(client, url)
+        span = args.range_kb * 1024
+        latencies, sent = [], 0
+        queue = asyncio.Queue()
+        for _ in range(args.requests):
+            start = random.randrange(0, max(1, size - span))
+            queue.put_nowait((start, min(size, start + span) - 1))
+
+        async def client_loop():
+            nonlocal sent
+            while not queue.empty():
+                start, end = queue.get_nowait()
+                t = time.perf_counter()
+                r = await client.get(url, headers={'range': f'bytes={start}-{end}'})
+                body = r.content
+                latencies.append(time.perf_counter() - t)
+                sent += len(body)
+                if args.impl == 'assets' and (r.status_code != 206 or len(body) != end - start + 1):
+                    raise RuntimeError(f"bad range response {r.status_code} len={len(body)}")
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*(client_loop() for _ in range(args.concurrency)))
+        wall = time.perf_counter() - t0
+        print(f"impl={args.impl} file={size / 2**20:.0f} MB range={args.range_kb} KB "
+              f"concurrency={args.concurrency} requests={args.requests}")
+        print(f"  {args.requests / wall:8.1f} req/s  {sent / wall / 2**20:8.1f} MB/s  "
+              f"p50={_pct(latencies, 0.5) * 1e3:.1f}ms p95={_pct(latencies, 0.95) * 1e3:.1f}ms "
+              f"p99={_pct(latencies, 0.99) * 1e3:.1f}ms")
+
+        full, revalidate = [], []
+        r = await client.get(url)
+        etag = r.headers.get('etag')
+        for _ in range(20):
+            t = time.perf_counter()
+            await client.get(url)
+            full.append(time.perf_counter() - t)
+            if etag:
+                t = time.perf_counter()
+                r = await client.get(url, headers={'if-none-match': etag})
+                revalidate.append(time.perf_counter() - t)
+        line = f"  full download median {statistics.median(full) * 1e3:.1f}ms"
+        if revalidate:
+            line += f"; If-None-Match -> {r.status_code} median {statistics.median(revalidate) * 1e3:.2f}ms"
+        print(line)
+
+
+def cli():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--impl', choices=['assets', 'static'], default='assets')
+    ap.add_argument('--size-mb', type=int, default=50)
+    ap.add_argument('--concurrency', type=int, default=32)
+    ap.add_argument('--requests', type=int, default=2000)
+    ap.add_argument('--range-kb', type=int, default=256)
+    ap.add_argument('--serve', help=argparse.SUPPRESS)
+    ap.add_argument('--port', type=int, default=0, help=argparse.SUPPRESS)
+    args = ap.parse_args()
+    if args.serve:
+        serve(args.impl, args.serve, args.port)
+        return
+
+    directory = tempfile.mkdtemp(prefix='bench_assets_')
+    size = args.size_mb * 2**20
+    with open(os.path.join(directory, 'master.wav'), 'wb') as f:
+        for _ in range(args.size_mb):
+            f.write(os.urandom(2**20))
+    port = _free_port()
+    server = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve', directory,
+                               '--impl', args.impl, '--port', str(port)])
+    try:
+        asyncio.run(load(args, f'http://127.0.0.1:{port}', size))
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,98 @@
+"""
+Batch generation benchmark: one /api/generate/batch versus N /api/generate/create.
+
+Renders the same grid of variations twice, first as N independent create
+jobs, then as a single batch, and reports wall time and throughput for
+each, plus how many pipeline stages the batch computed once and shared.
+
+Usage:
+    python benchmarks/bench_batch.py [--styles 4] [--arrangements 2] [--concurrency 2]
+
+The default batch concurrency matches the create queue's, so the speedup
+comes from shared stages rather than from running more variations at once.
+
+Runs in-process against mongomock unless DATABASE_URL/DATABASE_NAME are set.
+"""
+
+import argparse
+import asyncio
+import itertools
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+os.environ.setdefault("JOB_RESUME_ON_STARTUP", "false")
+
+import database  # noqa: E402
+
+if not database.configured():
+    import mongomock
+    database.db = mongomock.MongoClient().bench_batch
+
+import httpx  # noqa: E402
+
+import main  # noqa: E402
+
+STYLES = ['Romantic', 'Jazz', 'Lo-fi', 'Cinematic', 'Folk', 'Synthwave', 'Gospel', 'Ambient']
+ARRANGEMENTS = [['Piano', 'Strings'], ['Guitar', 'Bass'], ['Piano', 'Drums', 'Bass'], ['Synth']]
+
+
+async def _wait(client, ids, timeout: float):
+    t0 = time.perf_counter()
+    pending = list(ids)
+    while pending:
+        if time.perf_counter() - t0 > timeout:
+            raise TimeoutError(f"{len(pending)} jobs unfinished")
+        statuses = await asyncio.gather(*(client.get(f'/api/job/{i}/status') for i in pending))
+        pending = [i for i, r in zip(pending, statuses) if r.json().get('status') not in ('done', 'error')]
+        await asyncio.sleep(0.05)
+
+
+async def run(args):
+    main.BATCH_CONCURRENCY = args.concurrency
+    grid = {'style': STYLES[:args.styles], 'instruments': ARRANGEMENTS[:args.arrangements]}
+    variations = [dict(zip(grid, values)) for values in itertools.product(*grid.values())]
+    base = {'tempo': 90, 'key': 'C minor'}
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://bench") as c:
+        async with main.app.router.lifespan_context(main.app):
+            project_id = (await c.post('/api/projects', json={'name': 'bench'})).json()['projectId']
+
+            t0 = time.perf_counter()
+            ids = []
+            for v in variations:
+                r = await c.post('/api/generate/create', json={'projectId': project_id, **base, **v})
+                r.raise_for_status()
+                ids.append(r.json()['jobId'])
+            await _wait(c, ids, args.timeout)
+            independent = time.perf_counter() - t0
+
+            t0 = time.perf_counter()
+            r = await c.post('/api/generate/batch', json={'projectId': project_id, 'base': base, 'grid': grid})
+            r.raise_for_status()
+            batch_id = r.json()['jobId']
+            await _wait(c, [batch_id], args.timeout)
+            batched = time.perf_counter() - t0
+            result = (await c.get(f'/api/job/{batch_id}/status')).json().get('result') or {}
+
+    n = len(variations)
+    print(f"variations={n} ({args.styles} styles x {args.arrangements} arrangements), batch concurrency={args.concurrency}")
+    print(f"independent  {independent:6.2f}s  {n / independent:5.2f} variations/s")
+    print(f"batch        {batched:6.2f}s  {n / batched:5.2f} variations/s  "
+          f"done={result.get('done')}/{result.get('total')} shared stages={result.get('sharedStages')}")
+    print(f"speedup      {independent / batched:.2f}x")
+
+
+def cli():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--styles', type=int, default=4)
+    ap.add_argument('--arrangements', type=int, default=2)
+    ap.add_argument('--concurrency', type=int, default=2)
+    ap.add_argument('--timeout', type=float, default=300.0)
+    asyncio.run(run(ap.parse_args()))
+
+
+if __name__ == '__main__':
+    cli()
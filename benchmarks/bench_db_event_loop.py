@@ -0,0 +1,113 @@
+"""
+Event-loop lag benchmark: blocking pymongo calls vs. the async data layer.
+
+Runs N concurrent "handlers" that each perform a job_update-style round trip,
+while a ticker coroutine measures how late the event loop wakes it up. With
+blocking calls every round trip stalls the loop; with `database.adb` the calls
+run on the I/O pool and the loop stays responsive.
+
+Usage:
+    python benchmarks/bench_db_event_loop.py [--latency-ms 5] [--calls 200]
+
+Uses DATABASE_URL/DATABASE_NAME when set, otherwise mongomock with an
+artificial per-call latency to stand in for the network round trip.
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database  # noqa: E402
+
+
+class _SlowCollection:
+    def __init__(self, col, latency):
+        self._col = col
+        self._latency = latency
+
+    def __getattr__(self, name):
+        attr = getattr(self._col, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            time.sleep(self._latency)
+            return attr(*args, **kwargs)
+        return call
+
+
+class _SlowDatabase:
+    def __init__(self, real, latency):
+        self._real = real
+        self._latency = latency
+
+    def __getitem__(self, name):
+        return _SlowCollection(self._real[name], self._latency)
+
+
+def _setup(latency_sec: float):
+    if not database.configured():
+        import mongomock
+        database.db = _SlowDatabase(mongomock.MongoClient().bench, latency_sec)
+    ids = [database._require_db()['job'].insert_one({'progress': 0}).inserted_id for _ in range(32)]
+    return ids
+
+
+async def _ticker(lags, stop, interval=0.005):
+    while not stop.is_set():
+        t0 = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(max(0.0, time.perf_counter() - t0 - interval) * 1000)
+
+
+async def _run(mode: str, ids, calls: int, concurrency: int):
+    lags = []
+    stop = asyncio.Event()
+    ticker = asyncio.create_task(_ticker(lags, stop))
+    sem = asyncio.Semaphore(concurrency)
+
+    async def handler(i):
+        async with sem:
+            _id = ids[i % len(ids)]
+            if mode == 'sync':
+                database._require_db()['job'].update_one({'_id': _id}, {'$set': {'progress': i}})
+            else:
+                await database.adb['job'].update_one({'_id': _id}, {'$set': {'progress': i}})
+            await asyncio.sleep(0)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(handler(i) for i in range(calls)))
+    elapsed = time.perf_counter() - t0
+    stop.set()
+    await ticker
+    lags.sort()
+    return {
+        'mode': mode,
+        'elapsed_s': round(elapsed, 3),
+        'lag_p50_ms': round(statistics.median(lags), 2) if lags else 0.0,
+        'lag_p99_ms': round(lags[int(len(lags) * 0.99) - 1], 2) if lags else 0.0,
+        'lag_max_ms': round(lags[-1], 2) if lags else 0.0,
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--latency-ms', type=float, default=5.0)
+    ap.add_argument('--calls', type=int, default=200)
+    ap.add_argument('--concurrency', type=int, default=32)
+    args = ap.parse_args()
+
+    ids = _setup(args.latency_ms / 1000)
+    for mode in ('sync', 'async'):
+        r = asyncio.run(_run(mode, ids, args.calls, args.concurrency))
+        print(f"{r['mode']:>5}: elapsed={r['elapsed_s']}s  loop lag p50={r['lag_p50_ms']}ms "
+              f"p99={r['lag_p99_ms']}ms max={r['lag_max_ms']}ms")
+
+
+if __name__ == '__main__':
+    main()
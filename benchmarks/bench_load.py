@@ -0,0 +1,474 @@
+"""
+Load benchmark: mixed API traffic against the whole app, with a regression gate.
+
+Virtual users hammer the API for --duration seconds with a weighted mix of
+operations:
+
+    create    POST /api/projects
+    generate  a burst of --burst concurrent /api/generate/melody and
+              /api/generate/instrumental requests
+    poll      GET /api/job/{id}/status for a recently submitted job
+    upload    POST /api/upload/voice with two short WAV clips
+
+then waits (up to --drain seconds) for the submitted jobs to finish. It
+reports p50/p95/p99 latency per operation, requests/s, jobs/s, event-loop
+lag and Mongo operation counts; the last two are read from the app's own
+/metrics before and after the run, so they cover the server side only.
+
+Usage:
+    python benchmarks/bench_load.py [--server inprocess|uvicorn] [--duration 20]
+                                    [--users 32] [--mix create=1,generate=2,poll=12,upload=1]
+                                    [--out results.json] [--budgets benchmarks/load_budgets.json]
+                                    [--baseline previous.json] [--tolerance 0.25]
+
+--server inprocess drives the ASGI app directly in this process (client and
+server share one event loop, so loop lag includes the client's own work);
+--server uvicorn serves it from a child process over HTTP. Uses
+DATABASE_URL/DATABASE_NAME when set, otherwise mongomock inside the serving
+process.
+
+Results are written as JSON with --out. The run fails (exit status 1) when
+a --budgets limit is exceeded, or when --baseline is given and p95/p99
+latency or Mongo ops per request grew, or jobs/s fell, by more than
+--tolerance. A budgets file maps dotted result paths to limits:
+
+    {"requests.poll.p99_ms": {"max": 50}, "jobs.jobs_per_sec": {"min": 2}}
+
+benchmarks/load_budgets.json holds only machine-independent limits (no
+errors, no unfinished jobs, Mongo ops per request). Latency and throughput
+are gated against benchmarks/load_baseline.json, a recorded default run
+(in-process, mongomock); re-record it with --out when the hardware changes.
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import time
+import wave
+from datetime import datetime, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+os.environ.setdefault("JOB_RESUME_ON_STARTUP", "false")
+os.environ.setdefault("METRICS_LOOP_LAG_SEC", "0.01")
+
+OPS = ('create', 'generate', 'poll', 'upload')
+INSTRUMENTS = (['piano'], ['piano', 'strings'], ['drums', 'bass', 'guitar'])
+
+
+def _load_app():
+    """Import the app with a database behind it (mongomock unless DATABASE_URL is set)."""
+    import database
+    in_memory = not database.configured()
+    if in_memory:
+        import mongomock
+        database.db = mongomock.MongoClient().bench_load
+    import main
+    return main.app, 'mongomock' if in_memory else 'mongod'
+
+
+def serve(port: int):
+    import uvicorn
+    app, _ = _load_app()
+    uvicorn.run(app, host='127.0.0.1', port=port, log_level='warning')
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+async def _wait_up(client, timeout: float = 30.0):
+    t0 = time.perf_counter()
+    while True:
+        try:
+            await client.get('/')
+            return
+        except Exception:
+            if time.perf_counter() - t0 > timeout:
+                raise
+            await asyncio.sleep(0.2)
+
+
+def _wav_bytes(seconds: float = 1.0, rate: int = 16000) -> bytes:
+    buf = io.BytesIO()
+    with wave.open(buf, 'wb') as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(rate)
+        wf.writeframes(b'\x00\x00' * int(seconds * rate))
+    return buf.getvalue()
+
+
+def _parse_mix(spec: str):
+    weights = {}
+    for part in spec.split(','):
+        name, _, weight = part.partition('=')
+        if name.strip() not in OPS:
+            raise SystemExit(f"Unknown operation in --mix: {name!r} (expected {', '.join(OPS)})")
+        weights[name.strip()] = float(weight or 1)
+    return weights
+
+
+# ---------- metrics scraping ----------
+
+_SAMPLE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(\{[^}]*\})? (\S+)$')
+_LABEL = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+
+async def _scrape(client):
+    """/metrics as {(name, frozenset(labels)): value}, or None when metrics are disabled."""
+    r = await client.get('/metrics')
+    if r.status_code != 200:
+        return None
+    samples = {}
+    for line in r.text.splitlines():
+        m = _SAMPLE.match(line)
+        if m:
+            labels = frozenset(_LABEL.findall(m.group(2) or ''))
+            samples[(m.group(1), labels)] = float(m.group(3))
+    return samples
+
+
+def _delta(before, after, name):
+    """Per-label-set increase of a counter-like series between two scrapes."""
+    out = {}
+    for (n, labels), value in after.items():
+        if n == name:
+            out[labels] = value - before.get((n, labels), 0.0)
+    return out
+
+
+def _mongo_ops(before, after):
+    counts = {}
+    for labels, n in _delta(before, after, 'mongo_op_seconds_count').items():
+        op = dict(labels).get('op', '')
+        counts[op] = counts.get(op, 0) + int(n)
+    errors = sum(_delta(before, after, 'mongo_op_errors_total').values())
+    return {k: counts[k] for k in sorted(counts) if counts[k]}, int(errors)
+
+
+def _loop_lag(before, after):
+    """Event-loop lag from the histogram; percentiles are bucket upper bounds."""
+    buckets = sorted(((float(dict(labels)['le']), n)
+                      for labels, n in _delta(before, after, 'event_loop_lag_seconds_bucket').items()),
+                     key=lambda b: b[0])
+    count = sum(_delta(before, after, 'event_loop_lag_seconds_count').values())
+    total = sum(_delta(before, after, 'event_loop_lag_seconds_sum').values())
+    if not count:
+        return None
+
+    def quantile(q):
+        for bound, cumulative in buckets:
+            if cumulative >= q * count:
+                return None if bound == float('inf') else round(bound * 1000, 2)
+        return None
+
+    return {'samples': int(count), 'mean_ms': round(total / count * 1000, 2),
+            'p50_ms_le': quantile(0.5), 'p99_ms_le': quantile(0.99)}
+
+
+# ---------- workload ----------
+
+class Recorder:
+    def __init__(self):
+        self.latencies = {op: [] for op in OPS}
+        self.statuses = {op: {} for op in OPS}
+
+    def add(self, op: str, seconds: float, status: int):
+        self.latencies[op].append(seconds)
+        self.statuses[op][status] = self.statuses[op].get(status, 0) + 1
+
+
+def _pct(values, q):
+    return round(values[min(len(values) - 1, int(q * len(values)))] * 1000, 2) if values else None
+
+
+def _summary(values, statuses, elapsed):
+    values = sorted(values)
+    # 0 is a transport failure; 503/429 are load shedding and counted separately.
+    errors = sum(n for code, n in statuses.items() if code == 0 or (code >= 400 and code not in (429, 503)))
+    return {
+        'count': len(values),
+        'rps': round(len(values) / elapsed, 2),
+        'errors': errors,
+        'rejected': statuses.get(503, 0) + statuses.get(429, 0),
+        'status': {str(k): v for k, v in sorted(statuses.items())},
+        'p50_ms': _pct(values, 0.50),
+        'p95_ms': _pct(values, 0.95),
+        'p99_ms': _pct(values, 0.99),
+        'max_ms': round(values[-1] * 1000, 2) if values else None,
+    }
+
+
+class Workload:
+    def __init__(self, client, args, rec: Recorder):
+        self.client = client
+        self.args = args
+        self.rec = rec
+        self.projects = []
+        self.jobs = []
+        self.recent = []
+        self.clip = _wav_bytes()
+        self.seq = 0
+
+    async def _timed(self, op: str, method: str, url: str, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            r = await self.client.request(method, url, **kwargs)
+            status = r.status_code
+        except Exception:
+            r, status = None, 0
+        self.rec.add(op, time.perf_counter() - t0, status)
+        return r if status and status < 400 else None
+
+    async def create(self):
+        self.seq += 1
+        r = await self._timed('create', 'POST', '/api/projects', json={'name': f'bench-{self.seq}'})
+        if r is not None:
+            self.projects.append(r.json()['projectId'])
+
+    async def _generate_one(self):
+        project_id = random.choice(self.projects)
+        # A limited set of variants, so part of the traffic is served by the result cache.
+        variant = random.randrange(self.args.variants)
+        if random.random() < 0.5:
+            url, body = '/api/generate/melody', {
+                'projectId': project_id, 'lyrics': f'line {variant}\nla la la', 'style': 'Romantic',
+                'tempo': 80 + variant % 40, 'key': 'C minor'}
+        else:
+            url, body = '/api/generate/instrumental', {
+                'projectId': project_id, 'tempo': 80 + variant % 40, 'key': 'C minor',
+                'instruments': INSTRUMENTS[variant % len(INSTRUMENTS)], 'length_sec': 10, 'style': 'Sad'}
+        r = await self._timed('generate', 'POST', url, json=body)
+        if r is not None:
+            job_id = r.json()['jobId']
+            self.jobs.append(job_id)
+            self.recent = (self.recent + [job_id])[-64:]
+
+    async def generate(self):
+        await asyncio.gather(*(self._generate_one() for _ in range(self.args.burst)))
+
+    async def poll(self):
+        if not self.recent:
+            return await self.generate()
+        await self._timed('poll', 'GET', f'/api/job/{random.choice(self.recent)}/status')
+
+    async def upload(self):
+        files = [('files', (f'clip{i}.wav', self.clip, 'audio/wav')) for i in range(2)]
+        await self._timed('upload', 'POST', '/api/upload/voice', files=files, data={'name': 'Bench Voice'})
+
+    async def user(self, weights, deadline: float):
+        ops, w = list(weights), list(weights.values())
+        while time.perf_counter() < deadline:
+            await getattr(self, random.choices(ops, w)[0])()
+
+    async def drain(self, timeout: float):
+        """Wait for submitted jobs to finish; returns (status counts, seconds waited)."""
+        t0 = time.perf_counter()
+        pending = set(self.jobs)
+        statuses = {}
+        while pending and time.perf_counter() - t0 < timeout:
+            for job_id in list(pending):
+                r = await self.client.get(f'/api/job/{job_id}/status')
+                status = r.json().get('status') if r.status_code == 200 else 'missing'
+                if status in ('done', 'error', 'missing'):
+                    pending.discard(job_id)
+                    statuses[status] = statuses.get(status, 0) + 1
+            if pending:
+                await asyncio.sleep(0.25)
+        if pending:
+            statuses['unfinished'] = len(pending)
+        return statuses, time.perf_counter() - t0
+
+
+async def run(args, client, db_kind: str):
+    await _wait_up(client)
+    load = Workload(client, args, Recorder())
+    for _ in range(max(1, args.users // 8)):
+        await load.create()
+    rec = load.rec = Recorder()  # warm-up requests are not part of the results
+    before = await _scrape(client)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(load.user(args.weights, t0 + args.duration) for _ in range(args.users)))
+    elapsed = time.perf_counter() - t0
+    after = await _scrape(client)
+    job_statuses, drained = await load.drain(args.drain)
+
+    requests = {op: _summary(rec.latencies[op], rec.statuses[op], elapsed) for op in OPS if rec.latencies[op]}
+    all_latencies = [v for op in OPS for v in rec.latencies[op]]
+    all_statuses = {}
+    for op in OPS:
+        for code, n in rec.statuses[op].items():
+            all_statuses[code] = all_statuses.get(code, 0) + n
+    total = _summary(all_latencies, all_statuses, elapsed)
+    done = job_statuses.get('done', 0)
+    result = {
+        'meta': {
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'commit': _git_commit(),
+            'server': args.server,
+            'database': db_kind,
+            'duration_sec': args.duration,
+            'users': args.users,
+            'burst': args.burst,
+            'mix': args.weights,
+        },
+        'requests': {'total': total, **requests},
+        'jobs': {
+            'submitted': len(load.jobs),
+            **job_statuses,
+            'drain_sec': round(drained, 2),
+            'jobs_per_sec': round(done / (elapsed + drained), 2),
+        },
+    }
+    if before is not None and after is not None:
+        ops, errors = _mongo_ops(before, after)
+        result['event_loop_lag'] = _loop_lag(before, after)
+        result['mongo'] = {'ops': ops, 'total': sum(ops.values()), 'errors': errors,
+                           'ops_per_request': round(sum(ops.values()) / max(1, total['count']), 2)}
+    return result
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+# ---------- regression gate ----------
+
+def _lookup(result, path: str):
+    value = result
+    for part in path.split('.'):
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    return value
+
+
+def check_budgets(result, budgets):
+    failures = []
+    for path, limit in budgets.items():
+        value = _lookup(result, path)
+        if value is None:
+            continue
+        if 'max' in limit and value > limit['max']:
+            failures.append(f"{path} = {value} exceeds budget {limit['max']}")
+        if 'min' in limit and value < limit['min']:
+            failures.append(f"{path} = {value} is below budget {limit['min']}")
+    return failures
+
+
+def check_baseline(result, baseline, tolerance: float):
+    failures = []
+    higher_is_worse = [f'requests.{op}.{q}' for op in ('total',) + OPS for q in ('p95_ms', 'p99_ms')]
+    higher_is_worse.append('mongo.ops_per_request')
+    for path in higher_is_worse:
+        new, old = _lookup(result, path), _lookup(baseline, path)
+        if new is not None and old and new > old * (1 + tolerance):
+            failures.append(f"{path} regressed: {old} -> {new}")
+    new, old = _lookup(result, 'jobs.jobs_per_sec'), _lookup(baseline, 'jobs.jobs_per_sec')
+    if new is not None and old and new < old * (1 - tolerance):
+        failures.append(f"jobs.jobs_per_sec regressed: {old} -> {new}")
+    return failures
+
+
+def report(result):
+    meta = result['meta']
+    print(f"server={meta['server']} db={meta['database']} users={meta['users']} "
+          f"duration={meta['duration_sec']}s commit={meta['commit']}")
+    print(f"{'op':>9} {'count':>7} {'rps':>8} {'err':>5} {'rej':>5} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}  (ms)")
+    for op, s in result['requests'].items():
+        print(f"{op:>9} {s['count']:>7} {s['rps']:>8} {s['errors']:>5} {s['rejected']:>5} "
+              f"{s['p50_ms']!s:>8} {s['p95_ms']!s:>8} {s['p99_ms']!s:>8} {s['max_ms']!s:>8}")
+    jobs = result['jobs']
+    print(f"jobs: {jobs['submitted']} submitted, {jobs.get('done', 0)} done, {jobs.get('error', 0)} failed, "
+          f"{jobs.get('unfinished', 0)} unfinished; {jobs['jobs_per_sec']} jobs/s")
+    lag = result.get('event_loop_lag')
+    if lag:
+        print(f"event loop lag: mean {lag['mean_ms']}ms, p50 <= {lag['p50_ms_le']}ms, p99 <= {lag['p99_ms_le']}ms")
+    mongo = result.get('mongo')
+    if mongo:
+        print(f"mongo: {mongo['total']} ops ({mongo['ops_per_request']}/request, {mongo['errors']} errors): "
+              + ', '.join(f"{k}={v}" for k, v in mongo['ops'].items()))
+
+
+async def _main(args):
+    import httpx
+    timeout = httpx.Timeout(60.0)
+    if args.server == 'uvicorn':
+        port = _free_port()
+        proc = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve', str(port)], cwd=os.getcwd())
+        try:
+            async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=timeout,
+                                         limits=httpx.Limits(max_connections=args.users * 2)) as client:
+                db_kind = 'mongod' if os.getenv("DATABASE_URL") else 'mongomock'
+                return await run(args, client, db_kind)
+        finally:
+            proc.terminate()
+            proc.wait(timeout=30)
+    app, db_kind = _load_app()
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench",
+                                 timeout=timeout) as client:
+        async with app.router.lifespan_context(app):
+            return await run(args, client, db_kind)
+
+
+def cli():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--server', choices=('inprocess', 'uvicorn'), default='inprocess')
+    ap.add_argument('--duration', type=float, default=20.0)
+    ap.add_argument('--users', type=int, default=32, help='concurrent virtual users')
+    ap.add_argument('--mix', default='create=1,generate=2,poll=12,upload=1', help='operation weights')
+    ap.add_argument('--burst', type=int, default=5, help='generate requests fired together per generate op')
+    ap.add_argument('--variants', type=int, default=50, help='distinct generation requests (cache hit rate)')
+    ap.add_argument('--drain', type=float, default=120.0, help='seconds to wait for submitted jobs')
+    ap.add_argument('--seed', type=int, default=1)
+    ap.add_argument('--out', help='write results as JSON to this file')
+    ap.add_argument('--budgets', help='JSON file of absolute limits')
+    ap.add_argument('--baseline', help='earlier results JSON to compare against')
+    ap.add_argument('--tolerance', type=float, default=0.25, help='allowed relative regression vs --baseline')
+    ap.add_argument('--serve', type=int, help=argparse.SUPPRESS)
+    args = ap.parse_args()
+    if args.serve:
+        return serve(args.serve)
+    args.weights = _parse_mix(args.mix)
+    random.seed(args.seed)
+
+    result = asyncio.run(_main(args))
+    report(result)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(result, f, indent=2)
+        print(f"results written to {args.out}")
+
+    failures = []
+    if args.budgets:
+        with open(args.budgets) as f:
+            failures += check_budgets(result, json.load(f))
+    if args.baseline:
+        with open(args.baseline) as f:
+            failures += check_baseline(result, json.load(f), args.tolerance)
+    for failure in failures:
+        print(f"FAIL {failure}")
+    if failures:
+        sys.exit(1)
+    if args.budgets or args.baseline:
+        print("PASS regression gate")
+
+
+if __name__ == '__main__':
+    cli()
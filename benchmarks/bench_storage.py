@@ -0,0 +1,111 @@
+"""
+Asset storage benchmark: content-addressed puts, deduplication and fan-out.
+
+Renders a batch of files the way the mock workers do (identical silence
+stems and guides, plus unique placeholder thumbnails), puts each one into an
+asset store and reports puts/s, how many bytes deduplication saved and the
+largest directory the sharded layout produced. Every stored key is then read
+back through `resolve_url` from a cold cache to check URLs survive the
+backend round trip (s3 only; the local tree is the store itself).
+
+Usage:
+    python benchmarks/bench_storage.py [--backend local|s3] [--files 2000]
+                                       [--unique 0.3] [--depth 2]
+
+--backend s3 needs boto3. It uses ASSET_S3_ENDPOINT_URL/ASSET_S3_BUCKET when
+set (MinIO, a real bucket); otherwise it starts moto's in-process server as
+a local stand-in.
+"""
+
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from render import save_wav_silence, write_placeholder  # noqa: E402
+from storage import LocalAssetStore, S3AssetStore  # noqa: E402
+
+
+def make_store(backend: str, root: str, depth: int):
+    if backend == 'local':
+        return LocalAssetStore(root, depth=depth), None
+    import boto3
+    endpoint = os.getenv("ASSET_S3_ENDPOINT_URL")
+    bucket = os.getenv("ASSET_S3_BUCKET", "bench-assets")
+    server = None
+    if not endpoint:
+        from moto.server import ThreadedMotoServer
+        server = ThreadedMotoServer(port=0)
+        server.start()
+        host, port = server.get_host_and_port()
+        endpoint = f"http://{host}:{port}"
+        os.environ.setdefault("AWS_ACCESS_KEY_ID", "bench")
+        os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "bench")
+        os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    client = boto3.client('s3', endpoint_url=endpoint)
+    if not os.getenv("ASSET_S3_BUCKET"):
+        client.create_bucket(Bucket=bucket)
+    return S3AssetStore(root, bucket=bucket, prefix=f"bench-{int(time.time())}/", client=client, depth=depth), server
+
+
+def largest_dir(root: str) -> int:
+    return max((len(files) + len(dirs) for path, dirs, files in os.walk(root) if '.staging' not in path), default=0)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--backend', choices=('local', 's3'), default='local')
+    ap.add_argument('--files', type=int, default=2000)
+    ap.add_argument('--unique', type=float, default=0.3, help='fraction of renders with unique content')
+    ap.add_argument('--depth', type=int, default=2)
+    args = ap.parse_args()
+
+    root = tempfile.mkdtemp(prefix='bench_storage_')
+    store, server = make_store(args.backend, root, args.depth)
+    rng = random.Random(7)
+    try:
+        urls = []
+        t0 = time.perf_counter()
+        for _ in range(args.files):
+            if rng.random() < args.unique:
+                path = write_placeholder(store.staging_path('thumb.png'), 4096)
+            else:
+                path = save_wav_silence(store.staging_path('stem.wav'), duration_sec=rng.choice((2.0, 6.0)))
+            urls.append(store.put(path)['url'])
+        elapsed = time.perf_counter() - t0
+        s = store.stats()
+        saved = s['bytes_deduplicated'] / max(1, s['bytes_stored'] + s['bytes_deduplicated'])
+        print(f"backend={args.backend} files={args.files} puts/s={args.files / elapsed:.0f}")
+        print(f"distinct objects={len(set(urls))} deduplicated={s['deduplicated']} "
+              f"stored={s['bytes_stored'] / 1e6:.1f}MB saved={100 * saved:.1f}%")
+        print(f"largest directory: {largest_dir(root)} entries (depth {args.depth})")
+
+        if args.backend == 'local':
+            return
+        # Cold read-back: drop the local cache and resolve every URL again from the bucket.
+        for entry in os.listdir(root):
+            if entry != '.staging':
+                shutil.rmtree(os.path.join(root, entry))
+        t0 = time.perf_counter()
+        missing = 0
+        for url in set(urls):
+            try:
+                store.resolve_url(url)
+            except FileNotFoundError:
+                missing += 1
+        print(f"cold resolve: {len(set(urls))} urls in {time.perf_counter() - t0:.2f}s, "
+              f"fetched={store.stats()['fetches']} missing={missing}")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+        if server is not None:
+            server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+"""
+Distributed worker benchmark: leased job execution across several workers.
+
+Submits a burst of jobs through the API in JOB_EXECUTION=distributed mode,
+runs several lease workers against them, hard-kills one worker part way
+through and waits for every job to finish. Reports throughput, per-worker
+counts and how many jobs were reclaimed from the dead worker's expired
+leases.
+
+Usage:
+    python benchmarks/bench_workers.py [--workers 3] [--jobs 30] [--kill-after 1.0]
+
+With DATABASE_URL/DATABASE_NAME set, the workers are real `worker.py`
+processes (the killed one gets SIGKILL). Otherwise everything runs against
+mongomock in one process, each worker with its own lease owner id, which
+exercises the same claim/heartbeat/expiry races.
+"""
+
+import argparse
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+os.environ.setdefault("JOB_EXECUTION", "distributed")
+os.environ.setdefault("JOB_LEASE_SEC", "3")
+os.environ.setdefault("JOB_HEARTBEAT_SEC", "1")
+os.environ.setdefault("JOB_POLL_SEC", "0.1")
+os.environ.setdefault("JOB_RESUME_ON_STARTUP", "false")
+
+import database  # noqa: E402
+
+if not database.configured():
+    import mongomock
+    database.db = mongomock.MongoClient().bench_workers
+    IN_PROCESS = True
+else:
+    IN_PROCESS = False
+
+import httpx  # noqa: E402
+
+import main  # noqa: E402
+from leases import JobLeases, LeaseWorker  # noqa: E402
+
+
+async def _submit(client, project_id: str, n: int):
+    ids = []
+    for _ in range(n):
+        r = await client.post('/api/synthesize/vocal', json={
+            'projectId': project_id, 'voiceProfileId': 'bench', 'lyrics': 'la la', 'melodyUrl': '/assets/x'})
+        r.raise_for_status()
+        ids.append(r.json()['jobId'])
+    return ids
+
+
+def _pending(ids):
+    from bson import ObjectId
+    return database._require_db()['job'].count_documents({'_id': {'$in': [ObjectId(i) for i in ids]},
+                                               'status': {'$nin': ['done', 'error']}})
+
+
+async def run(args):
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://bench") as c:
+        async with main.app.router.lifespan_context(main.app):
+            project_id = (await c.post('/api/projects', json={'name': 'bench'})).json()['projectId']
+
+            workers, procs = [], []
+            if IN_PROCESS:
+                for i in range(args.workers):
+                    leases = JobLeases.from_env(owner=f"bench-worker-{i}")
+                    w = LeaseWorker.from_env(leases, main.run_leased_job, on_exhausted=main.fail_exhausted_job,
+                                             concurrency=args.concurrency)
+                    w.start()
+                    workers.append(w)
+            else:
+                for _ in range(args.workers):
+                    procs.append(subprocess.Popen([sys.executable, os.path.join(ROOT, 'worker.py'),
+                                                   '--concurrency', str(args.concurrency)], cwd=os.getcwd()))
+
+            t0 = time.perf_counter()
+            ids = await _submit(c, project_id, args.jobs)
+            await asyncio.sleep(args.kill_after)
+            # Simulated crash: the worker vanishes without handing its jobs back.
+            if IN_PROCESS:
+                for t in workers[0]._tasks:
+                    t.cancel()
+                await asyncio.gather(*workers[0]._tasks, return_exceptions=True)
+            else:
+                procs[0].send_signal(signal.SIGKILL)
+            while _pending(ids):
+                if time.perf_counter() - t0 > args.timeout:
+                    print(f"TIMEOUT: {_pending(ids)} jobs unfinished")
+                    break
+                await asyncio.sleep(0.1)
+            wall = time.perf_counter() - t0
+
+            from bson import ObjectId
+            docs = list(database._require_db()['job'].find({'_id': {'$in': [ObjectId(i) for i in ids]}},
+                                                {'status': 1, 'attempts': 1, 'runner': 1}))
+            done = sum(1 for d in docs if d['status'] == 'done')
+            retried = sum(1 for d in docs if d.get('attempts', 0) > 1)
+            print(f"jobs={args.jobs} workers={args.workers}x{args.concurrency} "
+                  f"mode={'in-process/mongomock' if IN_PROCESS else 'processes/mongod'}")
+            print(f"done {done}/{len(docs)} in {wall:.2f}s ({done / wall:.1f} jobs/s); "
+                  f"{retried} reclaimed after the kill")
+            by_runner = {}
+            for d in docs:
+                by_runner[d.get('runner')] = by_runner.get(d.get('runner'), 0) + 1
+            for runner, n in sorted(by_runner.items(), key=lambda kv: str(kv[0])):
+                print(f"  finished by {runner}: {n}")
+            for w in workers[1:]:
+                await w.stop()
+            for p in procs[1:]:
+                p.send_signal(signal.SIGTERM)
+                p.wait(timeout=30)
+
+
+def cli():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--workers', type=int, default=3)
+    ap.add_argument('--concurrency', type=int, default=2)
+    ap.add_argument('--jobs', type=int, default=30)
+    ap.add_argument('--kill-after', type=float, default=1.0)
+    ap.add_argument('--timeout', type=float, default=120.0)
+    asyncio.run(run(ap.parse_args()))
+
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,74 @@
+"""
+Job Checkpoints
+
+Every worker records, per completed step, what it produced (asset ids, URLs,
+file paths) under `checkpoint.<step>` on its job document. A job resumed
+after a restart reloads its checkpoint and skips every step that is already
+recorded, so rendered stems are reused instead of regenerated.
+
+Checkpoint writes go straight to Mongo instead of through the write-behind
+job state buffer: a step only counts as done once its record is durable.
+"""
+
+import logging
+import os
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from bson import ObjectId
+
+from database import adb
+from metrics import STEP_SECONDS, step_label
+
+logger = logging.getLogger(__name__)
+
+
+class Checkpoint:
+    """Completed steps of one job: step name -> outputs."""
+
+    def __init__(self, job_id: str, steps: Optional[Dict[str, Dict[str, Any]]] = None, collection: str = 'job'):
+        self.job_id = job_id
+        self.steps: Dict[str, Dict[str, Any]] = dict(steps or {})
+        self.collection = collection
+        self.reused = 0
+
+    @classmethod
+    async def load(cls, job_id: str, collection: str = 'job') -> 'Checkpoint':
+        doc = await adb[collection].find_one({'_id': ObjectId(job_id)}, {'checkpoint': 1})
+        return cls(job_id, (doc or {}).get('checkpoint') or {}, collection)
+
+    def get(self, step: str) -> Optional[Dict[str, Any]]:
+        """Recorded outputs of a step, or None if it has to (re)run.
+
+        A record whose files have disappeared from disk is treated as missing.
+        """
+        outputs = self.steps.get(step)
+        if outputs is None:
+            return None
+        missing = [p for p in outputs.get('paths', []) if not os.path.exists(p)]
+        if missing:
+            logger.warning("Job %s: checkpoint %s lost %d file(s); re-running it", self.job_id, step, len(missing))
+            return None
+        return outputs
+
+    async def save(self, step: str, outputs: Dict[str, Any]) -> Dict[str, Any]:
+        await adb[self.collection].update_one({'_id': ObjectId(self.job_id)}, {'$set': {f'checkpoint.{step}': outputs}})
+        self.steps[step] = outputs
+        return outputs
+
+    async def save_many(self, steps: Dict[str, Dict[str, Any]]):
+        """Record several steps with a single write."""
+        if not steps:
+            return
+        await adb[self.collection].update_one({'_id': ObjectId(self.job_id)},
+                                              {'$set': {f'checkpoint.{s}': o for s, o in steps.items()}})
+        self.steps.update(steps)
+
+    async def step(self, step: str, fn: Callable[[], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+        """Outputs of `step`, running `fn` and recording its result only if not already done."""
+        outputs = self.get(step)
+        if outputs is not None:
+            self.reused += 1
+            return outputs
+        with STEP_SECONDS.time(step=step_label(step)):
+            outputs = await fn()
+        return await self.save(step, outputs)
@@ -3,34 +3,255 @@ Database Helper Functions
 
 MongoDB helper functions ready to use in your backend code.
 Import and use these functions in your API endpoints for database operations.
+
+pymongo is a blocking driver, so async code must never call it directly from
+the event loop. Use `adb` (an awaitable mirror of `db`) or the `a*` helpers,
+which run every round trip on a dedicated, bounded I/O thread pool. The plain
+sync functions remain for scripts such as schema_examples.py.
+
+The client itself is created lazily by `connection` (see dbconn.py), which
+also owns pool timeouts and the circuit breaker that makes `adb` calls fail
+fast with DatabaseUnavailable while Mongo is unreachable. Assigning a
+database object to `db` (mongomock in benchmarks) bypasses the connection.
 """
 
-from pymongo import MongoClient
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
+from bson import ObjectId
+import asyncio
+import base64
+import functools
+import json
 import os
+import time
 from dotenv import load_dotenv
-from typing import Union
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple, Union
 from pydantic import BaseModel
+from pymongo import DeleteMany, UpdateOne
+from dbconn import DatabaseUnavailable, MongoConnection, is_connection_error
+from metrics import DB_ERRORS, DB_SECONDS
 
 # Load environment variables from .env file
 load_dotenv()
 
-_client = None
+# Explicit override; when None the database comes from `connection`.
 db = None
 
-database_url = os.getenv("DATABASE_URL")
-database_name = os.getenv("DATABASE_NAME")
+# Compound indexes the API relies on, created at startup by ensure_indexes().
+# Listings page newest-first on (created_at, _id), so every filter prefix ends in those keys.
+INDEXES: Dict[str, List[List[Tuple[str, int]]]] = {
+    'asset': [
+        [('project_id', 1), ('created_at', -1), ('_id', -1)],
+        [('project_id', 1), ('kind', 1), ('created_at', -1), ('_id', -1)],
+        # Garbage collection: reference checks by URL, TTL sweeps, voice profile cleanup.
+        [('url', 1)],
+        [('retention', 1), ('created_at', 1)],
+        [('voice_profile_id', 1)],
+    ],
+    'job': [
+        [('project_id', 1), ('created_at', -1), ('_id', -1)],
+        [('project_id', 1), ('status', 1), ('created_at', -1), ('_id', -1)],
+        [('status', 1), ('created_at', 1)],
+        # Children of a batch job, in submission order.
+        [('parent_id', 1), ('batch_index', 1)],
+    ],
+    'project': [
+        [('created_at', -1), ('_id', -1)],
+    ],
+    'voiceprofile': [
+        [('files', 1)],
+        [('demo_url', 1)],
+    ],
+}
 
-if database_url and database_name:
-    _client = MongoClient(database_url)
-    db = _client[database_name]
+# Bounded so a Mongo slowdown queues work here instead of exhausting the
+# driver's connection pool or the default executor shared with file I/O.
+DB_IO_THREADS = int(os.getenv("DB_IO_THREADS", "16"))
+_io_executor = ThreadPoolExecutor(max_workers=DB_IO_THREADS, thread_name_prefix="db-io")
+
+# Bulk helpers split larger batches into chunks of this many operations (well below the 100k/16MB
+# the server accepts per batch, so one slow chunk does not hold an I/O thread for long).
+DB_BULK_CHUNK = int(os.getenv("DB_BULK_CHUNK", "1000"))
+
+# At most DB_IO_THREADS operations are ever in flight, so a bigger pool would only hold idle sockets.
+connection = MongoConnection.from_env(default_pool_size=DB_IO_THREADS)
+
+
+def _require_db():
+    """The live database; raises DatabaseUnavailable if none is configured"""
+    if db is not None:
+        return db
+    return connection.database()
+
+
+def configured() -> bool:
+    return db is not None or connection.configured
+
+
+async def run_db(fn, *args, **kwargs):
+    """Run a blocking database call on the I/O pool and await its result"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_io_executor, functools.partial(fn, *args, **kwargs))
+
+
+class AsyncCollection:
+    """Awaitable proxy for a pymongo collection (motor-style method names)
+
+    Every call is timed into the `mongo_op_seconds` histogram by collection and operation,
+    and goes through the connection's circuit breaker.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def _col(self):
+        return _require_db()[self.name]
+
+    async def _timed(self, op: str, fn):
+        breaker = connection.breaker
+        breaker.allow()
+        t0 = time.perf_counter()
+        try:
+            result = await run_db(fn)
+        except DatabaseUnavailable:
+            breaker.release()
+            raise
+        except Exception as e:
+            DB_ERRORS.inc(collection=self.name, op=op)
+            # Any answer from the server, even an error, shows it is reachable.
+            breaker.record(not is_connection_error(e))
+            raise
+        except BaseException:
+            breaker.release()
+            raise
+        finally:
+            DB_SECONDS.observe(time.perf_counter() - t0, collection=self.name, op=op)
+        breaker.record(True)
+        return result
+
+    def _call(self, op: str, *args, **kwargs):
+        return self._timed(op, lambda: getattr(self._col(), op)(*args, **kwargs))
+
+    async def find_one(self, *args, **kwargs):
+        return await self._call('find_one', *args, **kwargs)
+
+    async def find(self, filter_dict: dict = None, projection: dict = None, sort=None, limit: int = 0) -> List[dict]:
+        def _find():
+            cursor = self._col().find(filter_dict or {}, projection)
+            if sort:
+                cursor = cursor.sort(sort)
+            if limit:
+                cursor = cursor.limit(limit)
+            return list(cursor)
+        return await self._timed('find', _find)
+
+    async def insert_one(self, *args, **kwargs):
+        return await self._call('insert_one', *args, **kwargs)
+
+    async def insert_many(self, *args, **kwargs):
+        return await self._call('insert_many', *args, **kwargs)
+
+    async def update_one(self, *args, **kwargs):
+        return await self._call('update_one', *args, **kwargs)
+
+    async def update_many(self, *args, **kwargs):
+        return await self._call('update_many', *args, **kwargs)
+
+    async def bulk_write(self, *args, **kwargs):
+        return await self._call('bulk_write', *args, **kwargs)
+
+    async def find_one_and_update(self, *args, **kwargs):
+        return await self._call('find_one_and_update', *args, **kwargs)
+
+    async def delete_one(self, *args, **kwargs):
+        return await self._call('delete_one', *args, **kwargs)
+
+    async def delete_many(self, *args, **kwargs):
+        return await self._call('delete_many', *args, **kwargs)
+
+    async def aggregate(self, pipeline: List[dict], **kwargs) -> List[dict]:
+        return await self._timed('aggregate', lambda: list(self._col().aggregate(pipeline, **kwargs)))
+
+    async def count_documents(self, *args, **kwargs):
+        return await self._call('count_documents', *args, **kwargs)
+
+    async def create_index(self, *args, **kwargs):
+        return await self._call('create_index', *args, **kwargs)
+
+
+class AsyncDatabase:
+    """Awaitable mirror of `db`; resolves the live database on every call"""
+
+    def __getitem__(self, name: str) -> AsyncCollection:
+        return AsyncCollection(name)
+
+    def __getattr__(self, name: str) -> AsyncCollection:
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return AsyncCollection(name)
+
+
+adb = AsyncDatabase()
+
+def ensure_indexes():
+    """Create every index in INDEXES (a no-op for indexes that already exist)"""
+    database = _require_db()
+    for collection_name, indexes in INDEXES.items():
+        for keys in indexes:
+            database[collection_name].create_index(keys)
+
+
+async def aensure_indexes():
+    await run_db(ensure_indexes)
 
-# Helper functions for common database operations
-def create_document(collection_name: str, data: Union[BaseModel, dict]):
-    """Insert a single document with timestamp"""
-    if db is None:
-        raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
 
+async def aprobe():
+    """Cached database health: {'ok', 'latency_ms' or 'error', 'circuit'}"""
+    return await connection.probe(lambda: run_db(lambda: _require_db().command('ping')))
+
+
+async def acollection_names() -> List[str]:
+    return await connection.collection_names(lambda: run_db(lambda: _require_db().list_collection_names()))
+
+
+# Keyset pagination: the cursor is the (created_at, _id) of the last item returned.
+PAGE_SORT = [('created_at', -1), ('_id', -1)]
+
+
+def encode_cursor(doc: dict) -> str:
+    raw = json.dumps({'t': doc['created_at'].isoformat(), 'id': str(doc['_id'])})
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, ObjectId]:
+    """Raises ValueError for anything that is not a cursor we issued"""
+    try:
+        raw = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        return datetime.fromisoformat(raw['t']), ObjectId(raw['id'])
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+async def apaginate(collection_name: str, filter_dict: dict, projection: Optional[dict] = None,
+                    limit: int = 50, cursor: Optional[str] = None) -> Tuple[List[dict], Optional[str]]:
+    """One page of documents, newest first, and the cursor for the next page (None on the last)"""
+    query: Dict[str, Any] = dict(filter_dict)
+    if cursor:
+        created_at, last_id = decode_cursor(cursor)
+        after = [
+            {'created_at': {'$lt': created_at}},
+            {'created_at': created_at, '_id': {'$lt': last_id}},
+        ]
+        query = {'$and': [query, {'$or': after}]} if '$or' in query else {**query, '$or': after}
+    if projection and all(projection.values()):
+        projection = {**projection, 'created_at': 1}  # the cursor is built from it
+    docs = await adb[collection_name].find(query, projection, sort=PAGE_SORT, limit=limit + 1)
+    next_cursor = encode_cursor(docs[limit - 1]) if len(docs) > limit else None
+    return docs[:limit], next_cursor
+
+
+# Helper functions for common database operations
+def _timestamped(data: Union[BaseModel, dict]) -> dict:
     # Convert Pydantic model to dict if needed
     if isinstance(data, BaseModel):
         data_dict = data.model_dump()
@@ -39,17 +260,113 @@ def create_document(collection_name: str, data: Union[BaseModel, dict]):
 
     data_dict['created_at'] = datetime.now(timezone.utc)
     data_dict['updated_at'] = datetime.now(timezone.utc)
+    return data_dict
+
 
-    result = db[collection_name].insert_one(data_dict)
+def create_document(collection_name: str, data: Union[BaseModel, dict]):
+    """Insert a single document with timestamp"""
+    result = _require_db()[collection_name].insert_one(_timestamped(data))
     return str(result.inserted_id)
 
+def create_documents(collection_name: str, items: Sequence[Union[BaseModel, dict]],
+                     chunk_size: int = 0) -> List[str]:
+    """Insert many documents with timestamps (unordered insert_many per chunk); returns their ids in order"""
+    docs = [_timestamped(d) for d in items]
+    database = _require_db()
+    for chunk in _chunks(docs, chunk_size):
+        database[collection_name].insert_many(chunk, ordered=False)
+    return [str(d['_id']) for d in docs]
+
+
+def update_document(collection_name: str, filter_dict: dict, updates: dict, upsert: bool = False) -> int:
+    """$set `updates` (and updated_at) on the first matching document; returns the number of
+    documents matched or upserted (0 means nothing matched and nothing was created)"""
+    result = _require_db()[collection_name].update_one(
+        filter_dict, {'$set': {**updates, 'updated_at': datetime.now(timezone.utc)}}, upsert=upsert)
+    return result.matched_count + (1 if result.upserted_id is not None else 0)
+
+
+def delete_document(collection_name: str, filter_dict: dict) -> int:
+    """Delete the first matching document; returns the deleted count"""
+    return _require_db()[collection_name].delete_one(filter_dict).deleted_count
+
+
 def get_documents(collection_name: str, filter_dict: dict = None, limit: int = None):
     """Get documents from collection"""
-    if db is None:
-        raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
-    
-    cursor = db[collection_name].find(filter_dict or {})
+    cursor = _require_db()[collection_name].find(filter_dict or {})
     if limit:
         cursor = cursor.limit(limit)
     
     return list(cursor)
+
+
+# Async counterparts for use inside request handlers and job workers
+async def acreate_document(collection_name: str, data: Union[BaseModel, dict]) -> str:
+    """Insert a single document with timestamp without blocking the event loop"""
+    result = await adb[collection_name].insert_one(_timestamped(data))
+    return str(result.inserted_id)
+
+
+async def aget_documents(collection_name: str, filter_dict: dict = None, limit: int = None) -> List[dict]:
+    """Get documents from collection without blocking the event loop"""
+    return await adb[collection_name].find(filter_dict, limit=limit or 0)
+
+
+# Bulk counterparts: one round trip per DB_BULK_CHUNK operations, unordered so one bad
+# document does not stop the rest (pymongo's BulkWriteError still reports it).
+def _chunks(items: Sequence[Any], size: int = 0) -> Iterable[Sequence[Any]]:
+    size = size or DB_BULK_CHUNK
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+async def ainsert_many(collection_name: str, docs: Sequence[dict], chunk_size: int = 0) -> List[str]:
+    """Insert documents as given; returns their ids in order"""
+    for chunk in _chunks(docs, chunk_size):
+        await adb[collection_name].insert_many(list(chunk), ordered=False)
+    return [str(d['_id']) for d in docs]
+
+
+async def acreate_documents(collection_name: str, items: Sequence[Union[BaseModel, dict]],
+                            chunk_size: int = 0) -> List[str]:
+    """Insert many documents with timestamps; returns their ids in order"""
+    return await ainsert_many(collection_name, [_timestamped(d) for d in items], chunk_size)
+
+
+async def abulk_write(collection_name: str, ops: Sequence[Any], chunk_size: int = 0) -> Dict[str, int]:
+    """Run pymongo write models in unordered chunks; returns the summed counts"""
+    totals = {'matched': 0, 'modified': 0, 'upserted': 0, 'deleted': 0}
+    for chunk in _chunks(ops, chunk_size):
+        result = await adb[collection_name].bulk_write(list(chunk), ordered=False)
+        totals['matched'] += result.matched_count
+        totals['modified'] += result.modified_count
+        totals['upserted'] += result.upserted_count
+        totals['deleted'] += result.deleted_count
+    return totals
+
+
+async def abulk_upsert(collection_name: str, docs: Sequence[dict], key: Sequence[str] = ('_id',),
+                       chunk_size: int = 0) -> Dict[str, int]:
+    """Insert or update each document, matched on its `key` fields; created_at is only set on insert"""
+    now = datetime.now(timezone.utc)
+    ops = []
+    for doc in docs:
+        match = {k: doc[k] for k in key}
+        fields = {k: v for k, v in doc.items() if k not in match and k != 'created_at'}
+        ops.append(UpdateOne(match, {'$set': {**fields, 'updated_at': now},
+                                     '$setOnInsert': {'created_at': doc.get('created_at', now)}}, upsert=True))
+    return await abulk_write(collection_name, ops, chunk_size)
+
+
+async def abatch_update(collection_name: str, updates: Iterable[Tuple[dict, dict]],
+                        chunk_size: int = 0) -> Dict[str, int]:
+    """Apply (filter, update document) pairs, each to the first match, in bulk"""
+    return await abulk_write(collection_name, [UpdateOne(f, u) for f, u in updates], chunk_size)
+
+
+async def adelete_documents(collection_name: str, ids: Sequence[Union[str, ObjectId]],
+                            chunk_size: int = 0) -> int:
+    """Delete documents by id, in chunks of `$in` lists; returns the deleted count"""
+    oids = [ObjectId(i) if isinstance(i, str) else i for i in ids]
+    ops = [DeleteMany({'_id': {'$in': list(chunk)}}) for chunk in _chunks(oids, chunk_size)]
+    return (await abulk_write(collection_name, ops, chunk_size=len(ops) or 1))['deleted']
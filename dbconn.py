@@ -0,0 +1,243 @@
+"""
+MongoDB Connection Management
+
+Owns the `MongoClient` behind database.py:
+
+    lazy init        the client is built on first use, not at import, so
+                     the app starts fast and scripts that never touch the
+                     database never connect (or resolve mongodb+srv DNS)
+    pool tuning      pool size, wait-queue, connect/socket and server
+                     selection timeouts are configurable; the defaults
+                     fail in seconds instead of the driver's 30s selection
+                     timeout and unbounded socket reads
+    probe            a ping cached for DB_PROBE_TTL_SEC, shared by
+                     concurrent callers, for liveness/readiness checks
+    circuit breaker  after DB_BREAKER_FAILURES consecutive connection
+                     errors, calls fail immediately with DatabaseUnavailable
+                     (served as 503) for DB_BREAKER_COOLDOWN_SEC; then one
+                     trial call is let through and its outcome closes or
+                     reopens the breaker
+
+Only connection-level errors (timeouts, unreachable servers, pool
+exhaustion) count towards the breaker; a duplicate key or a bad query says
+nothing about the database's health.
+
+Configuration (environment):
+    DATABASE_URL / DATABASE_NAME        connection string and database
+    DB_MAX_POOL_SIZE                    connections per server (default DB_IO_THREADS)
+    DB_MIN_POOL_SIZE                    connections kept open (default 0)
+    DB_WAIT_QUEUE_TIMEOUT_MS            wait for a free pooled connection (default 2000)
+    DB_CONNECT_TIMEOUT_MS               TCP connect timeout (default 3000)
+    DB_SOCKET_TIMEOUT_MS                per-operation socket read timeout (default 20000)
+    DB_SERVER_SELECTION_TIMEOUT_MS      wait for a usable server (default 3000)
+    DB_MAX_IDLE_TIME_MS                 close pooled connections idle this long (default 300000)
+    DB_BREAKER_FAILURES                 consecutive failures that open the breaker (default 5)
+    DB_BREAKER_COOLDOWN_SEC             how long it stays open (default 10)
+    DB_PROBE_TTL_SEC                    probe result lifetime (default 5)
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class DatabaseUnavailable(Exception):
+    """The database is not configured, or the circuit breaker is open."""
+
+    def __init__(self, message: str, retry_after: float = 0.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def is_connection_error(exc: BaseException) -> bool:
+    try:
+        from pymongo.errors import ConnectionFailure
+    except ImportError:
+        return False
+    # ConnectionFailure covers AutoReconnect, NetworkTimeout, ServerSelectionTimeoutError and
+    # WaitQueueTimeoutError (pool exhausted).
+    return isinstance(exc, ConnectionFailure)
+
+
+class CircuitBreaker:
+    """closed -> open after `failures` consecutive errors -> half-open after `cooldown_sec` -> closed."""
+
+    def __init__(self, failures: int = 5, cooldown_sec: float = 10.0):
+        self.failures = max(1, failures)
+        self.cooldown_sec = cooldown_sec
+        self._lock = threading.Lock()
+        self._consecutive = 0
+        self._opened_at: Optional[float] = None
+        self._trial = False
+        self.opened = 0
+        self.rejected = 0
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return 'closed'
+        return 'half-open' if time.monotonic() - self._opened_at >= self.cooldown_sec else 'open'
+
+    def allow(self):
+        """Raise DatabaseUnavailable unless a call may go through now."""
+        with self._lock:
+            if self._opened_at is None:
+                return
+            remaining = self.cooldown_sec - (time.monotonic() - self._opened_at)
+            if remaining <= 0 and not self._trial:
+                self._trial = True  # half-open: this caller probes the database
+                return
+            self.rejected += 1
+        raise DatabaseUnavailable("Database unavailable (circuit open)", retry_after=max(1.0, remaining))
+
+    def record(self, ok: bool):
+        with self._lock:
+            if ok:
+                if self._opened_at is not None:
+                    logger.warning("Database circuit closed")
+                self._consecutive = 0
+                self._opened_at = None
+                self._trial = False
+                return
+            self._consecutive += 1
+            if self._trial or (self._opened_at is None and self._consecutive >= self.failures):
+                if self._opened_at is None:
+                    self.opened += 1
+                    logger.warning("Database circuit opened after %d consecutive failures", self._consecutive)
+                self._opened_at = time.monotonic()
+                self._trial = False
+
+    def release(self):
+        """A trial call ended without telling us anything (e.g. a query error); let another one try."""
+        with self._lock:
+            self._trial = False
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'state': self.state,
+            'consecutive_failures': self._consecutive,
+            'opened': self.opened,
+            'rejected': self.rejected,
+        }
+
+
+class MongoConnection:
+    """Lazily created MongoClient with tuned pool settings, a cached probe and a circuit breaker."""
+
+    def __init__(self, url: Optional[str], name: Optional[str], client_options: Optional[Dict[str, Any]] = None,
+                 breaker: Optional[CircuitBreaker] = None, probe_ttl_sec: float = 5.0):
+        self.url = url
+        self.name = name
+        self.client_options = dict(client_options or {})
+        self.breaker = breaker or CircuitBreaker()
+        self.probe_ttl_sec = probe_ttl_sec
+        self._client = None
+        self._db = None
+        self._lock = threading.Lock()
+        self._probe: Optional[Dict[str, Any]] = None
+        self._probe_at = 0.0
+        self._probing: Optional[asyncio.Future] = None
+        self._collections: Optional[List[str]] = None
+        self._collections_at = 0.0
+
+    @classmethod
+    def from_env(cls, default_pool_size: int = 100) -> 'MongoConnection':
+        options = {
+            'maxPoolSize': int(os.getenv("DB_MAX_POOL_SIZE", str(default_pool_size))),
+            'minPoolSize': int(os.getenv("DB_MIN_POOL_SIZE", "0")),
+            'waitQueueTimeoutMS': int(os.getenv("DB_WAIT_QUEUE_TIMEOUT_MS", "2000")),
+            'connectTimeoutMS': int(os.getenv("DB_CONNECT_TIMEOUT_MS", "3000")),
+            'socketTimeoutMS': int(os.getenv("DB_SOCKET_TIMEOUT_MS", "20000")),
+            'serverSelectionTimeoutMS': int(os.getenv("DB_SERVER_SELECTION_TIMEOUT_MS", "3000")),
+            'maxIdleTimeMS': int(os.getenv("DB_MAX_IDLE_TIME_MS", "300000")),
+        }
+        return cls(
+            os.getenv("DATABASE_URL"),
+            os.getenv("DATABASE_NAME"),
+            client_options=options,
+            breaker=CircuitBreaker(int(os.getenv("DB_BREAKER_FAILURES", "5")),
+                                   float(os.getenv("DB_BREAKER_COOLDOWN_SEC", "10"))),
+            probe_ttl_sec=float(os.getenv("DB_PROBE_TTL_SEC", "5")),
+        )
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.url and self.name)
+
+    def database(self):
+        """The pymongo Database, creating the client on first use; raises DatabaseUnavailable if unconfigured."""
+        if self._db is not None:
+            return self._db
+        if not self.configured:
+            raise DatabaseUnavailable(
+                "Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
+        with self._lock:
+            if self._db is None:
+                from pymongo import MongoClient
+                # connect=False: the first operation connects, so building the client never blocks.
+                self._client = MongoClient(self.url, connect=False, **self.client_options)
+                self._db = self._client[self.name]
+        return self._db
+
+    def close(self):
+        with self._lock:
+            if self._client is not None:
+                self._client.close()
+            self._client = None
+            self._db = None
+
+    # ---- health ----
+
+    async def probe(self, ping: Callable[[], Awaitable[Any]]) -> Dict[str, Any]:
+        """Result of `ping()`, cached for probe_ttl_sec and shared by concurrent callers."""
+        now = time.monotonic()
+        if self._probe is not None and now - self._probe_at < self.probe_ttl_sec:
+            return self._probe
+        pending = self._probing
+        if pending is not None:
+            try:
+                return await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                if not pending.cancelled():
+                    raise
+                return await self.probe(ping)  # the probing caller went away; probe ourselves
+        pending = self._probing = asyncio.get_running_loop().create_future()
+        t0 = time.perf_counter()
+        try:
+            await ping()
+            result = {'ok': True, 'latency_ms': round((time.perf_counter() - t0) * 1000, 1)}
+            self.breaker.record(True)
+        except asyncio.CancelledError:
+            pending.cancel()
+            raise
+        except Exception as e:
+            if is_connection_error(e):
+                self.breaker.record(False)
+            result = {'ok': False, 'error': f"{type(e).__name__}: {str(e)[:200]}"}
+        finally:
+            self._probing = None
+        result['circuit'] = self.breaker.state
+        self._probe, self._probe_at = result, time.monotonic()
+        pending.set_result(result)
+        return result
+
+    async def collection_names(self, load: Callable[[], Awaitable[List[str]]]) -> List[str]:
+        """`load()`'s collection names, cached like the probe (for diagnostics pages)."""
+        if self._collections is None or time.monotonic() - self._collections_at >= self.probe_ttl_sec:
+            self._collections = await load()
+            self._collections_at = time.monotonic()
+        return self._collections
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'configured': self.configured,
+            'connected': self._client is not None,
+            'pool': dict(self.client_options),
+            'breaker': self.breaker.stats(),
+            'probe': self._probe,
+        }
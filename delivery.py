@@ -0,0 +1,299 @@
+"""
+Asset Delivery
+
+ASGI app serving rendered assets (mounted at /assets) with the parts of HTTP
+that players and browsers rely on, which the plain StaticFiles mount lacks:
+
+    Range       single `bytes=` ranges answered with 206 + Content-Range, so
+                WAV/MP4 players can seek without downloading the whole file
+                (unsatisfiable ranges get 416; If-Range is honoured)
+    ETag        strong validator derived from the file's SHA-256: read from
+                the name of content-addressed files (see storage.py), else
+                computed once per (inode, size, mtime) and kept in an LRU
+    304         If-None-Match / If-Modified-Since revalidation
+    caching     asset files are uuid/content named and never rewritten, so
+                they are sent with a long `immutable` Cache-Control
+
+Dot-prefixed paths (the render staging directory) are never served. With
+a `fetch` hook, files missing locally are materialized through it first,
+which is how the S3 backend fills its local cache on demand.
+
+Bodies are sent zero-copy when the server offers it: the ASGI
+`http.response.pathsend` extension for whole files and
+`http.response.zerocopy` (sendfile) for ranges. Otherwise they are streamed
+with positioned reads on a thread, one chunk at a time.
+
+Configuration (environment):
+    ASSET_CACHE_MAX_AGE_SEC      Cache-Control max-age (default 31536000)
+    ASSET_CHUNK_BYTES            streaming read size (default 262144)
+    ASSET_SENDFILE_MIN_BYTES     smallest body sent via zerocopy (default 65536)
+    ASSET_DIGEST_CACHE_ENTRIES   file digests kept in memory (default 50000)
+"""
+
+import asyncio
+import hashlib
+import logging
+import mimetypes
+import os
+import re
+import stat
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+logger = logging.getLogger(__name__)
+
+_HASH_CHUNK = 1 << 20
+# mimetypes maps .wav to audio/x-wav; browsers and players expect these.
+_CONTENT_ADDRESSED = re.compile(r'^([0-9a-f]{64})((?:\.[A-Za-z0-9]{1,5})*)$')
+_CONTENT_TYPES = {'.wav': 'audio/wav', '.mp4': 'video/mp4', '.mid': 'audio/midi', '.midi': 'audio/midi'}
+
+
+def file_digest(path: str) -> str:
+    """Hex SHA-256 of a file's contents."""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(_HASH_CHUNK)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def content_type(path: str) -> str:
+    ext = os.path.splitext(path)[1].lower()
+    return _CONTENT_TYPES.get(ext) or mimetypes.guess_type(path)[0] or 'application/octet-stream'
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """(start, end) inclusive for a single `bytes=` range.
+
+    Returns None when the header should be ignored (malformed, another
+    unit, or several ranges: the full file is sent instead) and raises
+    ValueError when the range cannot be satisfied.
+    """
+    unit, _, spec = header.partition('=')
+    if unit.strip().lower() != 'bytes' or ',' in spec:
+        return None
+    first, sep, last = spec.strip().partition('-')
+    if not sep or not (first.isdigit() or first == '') or not (last.isdigit() or last == ''):
+        return None
+    if first == '':
+        if last == '':
+            return None
+        suffix = int(last)
+        if suffix == 0 or size == 0:
+            raise ValueError("Empty suffix range")
+        return max(0, size - suffix), size - 1
+    start = int(first)
+    end = int(last) if last != '' else size - 1
+    if start >= size:
+        raise ValueError("Range starts past the end of the file")
+    if end < start:
+        return None
+    return start, min(end, size - 1)
+
+
+def _etag_matches(header: str, etag: str, weak: bool) -> bool:
+    for tag in header.split(','):
+        tag = tag.strip()
+        if tag == '*':
+            return True
+        if weak and tag.startswith('W/'):
+            tag = tag[2:]
+        if tag == etag:
+            return True
+    return False
+
+
+class AssetFiles:
+    """Serves files below `directory`; mount it in place of StaticFiles."""
+
+    def __init__(self, directory: str, max_age: int = 31536000, chunk_size: int = 256 * 1024,
+                 sendfile_min_bytes: int = 64 * 1024, digest_cache_entries: int = 50000,
+                 fetch: Optional[Callable[[str], str]] = None):
+        self.directory = os.path.realpath(directory)
+        self.fetch = fetch
+        self.max_age = max_age
+        self.chunk_size = max(4096, chunk_size)
+        self.sendfile_min_bytes = sendfile_min_bytes
+        self.digest_cache_entries = digest_cache_entries
+        # path -> ((inode, size, mtime_ns), etag)
+        self._digests: 'OrderedDict[str, Tuple[Tuple[int, int, int], str]]' = OrderedDict()
+        self._hashing: Dict[str, asyncio.Future] = {}
+        self.counters = {'200': 0, '206': 0, '304': 0, '404': 0, '416': 0, 'zerocopy': 0,
+                         'bytes_sent': 0, 'digests_computed': 0}
+
+    @classmethod
+    def from_env(cls, directory: str, **kwargs) -> 'AssetFiles':
+        return cls(
+            directory,
+            max_age=int(os.getenv("ASSET_CACHE_MAX_AGE_SEC", "31536000")),
+            chunk_size=int(os.getenv("ASSET_CHUNK_BYTES", str(256 * 1024))),
+            sendfile_min_bytes=int(os.getenv("ASSET_SENDFILE_MIN_BYTES", str(64 * 1024))),
+            digest_cache_entries=int(os.getenv("ASSET_DIGEST_CACHE_ENTRIES", "50000")),
+            **kwargs,
+        )
+
+    # ---------- lookup ----------
+
+    def _resolve(self, rel: str) -> Optional[Tuple[str, os.stat_result]]:
+        rel = os.path.normpath(rel.lstrip('/'))
+        if rel in ('', '.') or os.path.isabs(rel) or any(p.startswith('.') for p in rel.split(os.sep)):
+            return None
+        path = os.path.realpath(os.path.join(self.directory, rel))
+        if not path.startswith(self.directory + os.sep):
+            return None
+        try:
+            st = os.stat(path)
+        except (FileNotFoundError, NotADirectoryError, PermissionError):
+            if self.fetch is None:
+                return None
+            try:
+                path = self.fetch(rel.replace(os.sep, '/'))
+                st = os.stat(path)
+            except (FileNotFoundError, ValueError):
+                return None
+        if not stat.S_ISREG(st.st_mode):
+            return None
+        return path, st
+
+    async def etag(self, path: str, st: os.stat_result) -> str:
+        """Strong ETag for the file's current contents (hashed at most once per version)."""
+        named = _CONTENT_ADDRESSED.match(os.path.basename(path))
+        if named:
+            return f'"{named.group(1)[:32]}"'
+        key = (st.st_ino, st.st_size, st.st_mtime_ns)
+        hit = self._digests.get(path)
+        if hit is not None and hit[0] == key:
+            self._digests.move_to_end(path)
+            return hit[1]
+        pending = self._hashing.get(path)
+        if pending is None:
+            pending = asyncio.ensure_future(run_in_threadpool(file_digest, path))
+            self._hashing[path] = pending
+            try:
+                digest = await asyncio.shield(pending)
+            finally:
+                self._hashing.pop(path, None)
+            self.counters['digests_computed'] += 1
+            etag = f'"{digest[:32]}"'
+            self._digests[path] = (key, etag)
+            self._digests.move_to_end(path)
+            while len(self._digests) > self.digest_cache_entries:
+                self._digests.popitem(last=False)
+            return etag
+        return f'"{(await asyncio.shield(pending))[:32]}"'
+
+    # ---------- ASGI ----------
+
+    async def __call__(self, scope, receive, send):
+        assert scope['type'] == 'http'
+        method = scope['method']
+        if method not in ('GET', 'HEAD'):
+            await self._plain(send, 405, b'Method Not Allowed', [(b'allow', b'GET, HEAD')])
+            return
+        found = await run_in_threadpool(self._resolve, scope['path'])
+        if found is None:
+            self.counters['404'] += 1
+            await self._plain(send, 404, b'Not Found')
+            return
+        path, st = found
+        req = {k.decode('latin-1').lower(): v.decode('latin-1') for k, v in scope.get('headers', [])}
+        etag = await self.etag(path, st)
+        last_modified = formatdate(st.st_mtime, usegmt=True)
+        headers = [
+            (b'etag', etag.encode()),
+            (b'last-modified', last_modified.encode()),
+            (b'cache-control', f'public, max-age={self.max_age}, immutable'.encode()),
+            (b'accept-ranges', b'bytes'),
+        ]
+
+        if self._not_modified(req, etag, st):
+            self.counters['304'] += 1
+            await send({'type': 'http.response.start', 'status': 304, 'headers': headers})
+            await send({'type': 'http.response.body', 'body': b''})
+            return
+
+        size = st.st_size
+        start, end, status = 0, size - 1, 200
+        if 'range' in req and self._if_range_ok(req.get('if-range'), etag, last_modified):
+            try:
+                rng = parse_range(req['range'], size)
+            except ValueError:
+                self.counters['416'] += 1
+                await self._plain(send, 416, b'', [(b'content-range', f'bytes */{size}'.encode())] + headers)
+                return
+            if rng is not None:
+                start, end = rng
+                status = 206
+                headers.append((b'content-range', f'bytes {start}-{end}/{size}'.encode()))
+        length = end - start + 1 if size else 0
+        headers += [(b'content-type', content_type(path).encode()), (b'content-length', str(length).encode())]
+        self.counters[str(status)] += 1
+
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        if method == 'HEAD' or length == 0:
+            await send({'type': 'http.response.body', 'body': b''})
+            return
+        await self._send_body(scope, send, path, start, length, size)
+        self.counters['bytes_sent'] += length
+
+    def _not_modified(self, req: Dict[str, str], etag: str, st: os.stat_result) -> bool:
+        inm = req.get('if-none-match')
+        if inm is not None:
+            return _etag_matches(inm, etag, weak=True)
+        ims = req.get('if-modified-since')
+        if ims:
+            try:
+                return int(st.st_mtime) <= parsedate_to_datetime(ims).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    @staticmethod
+    def _if_range_ok(if_range: Optional[str], etag: str, last_modified: str) -> bool:
+        if if_range is None:
+            return True
+        if_range = if_range.strip()
+        if if_range.startswith('"') or if_range.startswith('W/'):
+            return if_range == etag
+        return if_range == last_modified
+
+    async def _send_body(self, scope, send, path: str, start: int, length: int, size: int):
+        extensions = scope.get('extensions') or {}
+        if 'http.response.pathsend' in extensions and length == size:
+            self.counters['zerocopy'] += 1
+            await send({'type': 'http.response.pathsend', 'path': path})
+            return
+        if 'http.response.zerocopy' in extensions and length >= self.sendfile_min_bytes:
+            self.counters['zerocopy'] += 1
+            with open(path, 'rb') as f:
+                await send({'type': 'http.response.zerocopy', 'file': f, 'offset': start, 'count': length,
+                            'more_body': False})
+            return
+        fd = await run_in_threadpool(os.open, path, os.O_RDONLY)
+        try:
+            pos, remaining = start, length
+            while remaining > 0:
+                chunk = await run_in_threadpool(os.pread, fd, min(self.chunk_size, remaining), pos)
+                if not chunk:
+                    raise IOError(f"{path} shrank while being sent")
+                pos += len(chunk)
+                remaining -= len(chunk)
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': remaining > 0})
+        finally:
+            os.close(fd)
+
+    @staticmethod
+    async def _plain(send, status: int, body: bytes, headers: Optional[List[Tuple[bytes, bytes]]] = None):
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': [(b'content-type', b'text/plain; charset=utf-8'),
+                                (b'content-length', str(len(body)).encode())] + (headers or [])})
+        await send({'type': 'http.response.body', 'body': body})
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.counters, 'digests_cached': len(self._digests), 'hashing': len(self._hashing)}
@@ -0,0 +1,307 @@
+"""
+Document Cache
+
+Bounded in-process read-through cache for hot single-document reads (job
+status polls, project lookups).
+
+    read-through    a miss loads the document once, however many requests
+                    ask for it at the same time
+    write-through   job_update/job_append_log apply their changes to the
+                    cached copy, so the process running a job always serves
+                    its current state from memory
+    TTL + LRU       entries expire after DOC_CACHE_TTL_SEC (terminal jobs
+                    after DOC_CACHE_TERMINAL_TTL_SEC, since they no longer
+                    change); the least recently used are evicted beyond
+                    DOC_CACHE_MAX_ENTRIES or DOC_CACHE_MAX_MB
+
+Other processes learn about writes through the capped `cache_invalidation`
+collection: every process publishes the ids it wrote (one document per job
+state flush) and polls for the ids written elsewhere, evicting them. A load
+that overlaps a write of the same document is returned but not cached.
+
+Configuration (environment):
+    DOC_CACHE_MAX_ENTRIES              cached documents (default 10000)
+    DOC_CACHE_MAX_MB                   approximate BSON size of all entries (default 64)
+    DOC_CACHE_TTL_SEC                  lifetime of entries (default 2)
+    DOC_CACHE_TERMINAL_TTL_SEC         lifetime of done/error jobs (default 300)
+    DOC_CACHE_PROJECT_TTL_SEC          lifetime of projects (default 60)
+    DOC_CACHE_INVALIDATION_POLL_SEC    cross-process invalidation poll; 0 disables (default 0.5)
+"""
+
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+import bson
+from pymongo.errors import OperationFailure
+
+import database
+from database import adb
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATUSES = ('done', 'error')
+
+Key = Tuple[str, str]
+
+
+def _size(value: Any) -> int:
+    try:
+        return len(bson.encode({'v': value}))
+    except Exception:
+        return 64
+
+
+class _Entry:
+    __slots__ = ('doc', 'expires', 'size')
+
+    def __init__(self, doc: Dict[str, Any], expires: float, size: int):
+        self.doc = doc
+        self.expires = expires
+        self.size = size
+
+
+class DocumentCache:
+    """LRU + TTL cache of documents keyed by (collection, id)."""
+
+    def __init__(self, origin: str, max_entries: int = 10000, max_bytes: int = 64 << 20, ttl_sec: float = 2.0,
+                 terminal_ttl_sec: float = 300.0, collection_ttls: Optional[Dict[str, float]] = None,
+                 poll_sec: float = 0.5, collection: str = 'cache_invalidation'):
+        self.origin = origin
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_sec = ttl_sec
+        self.terminal_ttl_sec = terminal_ttl_sec
+        self.collection_ttls = dict(collection_ttls or {})
+        self.poll_sec = poll_sec
+        self.collection = collection
+        self._entries: 'OrderedDict[Key, _Entry]' = OrderedDict()
+        self._loading: Dict[Key, asyncio.Future] = {}
+        self._versions: Dict[Key, int] = {}
+        self._seen: Dict[Any, float] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations_local = 0
+        self.invalidations_remote = 0
+        self.broadcasts = 0
+        self.broadcast_errors = 0
+
+    @classmethod
+    def from_env(cls, origin: str, **kwargs) -> 'DocumentCache':
+        return cls(
+            origin,
+            max_entries=int(os.getenv("DOC_CACHE_MAX_ENTRIES", "10000")),
+            max_bytes=int(float(os.getenv("DOC_CACHE_MAX_MB", "64")) * (1 << 20)),
+            ttl_sec=float(os.getenv("DOC_CACHE_TTL_SEC", "2")),
+            terminal_ttl_sec=float(os.getenv("DOC_CACHE_TERMINAL_TTL_SEC", "300")),
+            collection_ttls={'project': float(os.getenv("DOC_CACHE_PROJECT_TTL_SEC", "60"))},
+            poll_sec=float(os.getenv("DOC_CACHE_INVALIDATION_POLL_SEC", "0.5")),
+            **kwargs,
+        )
+
+    # ---- lifecycle ----
+
+    def start(self):
+        if self.poll_sec > 0 and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._poll(), name="doccache-invalidations")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def ensure_collection(self, size_bytes: int = 8 << 20, ttl_sec: int = 3600):
+        """Create the capped invalidation collection; servers without capped collections
+        (DocumentDB, mongomock) get a plain one whose entries expire after `ttl_sec`."""
+        def create():
+            db = database._require_db()
+            capped = True
+            if self.collection not in db.list_collection_names():
+                try:
+                    db.create_collection(self.collection, capped=True, size=size_bytes)
+                except (NotImplementedError, OperationFailure) as e:
+                    logger.warning("Capped collections unavailable (%s); %s entries expire by TTL instead",
+                                   e, self.collection)
+                    capped = False
+            if 'ts_1' not in db[self.collection].index_information():
+                db[self.collection].create_index('ts', **({} if capped else {'expireAfterSeconds': ttl_sec}))
+        await database.run_db(create)
+
+    # ---- reads ----
+
+    def _ttl(self, collection: str, doc: Dict[str, Any]) -> float:
+        if doc.get('status') in TERMINAL_STATUSES:
+            return self.terminal_ttl_sec
+        return self.collection_ttls.get(collection, self.ttl_sec)
+
+    def peek(self, collection: str, doc_id: str) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get((collection, doc_id))
+        if entry is None:
+            return None
+        if entry.expires <= time.monotonic():
+            self._drop((collection, doc_id))
+            self.expirations += 1
+            return None
+        self._entries.move_to_end((collection, doc_id))
+        return dict(entry.doc)
+
+    async def get(self, collection: str, doc_id: str,
+                  load: Callable[[], Awaitable[Optional[Dict[str, Any]]]]) -> Optional[Dict[str, Any]]:
+        """The cached document, or `load()`'s result (cached unless it raced a write). Returns a shallow copy."""
+        doc = self.peek(collection, doc_id)
+        if doc is not None:
+            self.hits += 1
+            return doc
+        key = (collection, doc_id)
+        pending = self._loading.get(key)
+        if pending is not None:
+            self.coalesced += 1
+            try:
+                doc = await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                if not pending.cancelled():
+                    raise
+                return await self.get(collection, doc_id, load)  # the loading request went away; load ourselves
+            return dict(doc) if doc is not None else None
+        self.misses += 1
+        version = self._versions.get(key, 0)
+        pending = self._loading[key] = asyncio.get_running_loop().create_future()
+        try:
+            doc = await load()
+        except asyncio.CancelledError:
+            pending.cancel()
+            raise
+        except BaseException as e:
+            pending.set_exception(e)
+            pending.exception()  # retrieved here; coalesced waiters re-raise it
+            raise
+        else:
+            pending.set_result(doc)
+        finally:
+            self._loading.pop(key, None)
+        if doc is not None and self._versions.get(key, 0) == version:
+            self._store(key, doc)
+        return dict(doc) if doc is not None else None
+
+    def _store(self, key: Key, doc: Dict[str, Any]):
+        self._drop(key)
+        entry = _Entry(dict(doc), time.monotonic() + self._ttl(key[0], doc), _size(doc))
+        self._entries[key] = entry
+        self.bytes += entry.size
+        while self._entries and (len(self._entries) > self.max_entries or self.bytes > self.max_bytes):
+            _, evicted = self._entries.popitem(last=False)
+            self.bytes -= evicted.size
+            self.evictions += 1
+
+    def _drop(self, key: Key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry.size
+
+    # ---- writes ----
+
+    def update(self, collection: str, doc_id: str, sets: Optional[Dict[str, Any]] = None,
+               pushes: Optional[Dict[str, List[Any]]] = None, limits: Optional[Dict[str, int]] = None):
+        """Apply a write to the cached copy (if any); the write itself goes to Mongo elsewhere.
+
+        `limits` caps pushed arrays to their last N elements, like `$slice`.
+        """
+        key = (collection, doc_id)
+        self._versions[key] = self._versions.get(key, 0) + 1
+        if len(self._versions) > 4 * self.max_entries:
+            self._versions = {k: v for k, v in self._versions.items() if k in self._entries or k in self._loading}
+        entry = self._entries.get(key)
+        if entry is None:
+            return
+        doc = dict(entry.doc)
+        delta = 0
+        for field, value in (sets or {}).items():
+            delta += _size(value) - (_size(doc[field]) if field in doc else 0)
+            doc[field] = value
+        for field, values in (pushes or {}).items():
+            old = doc.get(field) or []
+            merged = list(old) + list(values)
+            limit = (limits or {}).get(field)
+            doc[field] = merged[-limit:] if limit else merged
+            delta += _size(doc[field]) - _size(old) if limit else _size(values)
+        entry.doc = doc
+        entry.size += delta
+        self.bytes += delta
+        if doc.get('status') in TERMINAL_STATUSES:
+            entry.expires = time.monotonic() + self.terminal_ttl_sec
+
+    def invalidate(self, collection: str, doc_ids: Iterable[str], remote: bool = False):
+        for doc_id in doc_ids:
+            key = (collection, doc_id)
+            self._versions[key] = self._versions.get(key, 0) + 1
+            if key in self._entries:
+                self._drop(key)
+                if remote:
+                    self.invalidations_remote += 1
+                else:
+                    self.invalidations_local += 1
+
+    # ---- cross-process invalidation ----
+
+    async def broadcast(self, collection: str, doc_ids: List[str]):
+        """Tell other processes that these documents changed (call after the write is durable)."""
+        if self.poll_sec <= 0 or not doc_ids:
+            return
+        try:
+            await adb[self.collection].insert_one({'origin': self.origin, 'coll': collection, 'ids': list(doc_ids),
+                                                   'ts': datetime.utcnow()})
+            self.broadcasts += 1
+        except Exception:
+            self.broadcast_errors += 1
+            logger.debug("Cache invalidation broadcast failed", exc_info=True)
+
+    async def _poll(self):
+        since = datetime.utcnow()
+        slack = timedelta(seconds=max(2.0, 4 * self.poll_sec))
+        while True:
+            await asyncio.sleep(self.poll_sec)
+            started = datetime.utcnow()
+            try:
+                # Writers' clocks differ slightly, so look back a little and skip what was already applied.
+                docs = await adb[self.collection].find(
+                    {'ts': {'$gte': since - slack}, 'origin': {'$ne': self.origin}}, {'coll': 1, 'ids': 1})
+            except Exception:
+                logger.debug("Cache invalidation poll failed", exc_info=True)
+                continue
+            since = started
+            now = time.monotonic()
+            for d in docs:
+                if d['_id'] not in self._seen:
+                    self._seen[d['_id']] = now
+                    self.invalidate(d['coll'], d['ids'], remote=True)
+            horizon = now - 2 * slack.total_seconds() - self.poll_sec
+            self._seen = {k: t for k, t in self._seen.items() if t > horizon}
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'max_entries': self.max_entries,
+            'bytes': self.bytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'invalidations_local': self.invalidations_local,
+            'invalidations_remote': self.invalidations_remote,
+            'broadcasts': self.broadcasts,
+            'broadcast_errors': self.broadcast_errors,
+        }
@@ -0,0 +1,192 @@
+"""
+Job Event Broker
+
+In-process pub/sub for job progress, fed directly by job_update/job_append_log.
+
+Each job gets a channel holding the latest aggregated state, a bounded history
+of numbered events (for `Last-Event-ID` resumption) and the queues of live
+subscribers. Watching a job that runs in this process therefore costs no Mongo
+reads at all; channels of finished jobs linger for JOBEVENTS_RETAIN_SEC so late
+watchers still get the final result from memory.
+
+A channel's snapshot keeps only the last JOBEVENTS_STATE_LOGS log lines, and
+channels nobody has published to or watched for JOBEVENTS_IDLE_SEC (jobs
+that never finished here, e.g. lost to a crash elsewhere) are evicted. Event
+ids start from the wall clock in microseconds whenever a channel is
+(re)created, so they keep increasing across an eviction and a client's stale
+`Last-Event-ID` gets a fresh snapshot instead of an empty replay.
+
+Configuration (environment):
+    JOBEVENTS_HISTORY        events kept per channel for replay (default 256)
+    JOBEVENTS_RETAIN_SEC     how long a finished job's channel lingers (default 120)
+    JOBEVENTS_STATE_LOGS     log lines kept in a channel's snapshot (default 200)
+    JOBEVENTS_IDLE_SEC       evict channels idle this long (default 3600)
+"""
+
+import asyncio
+import json
+import os
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Deque, Dict, List, Optional, Tuple
+
+TERMINAL_STATUSES = ('done', 'error')
+
+# (event id, event type, payload)
+Event = Tuple[int, str, Dict[str, Any]]
+
+
+def _seed() -> int:
+    return int(time.time() * 1_000_000)
+
+
+class _Channel:
+    def __init__(self, history: int):
+        self.seed = self.seq = _seed()
+        self.touched = time.monotonic()
+        self.state: Dict[str, Any] = {}
+        self.history: Deque[Event] = deque(maxlen=history)
+        self.subscribers: List[asyncio.Queue] = []
+        self.closed = False
+
+
+class JobEventBroker:
+    """Fan-out of per-job events to any number of local subscribers."""
+
+    def __init__(self, history: int = 256, retain_sec: float = 120.0, subscriber_buffer: int = 1024,
+                 state_logs: int = 200, idle_sec: float = 3600.0):
+        self.history = history
+        self.retain_sec = retain_sec
+        self.subscriber_buffer = subscriber_buffer
+        self.state_logs = max(1, state_logs)
+        self.idle_sec = idle_sec
+        self._channels: Dict[str, _Channel] = {}
+        self._swept = time.monotonic()
+        self.published = 0
+        self.dropped_subscribers = 0
+        self.evicted = 0
+
+    @classmethod
+    def from_env(cls, **kwargs) -> 'JobEventBroker':
+        return cls(
+            history=int(os.getenv("JOBEVENTS_HISTORY", "256")),
+            retain_sec=float(os.getenv("JOBEVENTS_RETAIN_SEC", "120")),
+            state_logs=int(os.getenv("JOBEVENTS_STATE_LOGS", "200")),
+            idle_sec=float(os.getenv("JOBEVENTS_IDLE_SEC", "3600")),
+            **kwargs,
+        )
+
+    def has(self, job_id: str) -> bool:
+        return job_id in self._channels
+
+    def _channel(self, job_id: str) -> _Channel:
+        self._sweep()
+        ch = self._channels.get(job_id)
+        if ch is None:
+            ch = self._channels[job_id] = _Channel(self.history)
+        ch.touched = time.monotonic()
+        return ch
+
+    def _sweep(self):
+        """Evict unwatched channels idle for idle_sec; runs at most every idle_sec/4."""
+        now = time.monotonic()
+        if now - self._swept < self.idle_sec / 4:
+            return
+        self._swept = now
+        for job_id, ch in list(self._channels.items()):
+            if not ch.subscribers and now - ch.touched >= self.idle_sec:
+                del self._channels[job_id]
+                self.evicted += 1
+
+    def open(self, job_id: str, state: Dict[str, Any]):
+        """Create the channel for a job with its initial state."""
+        ch = self._channel(job_id)
+        ch.state.update(state)
+        if ch.state.get('logs'):
+            ch.state['logs'] = list(ch.state['logs'])[-self.state_logs:]
+
+    def publish(self, job_id: str, event: str, data: Dict[str, Any]) -> int:
+        ch = self._channel(job_id)
+        ch.seq += 1
+        if event == 'log':
+            logs = ch.state.setdefault('logs', [])
+            logs.append(data['line'])
+            if len(logs) > self.state_logs:
+                del logs[:len(logs) - self.state_logs]
+        else:
+            ch.state.update(data)
+        item: Event = (ch.seq, event, data)
+        ch.history.append(item)
+        self.published += 1
+        for q in list(ch.subscribers):
+            try:
+                q.put_nowait(item)
+            except asyncio.QueueFull:
+                # Too slow to keep up: disconnect, the client resumes via Last-Event-ID.
+                ch.subscribers.remove(q)
+                while not q.empty():
+                    q.get_nowait()
+                _offer_end(q)
+                self.dropped_subscribers += 1
+        if data.get('status') in TERMINAL_STATUSES and not ch.closed:
+            ch.closed = True
+            for q in ch.subscribers:
+                _offer_end(q)
+            asyncio.get_running_loop().call_later(self.retain_sec, self._channels.pop, job_id, None)
+        return ch.seq
+
+    def snapshot(self, job_id: str) -> Optional[Dict[str, Any]]:
+        ch = self._channels.get(job_id)
+        return dict(ch.state) if ch is not None else None
+
+    async def subscribe(self, job_id: str, last_event_id: Optional[int] = None) -> AsyncIterator[Event]:
+        """Yield events for a job: replay (or a snapshot), then live until it ends."""
+        ch = self._channel(job_id)
+        q: asyncio.Queue = asyncio.Queue(maxsize=self.subscriber_buffer)
+        oldest = ch.history[0][0] if ch.history else ch.seq + 1
+        # Ids outside this channel's range come from an evicted predecessor (or elsewhere): snapshot.
+        if last_event_id is not None and oldest - 1 <= last_event_id <= ch.seq:
+            backlog = [e for e in ch.history if e[0] > last_event_id]
+        else:
+            backlog = [(ch.seq, 'snapshot', dict(ch.state))]
+        if ch.closed:
+            for item in backlog:
+                yield item
+            return
+        ch.subscribers.append(q)
+        try:
+            for item in backlog:
+                yield item
+            while True:
+                item = await q.get()
+                if item is None:
+                    return
+                yield item
+        finally:
+            if q in ch.subscribers:
+                ch.subscribers.remove(q)
+            ch.touched = time.monotonic()
+            # Channel was only opened to watch a job nobody here publishes for.
+            if not ch.subscribers and ch.seq == ch.seed and self._channels.get(job_id) is ch:
+                self._channels.pop(job_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'channels': len(self._channels),
+            'subscribers': sum(len(c.subscribers) for c in self._channels.values()),
+            'published': self.published,
+            'dropped_subscribers': self.dropped_subscribers,
+            'evicted': self.evicted,
+        }
+
+
+def _offer_end(q: asyncio.Queue):
+    try:
+        q.put_nowait(None)
+    except asyncio.QueueFull:
+        pass
+
+
+def sse_format(event: Event) -> str:
+    eid, kind, data = event
+    return f"id: {eid}\nevent: {kind}\ndata: {json.dumps(data, default=str)}\n\n"
@@ -0,0 +1,163 @@
+"""
+Job Log Store
+
+Job log lines live in their own `job_log` collection, one document per line,
+instead of an ever-growing `logs` array on the job document. The job
+document only keeps the last JOB_LOG_TAIL_LINES lines (`$push` with
+`$slice`), so a status poll costs the same at the first line and the ten
+thousandth.
+
+Lines are buffered and written with one `insert_many` every
+JOB_LOG_FLUSH_MS. Each line gets its ObjectId when it is appended, and that
+id is the tail cursor: `tail(job_id, after=<id>)` returns the lines written
+since, including ones still in the buffer. Lines expire after
+JOB_LOG_TTL_SEC through a TTL index.
+
+Configuration (environment):
+    JOB_LOG_TAIL_LINES    lines kept on the job document (default 50)
+    JOB_LOG_TTL_SEC       lifetime of stored lines (default 2592000, 30 days)
+    JOB_LOG_FLUSH_MS      write-behind interval (default 250)
+"""
+
+import asyncio
+import logging
+import os
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from bson import ObjectId
+from pymongo.errors import BulkWriteError
+
+from database import adb
+
+logger = logging.getLogger(__name__)
+
+
+class JobLogStore:
+    """Write-behind, tailable store of job log lines."""
+
+    def __init__(self, collection: str = 'job_log', tail_lines: int = 50, ttl_sec: float = 30 * 86400,
+                 interval: float = 0.25):
+        self.collection = collection
+        self.tail_lines = max(1, tail_lines)
+        self.ttl_sec = ttl_sec
+        self.interval = interval
+        self._pending: List[Dict[str, Any]] = []
+        self._inflight: List[Dict[str, Any]] = []
+        self._lock: Optional[asyncio.Lock] = None
+        self._task: Optional[asyncio.Task] = None
+        self.appended = 0
+        self.writes = 0
+        self.failures = 0
+
+    @classmethod
+    def from_env(cls, **kwargs) -> 'JobLogStore':
+        return cls(
+            tail_lines=int(os.getenv("JOB_LOG_TAIL_LINES", "50")),
+            ttl_sec=float(os.getenv("JOB_LOG_TTL_SEC", str(30 * 86400))),
+            interval=int(os.getenv("JOB_LOG_FLUSH_MS", "250")) / 1000,
+            **kwargs,
+        )
+
+    async def ensure_indexes(self):
+        await adb[self.collection].create_index([('job_id', 1), ('_id', 1)])
+        await adb[self.collection].create_index('ts', expireAfterSeconds=int(self.ttl_sec))
+
+    # ---- lifecycle ----
+
+    def start(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name="joblog-flusher")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Job log flush failed")
+
+    # ---- writes ----
+
+    def append(self, job_id: str, line: str) -> str:
+        """Buffer one line; returns its id (the cursor that follows it)."""
+        self.start()
+        doc = {'_id': ObjectId(), 'job_id': job_id, 'line': line, 'ts': datetime.utcnow()}
+        self._pending.append(doc)
+        self.appended += 1
+        return str(doc['_id'])
+
+    async def flush(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, []
+            self._inflight = batch
+            try:
+                await adb[self.collection].insert_many(batch, ordered=False)
+            except BulkWriteError as e:
+                # Duplicate ids were written by an earlier attempt; only retry the rest.
+                retry = [batch[err['index']] for err in e.details.get('writeErrors', []) if err.get('code') != 11000]
+                if retry:
+                    self.failures += 1
+                    self._pending = retry + self._pending
+                    raise
+            except Exception:
+                self.failures += 1
+                self._pending = batch + self._pending
+                raise
+            finally:
+                self._inflight = []
+            self.writes += len(batch)
+
+    # ---- reads ----
+
+    async def tail(self, job_id: str, after: Optional[str] = None, limit: int = 200) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """Lines of a job after cursor `after` (oldest first) and the cursor to pass next time.
+
+        Raises ValueError for a malformed cursor.
+        """
+        query: Dict[str, Any] = {'job_id': job_id}
+        after_id = None
+        if after:
+            try:
+                after_id = ObjectId(after)
+            except Exception:
+                raise ValueError("Invalid cursor")
+            query['_id'] = {'$gt': after_id}
+        buffered = [d for d in self._inflight + self._pending
+                    if d['job_id'] == job_id and (after_id is None or d['_id'] > after_id)]
+        stored = await adb[self.collection].find(query, {'line': 1}, sort=[('_id', 1)], limit=limit)
+        merged = {d['_id']: d['line'] for d in stored}
+        for d in buffered:
+            merged.setdefault(d['_id'], d['line'])
+        items = [{'id': str(i), 'line': merged[i]} for i in sorted(merged)[:limit]]
+        return items, items[-1]['id'] if items else after
+
+    async def latest(self, job_id: str) -> Optional[str]:
+        """Cursor of the newest line of a job, or None if it has none."""
+        ids = [d['_id'] for d in self._inflight + self._pending if d['job_id'] == job_id]
+        ids += [d['_id'] for d in await adb[self.collection].find({'job_id': job_id}, {'_id': 1},
+                                                                   sort=[('_id', -1)], limit=1)]
+        return str(max(ids)) if ids else None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'appended': self.appended,
+            'writes': self.writes,
+            'pending': len(self._pending),
+            'failures': self.failures,
+            'tail_lines': self.tail_lines,
+            'flush_interval_ms': int(self.interval * 1000),
+        }
@@ -0,0 +1,288 @@
+"""
+Job Scheduler
+
+Bounded, per-type job queues drained by a fixed number of asyncio workers.
+
+Every job type gets its own queue and worker count, so a burst of one kind of
+job can never starve the others. Workers of all types additionally share a
+global pool of execution slots that is handed out by priority lane, which keeps
+short interactive jobs (melody) ahead of long full-pipeline renders when the
+box is saturated.
+
+Configuration (environment):
+    JOBQ_MAX_ACTIVE            global number of jobs running at once
+    JOBQ_<TYPE>_WORKERS        workers for a job type, e.g. JOBQ_MELODY_WORKERS=4
+    JOBQ_<TYPE>_MAXSIZE        queued jobs accepted before rejecting with 503 (with
+                               JOB_EXECUTION=distributed: unclaimed jobs fleet-wide)
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import math
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Lower value = served first.
+LANES = {'high': 0, 'normal': 1, 'low': 2}
+
+# job type -> (lane, workers, max queued)
+DEFAULT_QUEUES: Dict[str, Tuple[str, int, int]] = {
+    'melody': ('high', 4, 200),
+    'instrumental': ('normal', 2, 100),
+    'vocal': ('normal', 2, 100),
+    'mix': ('normal', 2, 100),
+    'video': ('low', 2, 50),
+    'create': ('low', 2, 50),
+    'batch': ('low', 1, 20),
+}
+
+
+class QueueFull(Exception):
+    """Raised when a job type's queue is at capacity."""
+
+    def __init__(self, job_type: str, depth: int, maxsize: int, retry_after: int):
+        super().__init__(f"Queue for '{job_type}' is full ({depth}/{maxsize})")
+        self.job_type = job_type
+        self.depth = depth
+        self.maxsize = maxsize
+        self.retry_after = retry_after
+
+
+@dataclass(order=True)
+class _Entry:
+    priority: int
+    seq: int
+    job_id: str = field(compare=False)
+    factory: Callable[[], Awaitable[Any]] = field(compare=False)
+    lane: str = field(compare=False, default='normal')
+    enqueued_at: float = field(compare=False, default_factory=time.monotonic)
+
+
+class _SlotGate:
+    """Counting semaphore whose waiters are woken in (priority, arrival) order."""
+
+    def __init__(self, slots: int):
+        self._free = slots
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+
+    async def acquire(self, priority: int):
+        if self._free > 0 and not self._waiters:
+            self._free -= 1
+            return
+        fut = asyncio.get_running_loop().create_future()
+        waiter = (priority, next(self._seq), fut)
+        heapq.heappush(self._waiters, waiter)
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                self.release()  # woken just before the cancel: hand the slot on
+            else:
+                # Drop it now, or the fast path above would keep queueing new acquirers behind it.
+                self._waiters.remove(waiter)
+                heapq.heapify(self._waiters)
+            raise
+
+    def release(self):
+        while self._waiters:
+            _, _, fut = heapq.heappop(self._waiters)
+            if not fut.done():
+                fut.set_result(None)
+                return
+        self._free += 1
+
+    @property
+    def waiting(self) -> int:
+        return sum(1 for _, _, f in self._waiters if not f.done())
+
+
+class JobQueue:
+    """Queue and bookkeeping for a single job type."""
+
+    def __init__(self, job_type: str, lane: str, workers: int, maxsize: int):
+        self.job_type = job_type
+        self.lane = lane
+        self.workers = max(1, workers)
+        self.maxsize = max(1, maxsize)
+        self.queue: asyncio.PriorityQueue = asyncio.PriorityQueue()
+        self.pending: Dict[str, _Entry] = {}
+        self.running = 0
+        self.completed = 0
+        self.rejected = 0
+        self.avg_run_sec = 5.0
+        self.avg_wait_sec = 0.0
+
+    @property
+    def depth(self) -> int:
+        return len(self.pending)
+
+    def position(self, job_id: str) -> Optional[int]:
+        entry = self.pending.get(job_id)
+        if entry is None:
+            return None
+        return 1 + sum(1 for e in self.pending.values() if e < entry)
+
+    def retry_after(self, depth: Optional[int] = None) -> int:
+        depth = self.depth if depth is None else depth
+        return max(1, math.ceil(depth * self.avg_run_sec / self.workers))
+
+    def record(self, wait_sec: float, run_sec: float):
+        # Exponentially weighted so Retry-After hints follow the current load.
+        self.avg_wait_sec = 0.8 * self.avg_wait_sec + 0.2 * wait_sec
+        self.avg_run_sec = 0.8 * self.avg_run_sec + 0.2 * run_sec
+        self.completed += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'lane': self.lane,
+            'workers': self.workers,
+            'maxsize': self.maxsize,
+            'depth': self.depth,
+            'running': self.running,
+            'completed': self.completed,
+            'rejected': self.rejected,
+            'avg_wait_ms': int(self.avg_wait_sec * 1000),
+            'avg_run_ms': int(self.avg_run_sec * 1000),
+        }
+
+
+class JobScheduler:
+    """Dispatches job coroutines onto bounded per-type queues."""
+
+    def __init__(self, queues: Dict[str, Tuple[str, int, int]], max_active: int,
+                 on_start: Optional[Callable[[str, Dict[str, Any]], Awaitable[None]]] = None):
+        self.queues: Dict[str, JobQueue] = {
+            t: JobQueue(t, lane, workers, maxsize) for t, (lane, workers, maxsize) in queues.items()
+        }
+        self.max_active = max(1, max_active)
+        self.on_start = on_start
+        self._gate: Optional[_SlotGate] = None
+        self._tasks: List[asyncio.Task] = []
+        self._seq = itertools.count()
+
+    @classmethod
+    def from_env(cls, **kwargs) -> 'JobScheduler':
+        queues = {}
+        for job_type, (lane, workers, maxsize) in DEFAULT_QUEUES.items():
+            prefix = f"JOBQ_{job_type.upper()}_"
+            queues[job_type] = (
+                os.getenv(prefix + "LANE", lane),
+                int(os.getenv(prefix + "WORKERS", workers)),
+                int(os.getenv(prefix + "MAXSIZE", maxsize)),
+            )
+        max_active = int(os.getenv("JOBQ_MAX_ACTIVE", max(4, (os.cpu_count() or 2) * 2)))
+        return cls(queues, max_active, **kwargs)
+
+    # ---- lifecycle ----
+
+    @property
+    def started(self) -> bool:
+        return bool(self._tasks)
+
+    def start(self):
+        if self._tasks:
+            return
+        self._gate = _SlotGate(self.max_active)
+        for q in self.queues.values():
+            for i in range(q.workers):
+                self._tasks.append(asyncio.create_task(self._worker(q), name=f"jobq-{q.job_type}-{i}"))
+
+    async def stop(self):
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    # ---- submission ----
+
+    def _queue(self, job_type: str) -> JobQueue:
+        q = self.queues.get(job_type)
+        if q is None:
+            raise KeyError(f"Unknown job type '{job_type}'")
+        return q
+
+    def ensure_capacity(self, job_type: str, depth: Optional[int] = None):
+        """Raise QueueFull without enqueueing anything (cheap pre-check).
+
+        `depth` replaces this process's queue depth, e.g. with the number of
+        leased jobs still waiting for a worker.
+        """
+        q = self._queue(job_type)
+        depth = q.depth if depth is None else depth
+        if depth >= q.maxsize:
+            q.rejected += 1
+            raise QueueFull(job_type, depth, q.maxsize, q.retry_after(depth))
+
+    def submit(self, job_type: str, job_id: str, factory: Callable[[], Awaitable[Any]],
+               lane: Optional[str] = None) -> Dict[str, Any]:
+        """Enqueue `factory()` to run as job `job_id`; returns queue info for the client."""
+        self.start()
+        q = self._queue(job_type)
+        self.ensure_capacity(job_type)
+        lane = lane or q.lane
+        entry = _Entry(LANES.get(lane, LANES['normal']), next(self._seq), job_id, factory, lane)
+        q.pending[job_id] = entry
+        q.queue.put_nowait(entry)
+        return self.queue_info(job_type, job_id)
+
+    def queue_info(self, job_type: str, job_id: str) -> Optional[Dict[str, Any]]:
+        """Live queue position for a queued job, or None once it has started."""
+        q = self.queues.get(job_type)
+        if q is None:
+            return None
+        pos = q.position(job_id)
+        if pos is None:
+            return None
+        return {
+            'lane': q.pending[job_id].lane,
+            'position': pos,
+            'depth': q.depth,
+            'estimated_wait_ms': int(pos * q.avg_run_sec / q.workers * 1000),
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'max_active': self.max_active,
+            'waiting_for_slot': self._gate.waiting if self._gate else 0,
+            'queues': {t: q.stats() for t, q in self.queues.items()},
+        }
+
+    # ---- execution ----
+
+    async def _worker(self, q: JobQueue):
+        while True:
+            entry: _Entry = await q.queue.get()
+            try:
+                await self._gate.acquire(entry.priority)
+                try:
+                    q.pending.pop(entry.job_id, None)
+                    q.running += 1
+                    wait_sec = time.monotonic() - entry.enqueued_at
+                    if self.on_start is not None:
+                        try:
+                            await self.on_start(entry.job_id, {'type': q.job_type, 'lane': entry.lane,
+                                                               'wait_ms': int(wait_sec * 1000)})
+                        except Exception:
+                            logger.exception("on_start hook failed for job %s", entry.job_id)
+                    t0 = time.monotonic()
+                    try:
+                        await entry.factory()
+                    except asyncio.CancelledError:
+                        raise
+                    except Exception:
+                        logger.exception("Job %s (%s) crashed", entry.job_id, q.job_type)
+                    finally:
+                        q.running -= 1
+                        q.record(wait_sec, time.monotonic() - t0)
+                finally:
+                    self._gate.release()
+            finally:
+                q.pending.pop(entry.job_id, None)
+                q.queue.task_done()
@@ -0,0 +1,194 @@
+"""
+Job State Buffer
+
+Write-behind coalescing of job progress and log updates.
+
+Workers report progress far more often than anyone needs it persisted. Instead
+of one `update_one` per call, successive `$set` fields and `$push` values for
+the same job are merged in memory and written as a single `bulk_write` every
+`JOBSTATE_FLUSH_MS` milliseconds. Terminal updates (`done`/`error`) flush
+synchronously, and flushes are serialized, so the final state of a job is
+never lost or overtaken by an older write. An optional `on_flush` callback
+receives the ids of every batch once it is written (used to invalidate
+other processes' document caches). Arrays listed in `push_limits` keep only
+their last N elements (`$slice`).
+"""
+
+import asyncio
+import logging
+import os
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from bson import ObjectId
+from pymongo import UpdateOne
+
+import database
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATUSES = ('done', 'error')
+
+
+class _Pending:
+    __slots__ = ('sets', 'pushes', 'updates')
+
+    def __init__(self):
+        self.sets: Dict[str, Any] = {}
+        self.pushes: Dict[str, List[Any]] = {}
+        self.updates = 0
+
+    def absorb(self, older: '_Pending'):
+        """Merge a failed, older batch underneath this one."""
+        merged = dict(older.sets)
+        merged.update(self.sets)
+        self.sets = merged
+        for field, values in older.pushes.items():
+            self.pushes[field] = values + self.pushes.get(field, [])
+        self.updates += older.updates
+
+    def to_update(self, limits: Dict[str, int]) -> Dict[str, Any]:
+        update: Dict[str, Any] = {}
+        if self.sets:
+            update['$set'] = self.sets
+        if self.pushes:
+            update['$push'] = {f: _each(v, limits.get(f)) for f, v in self.pushes.items()}
+        return update
+
+
+def _each(values: List[Any], limit: Optional[int]) -> Dict[str, Any]:
+    return {'$each': values, '$slice': -limit} if limit else {'$each': values}
+
+
+class JobStateBuffer:
+    """Coalesces per-job `$set`/`$push` updates and flushes them in bulk."""
+
+    def __init__(self, collection: str = 'job', interval: float = 0.25,
+                 on_flush: Optional[Callable[[List[str]], Awaitable[None]]] = None,
+                 push_limits: Optional[Dict[str, int]] = None):
+        self.collection = collection
+        self.interval = interval
+        self.on_flush = on_flush
+        self.push_limits = dict(push_limits or {})
+        self._pending: Dict[str, _Pending] = {}
+        self._inflight: Dict[str, _Pending] = {}
+        self._lock: Optional[asyncio.Lock] = None
+        self._task: Optional[asyncio.Task] = None
+        self.updates = 0
+        self.writes = 0
+        self.bulk_calls = 0
+        self.failures = 0
+
+    @classmethod
+    def from_env(cls, **kwargs) -> 'JobStateBuffer':
+        return cls(interval=int(os.getenv("JOBSTATE_FLUSH_MS", "250")) / 1000, **kwargs)
+
+    # ---- lifecycle ----
+
+    def start(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name="jobstate-flusher")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Job state flush failed")
+
+    # ---- writes ----
+
+    def _entry(self, job_id: str) -> _Pending:
+        self.start()
+        self.updates += 1
+        p = self._pending.get(job_id)
+        if p is None:
+            p = self._pending[job_id] = _Pending()
+        p.updates += 1
+        return p
+
+    async def set(self, job_id: str, fields: Dict[str, Any]):
+        self._entry(job_id).sets.update(fields)
+        if fields.get('status') in TERMINAL_STATUSES:
+            try:
+                await self.flush([job_id])
+            except Exception:
+                # Kept in the buffer; the background flusher retries it.
+                logger.exception("Terminal flush failed for job %s", job_id)
+
+    async def push(self, job_id: str, field: str, value: Any):
+        self._entry(job_id).pushes.setdefault(field, []).append(value)
+
+    async def flush(self, job_ids: Optional[List[str]] = None):
+        """Write buffered updates (all jobs, or just `job_ids`) in one bulk_write."""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            keys = list(self._pending) if job_ids is None else [j for j in job_ids if j in self._pending]
+            if not keys:
+                return
+            batch = {k: self._pending.pop(k) for k in keys}
+            self._inflight = batch
+            ops = [UpdateOne({'_id': ObjectId(k)}, p.to_update(self.push_limits)) for k, p in batch.items()]
+            try:
+                await database.adb[self.collection].bulk_write(ops, ordered=False)
+            except Exception:
+                self.failures += 1
+                # Put the batch back underneath anything that arrived meanwhile.
+                for k, p in batch.items():
+                    newer = self._pending.get(k)
+                    if newer is None:
+                        self._pending[k] = p
+                    else:
+                        newer.absorb(p)
+                raise
+            finally:
+                self._inflight = {}
+            self.bulk_calls += 1
+            self.writes += len(ops)
+        if self.on_flush is not None:
+            try:
+                await self.on_flush(keys)
+            except Exception:
+                logger.exception("Job state on_flush callback failed")
+
+    # ---- reads ----
+
+    def overlay(self, job_id: str, doc: Dict[str, Any]) -> Dict[str, Any]:
+        """Apply not-yet-flushed updates to a document read from Mongo."""
+        inflight = self._inflight.get(job_id)
+        if inflight is not None:
+            # $set is idempotent; in-flight pushes may already be in `doc`.
+            doc.update(inflight.sets)
+        p = self._pending.get(job_id)
+        if p is not None:
+            doc.update(p.sets)
+            for field, values in p.pushes.items():
+                merged = list(doc.get(field) or []) + values
+                limit = self.push_limits.get(field)
+                doc[field] = merged[-limit:] if limit else merged
+        return doc
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'updates': self.updates,
+            'writes': self.writes,
+            'bulk_calls': self.bulk_calls,
+            'writes_saved': self.updates - self.writes - self.pending_updates,
+            'pending_jobs': len(self._pending),
+            'failures': self.failures,
+            'flush_interval_ms': int(self.interval * 1000),
+        }
+
+    @property
+    def pending_updates(self) -> int:
+        return sum(p.updates for p in self._pending.values())
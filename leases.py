@@ -0,0 +1,310 @@
+"""
+Job Leases
+
+Distributed job execution on top of the `job` collection. API processes only
+create jobs and mark them leasable; any number of worker processes (see
+worker.py) claim them atomically:
+
+    claim       find_one_and_update on a queued job, or a running job whose
+                lease has expired, setting lease_owner/lease_until
+    heartbeat   extends lease_until while the job runs; a worker that loses
+                its lease (it stalled past the expiry and someone else took
+                over) cancels its copy of the job
+    release     clears the lease once the worker function returns
+
+A worker that dies simply stops heartbeating; its jobs are reclaimed once
+their lease expires and resume from their checkpoint. Jobs that keep killing
+their worker are failed after JOB_MAX_ATTEMPTS claims.
+
+Jobs run in-process (JOB_EXECUTION=local) carry no lease; instead every API
+process heartbeats one document in the `runner` collection (RunnerHeartbeat).
+Another process only resumes such a job once its runner's heartbeat is stale
+or gone, so a live sibling (another uvicorn worker, the old half of a rolling
+restart) keeps its jobs. A process that shuts down cleanly removes its
+document, so its jobs are resumed right away.
+
+Configuration (environment):
+    JOB_LEASE_SEC            lease length (default 30)
+    JOB_HEARTBEAT_SEC        heartbeat interval (default 10)
+    JOB_POLL_SEC             idle claim poll interval (default 0.5)
+    JOB_MAX_ATTEMPTS         claims before a job is failed (default 3)
+    JOB_WORKER_CONCURRENCY   jobs one worker process runs at once (default 4)
+    JOB_RUNNER_HEARTBEAT_SEC in-process runner heartbeat interval (default 10)
+    JOB_RUNNER_TIMEOUT_SEC   heartbeat age after which a runner counts as dead (default 60)
+"""
+
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+
+from database import adb
+
+logger = logging.getLogger(__name__)
+
+# Stored as lease_until on jobs that are waiting to be claimed; always in the past.
+LEASABLE = datetime(1970, 1, 1)
+
+
+def worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class JobLeases:
+    """Atomic claim / heartbeat / release of jobs in a Mongo collection."""
+
+    def __init__(self, owner: Optional[str] = None, lease_sec: float = 30.0, max_attempts: int = 3,
+                 collection: str = 'job'):
+        self.owner = owner or worker_id()
+        self.lease_sec = lease_sec
+        self.max_attempts = max_attempts
+        self.collection = collection
+        self.claimed = 0
+        self.reclaimed = 0
+        self.lost = 0
+
+    @classmethod
+    def from_env(cls, **kwargs) -> 'JobLeases':
+        return cls(lease_sec=float(os.getenv("JOB_LEASE_SEC", "30")),
+                   max_attempts=int(os.getenv("JOB_MAX_ATTEMPTS", "3")), **kwargs)
+
+    async def ensure_indexes(self):
+        await adb[self.collection].create_index([('status', 1), ('lease_until', 1), ('priority', 1), ('created_at', 1)])
+
+    async def make_leasable(self, job_id: str, priority: int = 1):
+        """Hand a freshly created job to the worker fleet (written directly, not buffered)."""
+        await adb[self.collection].update_one(
+            {'_id': ObjectId(job_id)},
+            {'$set': {'lease_until': LEASABLE, 'lease_owner': None, 'priority': priority, 'attempts': 0}})
+
+    async def queued(self, job_type: str) -> int:
+        """Jobs of `job_type` waiting for their first claim, across the whole fleet."""
+        return await adb[self.collection].count_documents(
+            {'status': 'queued', 'lease_until': LEASABLE, 'type': job_type})
+
+    async def claim(self, job_types: Optional[Sequence[str]] = None) -> Optional[Dict[str, Any]]:
+        """Take the highest-priority, oldest claimable job, or None."""
+        now = datetime.utcnow()
+        query: Dict[str, Any] = {'status': {'$in': ['queued', 'running']}, 'lease_until': {'$lt': now}}
+        if job_types:
+            query['type'] = {'$in': list(job_types)}
+        doc = await adb[self.collection].find_one_and_update(
+            query,
+            {'$set': {'lease_owner': self.owner, 'lease_until': now + timedelta(seconds=self.lease_sec),
+                      'runner': self.owner},
+             '$inc': {'attempts': 1}},
+            projection={'logs': 0, 'checkpoint': 0},
+            sort=[('priority', 1), ('created_at', 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+        if doc is not None:
+            self.claimed += 1
+            if doc.get('status') == 'running':
+                self.reclaimed += 1
+        return doc
+
+    async def heartbeat(self, job_id: str) -> bool:
+        """Extend our lease; False if it now belongs to someone else."""
+        res = await adb[self.collection].update_one(
+            {'_id': ObjectId(job_id), 'lease_owner': self.owner},
+            {'$set': {'lease_until': datetime.utcnow() + timedelta(seconds=self.lease_sec)}})
+        if res.matched_count == 0:
+            self.lost += 1
+            return False
+        return True
+
+    async def release(self, job_id: str):
+        await adb[self.collection].update_one(
+            {'_id': ObjectId(job_id), 'lease_owner': self.owner},
+            {'$set': {'lease_owner': None}})
+
+    async def abandon(self, job_id: str):
+        """Give a job back immediately (graceful shutdown); this claim does not count as an attempt."""
+        await adb[self.collection].update_one(
+            {'_id': ObjectId(job_id), 'lease_owner': self.owner},
+            {'$set': {'lease_until': LEASABLE, 'lease_owner': None}, '$inc': {'attempts': -1}})
+
+    def stats(self) -> Dict[str, Any]:
+        return {'owner': self.owner, 'claimed': self.claimed, 'reclaimed': self.reclaimed, 'lost': self.lost}
+
+
+class LeaseWorker:
+    """Claims leased jobs and runs them with `runner(doc)`, `concurrency` at a time."""
+
+    def __init__(self, leases: JobLeases, runner: Callable[[Dict[str, Any]], Awaitable[None]],
+                 job_types: Optional[Sequence[str]] = None, concurrency: int = 4,
+                 heartbeat_sec: float = 10.0, poll_sec: float = 0.5,
+                 on_exhausted: Optional[Callable[[Dict[str, Any]], Awaitable[None]]] = None):
+        self.leases = leases
+        self.runner = runner
+        self.job_types = list(job_types) if job_types else None
+        self.concurrency = max(1, concurrency)
+        self.heartbeat_sec = heartbeat_sec
+        self.poll_sec = poll_sec
+        self.on_exhausted = on_exhausted
+        self._tasks: List[asyncio.Task] = []
+        self.running: Dict[str, asyncio.Task] = {}
+        self.completed = 0
+        self.failed = 0
+
+    @classmethod
+    def from_env(cls, leases: JobLeases, runner, **kwargs) -> 'LeaseWorker':
+        kwargs.setdefault('concurrency', int(os.getenv("JOB_WORKER_CONCURRENCY", "4")))
+        kwargs.setdefault('heartbeat_sec', float(os.getenv("JOB_HEARTBEAT_SEC", "10")))
+        kwargs.setdefault('poll_sec', float(os.getenv("JOB_POLL_SEC", "0.5")))
+        return cls(leases, runner, **kwargs)
+
+    def start(self):
+        if self._tasks:
+            return
+        for i in range(self.concurrency):
+            self._tasks.append(asyncio.create_task(self._slot(), name=f"lease-worker-{i}"))
+
+    async def stop(self):
+        """Stop claiming, cancel running jobs and hand them back so another worker resumes them."""
+        handed_back = list(self.running)
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        for job_id in handed_back:
+            try:
+                await self.leases.abandon(job_id)
+            except Exception:
+                logger.exception("Could not hand back job %s; its lease will expire", job_id)
+
+    async def _slot(self):
+        while True:
+            try:
+                doc = await self.leases.claim(self.job_types)
+            except Exception:
+                logger.exception("Claiming a job failed")
+                doc = None
+            if doc is None:
+                await asyncio.sleep(self.poll_sec)
+                continue
+            await self._run(doc)
+
+    async def _run(self, doc: Dict[str, Any]):
+        job_id = str(doc['_id'])
+        if doc.get('attempts', 1) > self.leases.max_attempts:
+            logger.warning("Job %s exhausted %d attempts", job_id, self.leases.max_attempts)
+            if self.on_exhausted is not None:
+                await self.on_exhausted(doc)
+            await self.leases.release(job_id)
+            return
+        task = asyncio.create_task(self.runner(doc), name=f"job-{job_id}")
+        self.running[job_id] = task
+        t0 = time.monotonic()
+        try:
+            while True:
+                done, _ = await asyncio.wait({task}, timeout=self.heartbeat_sec)
+                if done:
+                    break
+                if not await self._heartbeat(job_id):
+                    logger.warning("Lost lease on job %s after %.1fs; abandoning it", job_id, time.monotonic() - t0)
+                    task.cancel()
+                    await asyncio.gather(task, return_exceptions=True)
+                    return
+            if task.exception() is not None:
+                # Lease is kept: it expires and the job is retried (from its checkpoint) elsewhere.
+                self.failed += 1
+                logger.error("Job %s crashed its worker", job_id, exc_info=task.exception())
+                return
+            self.completed += 1
+            await self.leases.release(job_id)
+        except asyncio.CancelledError:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            raise
+        finally:
+            self.running.pop(job_id, None)
+
+    async def _heartbeat(self, job_id: str) -> bool:
+        try:
+            return await self.leases.heartbeat(job_id)
+        except Exception:
+            # Mongo hiccup: keep working, the lease is still ours until it expires.
+            logger.exception("Heartbeat for job %s failed", job_id)
+            return True
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.leases.stats(),
+            'concurrency': self.concurrency,
+            'running': sorted(self.running),
+            'completed': self.completed,
+            'failed': self.failed,
+        }
+
+
+class RunnerHeartbeat:
+    """Liveness of the processes that run jobs in-process, one heartbeat document each.
+
+    `on_beat()` (if given) is awaited after every heartbeat, e.g. to resume the jobs of
+    runners that have died since.
+    """
+
+    def __init__(self, owner: str, interval: float = 10.0, timeout_sec: float = 60.0, collection: str = 'runner',
+                 on_beat: Optional[Callable[[], Awaitable[Any]]] = None):
+        self.owner = owner
+        self.interval = interval
+        self.timeout_sec = max(timeout_sec, 2 * interval)
+        self.collection = collection
+        self.on_beat = on_beat
+        self._task: Optional[asyncio.Task] = None
+        self.beats = 0
+        self.failures = 0
+
+    @classmethod
+    def from_env(cls, owner: str, **kwargs) -> 'RunnerHeartbeat':
+        return cls(owner, interval=float(os.getenv("JOB_RUNNER_HEARTBEAT_SEC", "10")),
+                   timeout_sec=float(os.getenv("JOB_RUNNER_TIMEOUT_SEC", "60")), **kwargs)
+
+    async def beat(self):
+        await adb[self.collection].update_one({'_id': self.owner}, {'$set': {'seen_at': datetime.utcnow()}},
+                                              upsert=True)
+        self.beats += 1
+
+    async def live(self) -> List[str]:
+        """Runners whose heartbeat is recent enough, always including this one."""
+        cutoff = datetime.utcnow() - timedelta(seconds=self.timeout_sec)
+        docs = await adb[self.collection].find({'seen_at': {'$gte': cutoff}}, {'_id': 1})
+        return sorted({d['_id'] for d in docs} | {self.owner})
+
+    def start(self):
+        if self.interval > 0 and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._run(), name="runner-heartbeat")
+
+    async def stop(self):
+        """Stop heartbeating and deregister, so our unfinished jobs are resumable at once."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        try:
+            await adb[self.collection].delete_one({'_id': self.owner})
+        except Exception:
+            logger.warning("Could not deregister runner %s; its jobs resume once its heartbeat is stale", self.owner)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.beat()
+                if self.on_beat is not None:
+                    await self.on_beat()
+            except Exception:
+                self.failures += 1
+                logger.exception("Runner heartbeat failed")
+
+    def stats(self) -> Dict[str, Any]:
+        return {'owner': self.owner, 'interval_sec': self.interval, 'timeout_sec': self.timeout_sec,
+                'beats': self.beats, 'failures': self.failures}
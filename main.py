@@ -1,22 +1,47 @@
 import os
 import asyncio
+import logging
+import time
 import uuid
 from datetime import datetime
-from typing import List, Optional, Dict, Any
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
+from typing import List, Optional, Dict, Any, Tuple
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request, Header
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-from database import db, create_document
+import database
+from database import adb, acreate_document, acreate_documents, ainsert_many, aensure_indexes, apaginate, aprobe, acollection_names
+from dbconn import DatabaseUnavailable, is_connection_error
+from jobqueue import JobScheduler, QueueFull, LANES
+from jobstate import JobStateBuffer
+from joblogs import JobLogStore
+from doccache import DocumentCache
+from jobevents import JobEventBroker, TERMINAL_STATUSES, sse_format
+from resultcache import ResultCache, request_fingerprint
+from singleflight import InFlight, IdempotencyStore, IdempotencyConflict
 from schemas import (
     Project, Track, VoiceProfile, Job,
     GenerateInstrumentalRequest, GenerateMelodyRequest,
-    SynthesizeVocalRequest, MixRequest, GenerateVideoRequest
+    SynthesizeVocalRequest, MixRequest, GenerateVideoRequest, BatchGenerateRequest
 )
+from audio_analysis import analyze_clip, build_report
+from mixer import mix_stems, stem_paths_from_urls
+from render import RenderPool, save_wav_silence, write_text, write_placeholder
+from pipeline import Pipeline, Stage, StageFailed
+from checkpoint import Checkpoint
+from metrics import STEP_SECONDS
+from leases import JobLeases, RunnerHeartbeat
+from delivery import AssetFiles
+from storage import AssetStore
+from assetgc import AssetSweeper
+import metrics
+from metrics import REGISTRY, HTTPMetricsMiddleware, LoopLagMonitor
+from profiling import Profiler, ProfilerBusy, ProfileMiddleware, LoopWatchdog
 from bson import ObjectId
-import wave
 import contextlib
+import itertools
+
+logger = logging.getLogger(__name__)
 
 ASSETS_DIR = os.path.join(os.getcwd(), 'assets')
 os.makedirs(ASSETS_DIR, exist_ok=True)
@@ -32,8 +57,193 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(HTTPMetricsMiddleware)
+profiler = Profiler.from_env(os.path.join(os.getcwd(), 'logs', 'profiles'))
+if profiler.enabled:
+    app.add_middleware(ProfileMiddleware, profiler=profiler)
+
+asset_store = AssetStore.from_env(ASSETS_DIR)
+asset_files = AssetFiles.from_env(ASSETS_DIR, fetch=asset_store.resolve_url)
+app.mount("/assets", asset_files, name="assets")
+
+
+# Identifies this server process as the runner of the jobs it queues.
+INSTANCE_ID = uuid.uuid4().hex
+RESUME_ON_STARTUP = os.getenv("JOB_RESUME_ON_STARTUP", "true").lower() == "true"
+# local: jobs run in the process that accepted them. distributed: they are
+# claimed through Mongo leases by worker processes (worker.py).
+JOB_EXECUTION = os.getenv("JOB_EXECUTION", "local").lower()
+REMOTE_POLL_SEC = float(os.getenv("JOB_REMOTE_POLL_SEC", "0.5"))
+# /api/generate/batch: most variations per request, and how many of them render at once.
+BATCH_MAX_VARIATIONS = int(os.getenv("BATCH_MAX_VARIATIONS", "64"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+# render_stems: finished stems are registered (one asset insert + one checkpoint write) per this many.
+STEM_FLUSH_BATCH = int(os.getenv("STEM_FLUSH_BATCH", "4"))
+
+
+async def _on_job_start(job_id: str, info: Dict[str, Any]):
+    QUEUE_WAIT.observe(info['wait_ms'] / 1000, type=info['type'], lane=info['lane'])
+    await job_update(job_id, queue={'lane': info['lane'], 'position': 0, 'wait_ms': info['wait_ms']})
+
+
+scheduler = JobScheduler.from_env(on_start=_on_job_start)
+doc_cache = DocumentCache.from_env(INSTANCE_ID)
+job_logs = JobLogStore.from_env()
+# The job document only keeps the newest log lines; the full log is in job_logs.
+LOG_LIMITS = {'logs': job_logs.tail_lines}
+job_state = JobStateBuffer.from_env(on_flush=lambda ids: doc_cache.broadcast('job', ids), push_limits=LOG_LIMITS)
+job_events = JobEventBroker.from_env()
+result_cache = ResultCache.from_env()
+inflight = InFlight()
+idempotency = IdempotencyStore.from_env()
+render_pool = RenderPool.from_env()
+leases = JobLeases.from_env()
+# Jobs of a runner whose heartbeat went stale are resumed by the survivors (see resume_orphaned_jobs).
+runners = RunnerHeartbeat.from_env(INSTANCE_ID, on_beat=(lambda: resume_orphaned_jobs()) if RESUME_ON_STARTUP else None)
+asset_sweeper = AssetSweeper.from_env(asset_store, INSTANCE_ID)
+loop_lag = LoopLagMonitor.from_env()
+loop_watchdog = LoopWatchdog.from_env()
+_mirror_tasks = set()
+_watchers: Dict[str, asyncio.Task] = {}
+
+# ---------- Metrics ----------
+
+QUEUE_WAIT = REGISTRY.histogram('job_queue_wait_seconds', 'Time jobs spent queued before a worker slot', ('type', 'lane'))
+JOB_SECONDS = REGISTRY.histogram('job_duration_seconds', 'Job run time, from running to done/error', ('type', 'status'))
+JOBS_TOTAL = REGISTRY.counter('jobs_total', 'Jobs that finished, by outcome', ('type', 'status'))
+# job id -> (type, monotonic time it started running); only jobs this process runs.
+_job_clock: Dict[str, tuple] = {}
+
+
+def _observe_job(job_id: str, status: str):
+    if status == 'running':
+        if job_id not in _job_clock:
+            state = job_events.snapshot(job_id) or {}
+            _job_clock[job_id] = (state.get('type') or 'unknown', time.monotonic())
+    elif status in TERMINAL_STATUSES:
+        job_type, started = _job_clock.pop(job_id, (None, None))
+        if job_type is None:
+            job_type = (job_events.snapshot(job_id) or {}).get('type') or 'unknown'
+        JOBS_TOTAL.inc(type=job_type, status=status)
+        if started is not None:
+            JOB_SECONDS.observe(time.monotonic() - started, type=job_type, status=status)
+
+
+def _queue_series(field: str):
+    return [((t,), getattr(q, field)) for t, q in scheduler.queues.items()]
+
+
+REGISTRY.callback('job_queue_depth', 'Jobs waiting in the local scheduler', 'gauge',
+                  lambda: _queue_series('depth'), ('type',))
+REGISTRY.callback('jobs_running', 'Jobs running in the local scheduler', 'gauge',
+                  lambda: _queue_series('running'), ('type',))
+REGISTRY.callback('asset_bytes_written_total', 'Bytes of assets written to ASSETS_DIR, before deduplication', 'counter',
+                  lambda: [((), asset_store.counters['bytes_stored'] + asset_store.counters['bytes_deduplicated'])])
+REGISTRY.callback('asset_bytes_stored_total', 'Bytes of new asset content stored after deduplication', 'counter',
+                  lambda: [((), asset_store.counters['bytes_stored'])])
+REGISTRY.callback('asset_puts_total', 'Assets stored, by whether the content already existed', 'counter',
+                  lambda: [(('false',), asset_store.counters['puts'] - asset_store.counters['deduplicated']),
+                           (('true',), asset_store.counters['deduplicated'])], ('deduplicated',))
+REGISTRY.callback('job_state_pending_jobs', 'Jobs with buffered state updates not yet flushed', 'gauge',
+                  lambda: [((), job_state.stats()['pending_jobs'])])
+REGISTRY.callback('mongo_circuit_open', 'Whether the MongoDB circuit breaker is rejecting calls', 'gauge',
+                  lambda: [((), 0 if database.connection.breaker.state == 'closed' else 1)])
+REGISTRY.callback('document_cache_entries', 'Documents in the read-through cache', 'gauge',
+                  lambda: [((), len(doc_cache._entries))])
+
+
+@app.on_event("startup")
+async def _start_scheduler():
+    job_state.start()
+    job_logs.start()
+    await render_pool.start()
+    scheduler.start()
+    asset_sweeper.start()
+    doc_cache.start()
+    loop_lag.start()
+    loop_watchdog.start()
+    await _setup_database()
+    try:
+        # Announce ourselves before looking for orphans, so a sibling starting now leaves our jobs alone.
+        await runners.beat()
+        if RESUME_ON_STARTUP:
+            await resume_orphaned_jobs()
+    except Exception:
+        logger.exception("Resuming orphaned jobs failed")
+    runners.start()
+
+
+async def ensure_collections():
+    """Indexes and collections the queries here rely on (paginated listings, leases, the capped
+    cache-invalidation collection, ...)."""
+    await aensure_indexes()
+    await doc_cache.ensure_collection()
+    await job_logs.ensure_indexes()
+    await result_cache.ensure_indexes()
+    await idempotency.ensure_indexes()
+    if JOB_EXECUTION == 'distributed':
+        await leases.ensure_indexes()
+
+
+def _db_unreachable(e: BaseException) -> bool:
+    return isinstance(e, DatabaseUnavailable) or is_connection_error(e)
+
+
+_setup_task: Optional[asyncio.Task] = None
 
-app.mount("/assets", StaticFiles(directory=ASSETS_DIR), name="assets")
+
+async def _setup_database():
+    """Ensure collections at startup.
+
+    An unreachable database does not stop the server (requests get 503 until it is back);
+    setup is retried in the background meanwhile. Any other failure (an index conflicting
+    with an existing one, missing privileges) is a deployment error and fails startup.
+    """
+    global _setup_task
+    if not database.configured():
+        logger.warning("Database not configured; skipping index setup")
+        return
+    try:
+        await ensure_collections()
+    except Exception as e:
+        if not _db_unreachable(e):
+            logger.exception("Database index setup failed")
+            raise
+        logger.warning("Database unreachable at startup (%s); retrying index setup in the background", e)
+        _setup_task = asyncio.create_task(_retry_setup_database(), name="db-setup")
+
+
+async def _retry_setup_database(delay: float = 1.0):
+    while True:
+        await asyncio.sleep(delay)
+        try:
+            await ensure_collections()
+        except Exception as e:
+            if not _db_unreachable(e):
+                logger.exception("Database index setup failed")
+                return
+            delay = min(60.0, delay * 2)
+            continue
+        logger.info("Database index setup completed")
+        return
+
+
+@app.on_event("shutdown")
+async def _stop_scheduler():
+    if _setup_task is not None:
+        _setup_task.cancel()
+    await runners.stop()
+    await scheduler.stop()
+    await asset_sweeper.stop()
+    await doc_cache.stop()
+    await loop_lag.stop()
+    await loop_watchdog.stop()
+    for task in list(_watchers.values()):
+        task.cancel()
+    await job_state.stop()
+    await job_logs.stop()
+    await render_pool.stop()
+    database.connection.close()
 
 # ---------- Helpers ----------
 
@@ -44,52 +254,366 @@ def oid(id_str: str) -> ObjectId:
         raise HTTPException(status_code=400, detail="Invalid ID")
 
 
-def save_wav_silence(path: str, duration_sec: float = 2.0, samplerate: int = 44100):
-    frames = int(duration_sec * samplerate)
-    with wave.open(path, 'w') as wf:
-        wf.setnchannels(1)
-        wf.setsampwidth(2)
-        wf.setframerate(samplerate)
-        silence = (b"\x00\x00") * frames
-        wf.writeframes(silence)
+async def job_create(job_type: str, project_id: Optional[str] = None, message: str = "Queued",
+                     params: Optional[Dict[str, Any]] = None, job_id: Optional[str] = None) -> str:
+    """Insert a queued job; `job_id` pre-assigns its id (e.g. one reserved for an Idempotency-Key)."""
+    excess = asset_sweeper.over_quota(project_id)
+    if excess:
+        raise HTTPException(status_code=507, detail={'error': 'quota_exceeded', 'projectId': project_id,
+                                                     'excessBytes': excess})
+    job_doc = Job(type=job_type, project_id=project_id, message=message, params=params or {}, runner=INSTANCE_ID).model_dump()
+    if job_id:
+        job_doc['_id'] = ObjectId(job_id)
+    job_id = await acreate_document('job', job_doc)
+    job_events.open(job_id, {k: job_doc[k] for k in ('type', 'project_id', 'status', 'progress', 'message')})
+    return job_id
 
 
-def job_create(job_type: str, project_id: Optional[str] = None, message: str = "Queued") -> str:
-    job_doc = Job(type=job_type, project_id=project_id, message=message).model_dump()
-    job_id = create_document('job', job_doc)
-    return job_id
+async def job_update(job_id: str, **fields):
+    if 'status' in fields:
+        _observe_job(job_id, fields['status'])
+    job_events.publish(job_id, 'end' if fields.get('status') in TERMINAL_STATUSES else 'update', fields)
+    doc_cache.update('job', job_id, sets=fields)
+    await job_state.set(job_id, fields)
+
+
+async def job_append_log(job_id: str, msg: str):
+    line = f"{datetime.utcnow().isoformat()} - {msg}"
+    job_events.publish(job_id, 'log', {'line': line})
+    await record_log(job_id, line)
 
 
-def job_update(job_id: str, **fields):
-    db['job'].update_one({'_id': oid(job_id)}, {'$set': fields})
+async def record_log(job_id: str, line: str):
+    """Store a log line in the log store and the job document's capped tail."""
+    job_logs.append(job_id, line)
+    doc_cache.update('job', job_id, pushes={'logs': [line]}, limits=LOG_LIMITS)
+    await job_state.push(job_id, 'logs', line)
+
+
+async def enqueue_job(job_type: str, job_id: str, factory, lane: Optional[str] = None,
+                      on_done=None) -> Dict[str, Any]:
+    """Run the job here, or hand it to the worker fleet; `on_done()` is called once it has finished."""
+    if JOB_EXECUTION == 'distributed':
+        lane = lane or scheduler.queues[job_type].lane
+        await leases.make_leasable(job_id, priority=LANES.get(lane, 1))
+        watch_remote_job(job_id, on_done)
+        return {'lane': lane, 'dispatch': 'lease'}
+    if profiler.job_requested():
+        factory = profiler.wrap_job(job_id, factory)
+    try:
+        return scheduler.submit(job_type, job_id, _then(factory, on_done) if on_done else factory, lane=lane)
+    except QueueFull as e:
+        await job_update(job_id, status='error', message='Rejected: queue full')
+        raise queue_full_error(e)
+
+
+def _then(factory, callback):
+    async def run():
+        try:
+            await factory()
+        finally:
+            callback()
+    return run
+
+
+def queue_full_error(e: QueueFull) -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail={'error': 'queue_full', 'jobType': e.job_type, 'queueDepth': e.depth, 'maxQueue': e.maxsize},
+        headers={'Retry-After': str(e.retry_after)},
+    )
+
+
+async def check_capacity(job_type: str):
+    """503 once the job type's queue is full; in distributed mode, the fleet-wide queue of unclaimed jobs."""
+    depth = await leases.queued(job_type) if JOB_EXECUTION == 'distributed' else None
+    try:
+        scheduler.ensure_capacity(job_type, depth)
+    except QueueFull as e:
+        raise queue_full_error(e)
+
+
+async def register_cached_assets(hit: Dict[str, Any], project_id: Optional[str], fingerprint: str):
+    """Register a cached result's files as assets of `project_id`, so its listings and quota include them."""
+    await asset_create_many([{'kind': a['kind'], 'file_path': a['path'], 'project_id': project_id,
+                              'meta': {**(a.get('meta') or {}), 'cache_key': fingerprint},
+                              'intermediate': a.get('retention') == 'intermediate'} for a in hit['assets']])
+
+
+async def serve_cached(job_type: str, req: BaseModel, fingerprint: str, message: str,
+                       job_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """Complete a job straight from the result cache when an identical request was rendered before."""
+    hit = await result_cache.get(fingerprint)
+    if hit is None:
+        return None
+    job_id = await job_create(job_type, req.projectId, message=message, params=req.model_dump(), job_id=job_id)
+    await register_cached_assets(hit, req.projectId, fingerprint)
+    await job_update(job_id, status='done', progress=100, message=message, result=hit['result'], cached=True)
+    return {"jobId": job_id, "status": "done", "cached": True, "result": hit['result']}
+
+
+async def submit_generation(job_type: str, req: BaseModel, message: str, cached_message: str, worker,
+                            idempotency_key: Optional[str] = None) -> Dict[str, Any]:
+    """Cache hit, attach to an identical in-flight job, or enqueue a new one."""
+    fingerprint = request_fingerprint(job_type, req.model_dump())
+    if idempotency_key:
+        async with idempotency.lock(job_type, idempotency_key):
+            try:
+                prior = await idempotency.lookup(job_type, idempotency_key, fingerprint)
+            except IdempotencyConflict as e:
+                raise HTTPException(status_code=409, detail=str(e))
+            if prior:
+                return await idempotent_replay(prior)
+            # Reserve the key before anything is created, so a process losing the race never starts a job.
+            job_id = str(ObjectId())
+            try:
+                winner = await idempotency.reserve(job_type, idempotency_key, fingerprint, job_id)
+            except IdempotencyConflict as e:
+                raise HTTPException(status_code=409, detail=str(e))
+            if winner != job_id:
+                return await idempotent_replay(winner)
+            try:
+                return await _submit_generation(job_type, req, fingerprint, message, cached_message, worker, job_id)
+            except Exception:
+                await idempotency.release(job_type, idempotency_key, job_id)
+                raise
+    return await _submit_generation(job_type, req, fingerprint, message, cached_message, worker)
+
+
+async def _submit_generation(job_type, req, fingerprint, message, cached_message, worker,
+                             job_id: Optional[str] = None) -> Dict[str, Any]:
+    if not inflight.active(fingerprint):
+        cached = await serve_cached(job_type, req, fingerprint, cached_message, job_id)
+        if cached:
+            return cached
+    if not inflight.claim(fingerprint):
+        try:
+            leader = await inflight.attach(fingerprint)
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=503, detail=str(e))
+        job_id = await job_create(job_type, req.projectId, message=message, params=req.model_dump(), job_id=job_id)
+        inflight.follow(fingerprint, job_id)
+        task = asyncio.create_task(_mirror_job(job_id, leader, fingerprint, req.projectId))
+        _mirror_tasks.add(task)
+        task.add_done_callback(_mirror_tasks.discard)
+        return {"jobId": job_id, "status": "queued", "coalescedWith": leader}
+
+    try:
+        await check_capacity(job_type)
+        job_id = await job_create(job_type, req.projectId, message=message, params=req.model_dump(), job_id=job_id)
+        queue = await enqueue_job(job_type, job_id, lambda: worker(job_id, req),
+                                  on_done=lambda: inflight.finish(fingerprint))
+    except BaseException as e:
+        inflight.finish(fingerprint, e)
+        raise
+    inflight.started(fingerprint, job_id)
+    return {"jobId": job_id, "status": "queued", "queue": queue}
 
 
-def job_append_log(job_id: str, msg: str):
-    db['job'].update_one({'_id': oid(job_id)}, {'$push': {'logs': f"{datetime.utcnow().isoformat()} - {msg}"}})
+async def idempotent_replay(job_id: str) -> Dict[str, Any]:
+    state = job_events.snapshot(job_id)
+    if state is None:
+        state = await get_job(job_id) or {}
+    resp = {"jobId": job_id, "status": state.get('status', 'queued'), "idempotentReplay": True}
+    if state.get('result'):
+        resp['result'] = state['result']
+    return resp
 
 
-def asset_create(kind: str, file_path: str, project_id: Optional[str] = None, meta: Dict[str, Any] = None) -> Dict[str, Any]:
-    url = f"/assets/{os.path.basename(file_path)}"
-    asset = {
+_MIRRORED_FIELDS = ('status', 'progress', 'message', 'result')
+
+
+async def _mirror_job(job_id: str, leader_id: str, fingerprint: str, project_id: Optional[str]):
+    """Follow a coalesced leader job and copy its progress, logs and result.
+
+    A follower on another project also gets the leader's files registered as its own project's assets.
+    """
+    await job_update(job_id, coalesced_with=leader_id)
+    leader_project = (job_events.snapshot(leader_id) or {}).get('project_id')
+    try:
+        async for _, kind, data in job_events.subscribe(leader_id):
+            if kind == 'log':
+                await record_log(job_id, data['line'])
+                job_events.publish(job_id, 'log', data)
+                continue
+            fields = {k: data[k] for k in _MIRRORED_FIELDS if k in data}
+            if fields.get('status') == 'done' and project_id != leader_project:
+                # Workers cache their result before reporting done, so the entry is there.
+                hit = await result_cache.get(fingerprint)
+                if hit is None:
+                    raise RuntimeError('Result of the coalesced job is no longer available')
+                await register_cached_assets(hit, project_id, fingerprint)
+            if fields:
+                await job_update(job_id, **fields)
+    except Exception as e:
+        await job_update(job_id, status='error', message=str(e))
+
+
+async def store_file(path: str) -> Dict[str, Any]:
+    """Move a staged render into the content-addressed asset store (see storage.py)."""
+    return await asyncio.get_running_loop().run_in_executor(None, asset_store.put, path)
+
+
+def path_url(path: str) -> str:
+    """Public URL of a file already in the asset store."""
+    return asset_store.url(asset_store.key_for_path(path))
+
+
+async def run_shared(shared: Optional[Dict[Any, asyncio.Future]], key, fn):
+    """`fn()`, computed once per `key` among the jobs of a batch that share `shared` (see _worker_batch).
+
+    Without a `shared` dict (a standalone job) this is just `await fn()`.
+    """
+    if shared is None:
+        return await fn()
+    fut = shared.get(key)
+    if fut is None:
+        fut = shared[key] = asyncio.ensure_future(fn())
+    else:
+        shared['_reused'] = shared.get('_reused', 0) + 1
+    # Shielded: a cancelled follower must not cancel the render the other variations wait for.
+    return await asyncio.shield(fut)
+
+
+def _asset_doc(stored: Dict[str, Any], kind: str, project_id: Optional[str] = None, meta: Dict[str, Any] = None,
+               intermediate: bool = False, **fields) -> Dict[str, Any]:
+    return {
         'project_id': project_id,
         'kind': kind,
-        'path': file_path,
-        'url': url,
+        'path': stored['path'],
+        'url': stored['url'],
+        'storage_key': stored['key'],
+        'digest': stored['digest'],
+        'size': stored['size'],
         'meta': meta or {},
-        'created_at': datetime.utcnow()
+        'retention': 'intermediate' if intermediate else 'final',
+        'created_at': datetime.utcnow(),
+        **fields,
     }
-    _id = db['asset'].insert_one(asset).inserted_id
+
+
+async def asset_create(kind: str, file_path: str, project_id: Optional[str] = None, meta: Dict[str, Any] = None,
+                       intermediate: bool = False, **fields) -> Dict[str, Any]:
+    """Store a staged file and register it; intermediate assets expire (see assetgc.py)."""
+    asset = _asset_doc(await store_file(file_path), kind, project_id, meta, intermediate, **fields)
+    _id = (await adb['asset'].insert_one(asset)).inserted_id
     asset['id'] = str(_id)
     return asset
 
 
+async def asset_create_many(items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Store several staged files in parallel and register them with one insert.
+
+    `items` are asset_create() keyword arguments (`kind`, `file_path`, ...); assets come back in the same order.
+    """
+    stored = await asyncio.gather(*(store_file(item['file_path']) for item in items))
+    assets = [_asset_doc(s, **{k: v for k, v in item.items() if k != 'file_path'}) for s, item in zip(stored, items)]
+    for asset, asset_id in zip(assets, await ainsert_many('asset', assets)):
+        asset['id'] = asset_id
+    return assets
+
+
+def asset_ref(asset: Dict[str, Any]) -> Dict[str, Any]:
+    """The parts of an asset worth keeping in a job checkpoint or the result cache."""
+    return {k: asset[k] for k in ('id', 'kind', 'path', 'url', 'meta', 'retention')}
+
+
+async def render_asset(ckpt: Checkpoint, step: str, kind: str, name: str, project_id: Optional[str], render,
+                       meta: Dict[str, Any] = None, intermediate: bool = False) -> Dict[str, Any]:
+    """Render `name` via `render(path)`, store and register it, unless `step` is already checkpointed."""
+    async def run():
+        path = asset_store.staging_path(name)
+        await render(path)
+        asset = await asset_create(kind, path, project_id, meta, intermediate=intermediate)
+        return {'asset': asset_ref(asset), 'paths': [asset['path']]}
+    return (await ckpt.step(step, run))['asset']
+
+
+async def render_stems(ckpt: Checkpoint, project_id: Optional[str], instruments: List[str], duration_sec: float,
+                       meta: Dict[str, Any], on_stem=None) -> List[Dict[str, Any]]:
+    """Render every stem in parallel; returns asset refs in instrument order.
+
+    Each stem is its own checkpoint step (`stem_<i>`), so a resumed job only renders the missing ones.
+    Finished stems are registered in batches of STEM_FLUSH_BATCH, one asset insert and one checkpoint
+    write per batch, and whatever finished is still registered when the job fails or is cancelled.
+    `on_stem(i, instrument)` is awaited in instrument order as each stem is rendered (or found in the
+    checkpoint).
+    """
+    done = {i: ckpt.get(f'stem_{i}') for i in range(len(instruments))}
+    todo = [i for i, outputs in done.items() if outputs is None]
+    ckpt.reused += len(instruments) - len(todo)
+    paths = {i: asset_store.staging_path("stem.wav") for i in todo}
+    renders = {i: asyncio.ensure_future(render_pool.run('silence', save_wav_silence, paths[i], duration_sec=duration_sec))
+               for i in todo}
+    unsaved: List[int] = []
+
+    async def flush():
+        batch = list(unsaved)
+        unsaved.clear()
+        if not batch:
+            return
+        assets = await asset_create_many([{'kind': 'wav', 'file_path': paths[i], 'project_id': project_id,
+                                           'meta': {'instrument': instruments[i], **meta}, 'intermediate': True}
+                                          for i in batch])
+        new = {f'stem_{i}': {'asset': asset_ref(a), 'paths': [a['path']]} for i, a in zip(batch, assets)}
+        await ckpt.save_many(new)
+        done.update({int(step[len('stem_'):]): outputs for step, outputs in new.items()})
+
+    try:
+        with STEP_SECONDS.time(step='stem'):
+            for i, inst in enumerate(instruments):
+                if i in renders:
+                    await renders[i]
+                    unsaved.append(i)
+                    if len(unsaved) >= STEM_FLUSH_BATCH:
+                        await flush()
+                if on_stem is not None:
+                    await on_stem(i, inst)
+    except BaseException:
+        for r in renders.values():
+            r.cancel()
+        unsaved.extend(i for i, r in renders.items()
+                       if i not in unsaved and done[i] is None and r.done() and not r.cancelled() and r.exception() is None)
+        try:
+            await flush()
+        except Exception:
+            logger.exception("Job %s: registering finished stems failed", ckpt.job_id)
+        raise
+    await flush()
+    return [done[i]['asset'] for i in range(len(instruments))]
+
+
 # ---------- Basic routes ----------
 
+@app.exception_handler(DatabaseUnavailable)
+async def database_unavailable(request: Request, exc: DatabaseUnavailable):
+    headers = {'Retry-After': str(int(exc.retry_after + 0.999))} if exc.retry_after else None
+    return JSONResponse(status_code=503, content={'detail': {'error': 'database_unavailable', 'message': str(exc)}},
+                        headers=headers)
+
+
 @app.get("/")
 async def root():
     return {"name": "AI Song Generator", "status": "ok", "mock": MOCK_MODE}
 
 
+@app.get("/healthz")
+async def liveness():
+    """The process is up and its event loop is serving requests; never touches the database."""
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+async def readiness():
+    """Ready to serve traffic: the (cached) database ping succeeds and the circuit is closed."""
+    probe = await aprobe()
+    ready = probe['ok'] and database.connection.breaker.state == 'closed'
+    return JSONResponse(status_code=200 if ready else 503,
+                        content={'status': 'ready' if ready else 'unavailable', 'database': probe})
+
+
 class CreateProjectBody(BaseModel):
     name: str
     tempo: int = 80
@@ -103,13 +627,14 @@ class CreateProjectBody(BaseModel):
 @app.post("/api/projects")
 async def create_project(body: CreateProjectBody):
     proj = Project(**body.model_dump())
-    pid = create_document('project', proj)
+    pid = await acreate_document('project', proj)
     return {"projectId": pid}
 
 
 @app.get("/api/projects/{project_id}")
 async def get_project(project_id: str):
-    doc = db['project'].find_one({'_id': oid(project_id)})
+    oid(project_id)
+    doc = await doc_cache.get('project', project_id, lambda: adb['project'].find_one({'_id': oid(project_id)}))
     if not doc:
         raise HTTPException(status_code=404, detail="Not found")
     doc['id'] = str(doc['_id'])
@@ -117,39 +642,80 @@ async def get_project(project_id: str):
     return doc
 
 
+MAX_PAGE_SIZE = 200
+_ASSET_LIST_FIELDS = {'kind': 1, 'url': 1, 'meta': 1, 'project_id': 1}
+_JOB_LIST_FIELDS = {'type': 1, 'status': 1, 'progress': 1, 'message': 1, 'project_id': 1}
+
+
+async def list_page(collection: str, query: Dict[str, Any], fields: Dict[str, int], limit: int,
+                    cursor: Optional[str]) -> Dict[str, Any]:
+    try:
+        docs, next_cursor = await apaginate(collection, query, fields, max(1, min(limit, MAX_PAGE_SIZE)), cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    for d in docs:
+        d['id'] = str(d.pop('_id'))
+    return {'items': docs, 'nextCursor': next_cursor}
+
+
+@app.get("/api/projects/{project_id}/assets")
+async def list_project_assets(project_id: str, kind: Optional[str] = None, limit: int = 50, cursor: Optional[str] = None):
+    """Assets of a project, newest first; pass `nextCursor` back as `cursor` for the next page."""
+    oid(project_id)
+    query: Dict[str, Any] = {'project_id': project_id}
+    if kind:
+        query['kind'] = kind
+    return await list_page('asset', query, _ASSET_LIST_FIELDS, limit, cursor)
+
+
+@app.get("/api/projects/{project_id}/jobs")
+async def list_project_jobs(project_id: str, status: Optional[str] = None, limit: int = 50, cursor: Optional[str] = None):
+    """Jobs of a project, newest first, without logs or results (see /api/job/{id}/status)."""
+    oid(project_id)
+    query: Dict[str, Any] = {'project_id': project_id}
+    if status:
+        query['status'] = status
+    page = await list_page('job', query, _JOB_LIST_FIELDS, limit, cursor)
+    for item in page['items']:
+        # Progress that is still in the write-behind buffer.
+        pending = job_state.overlay(item['id'], {})
+        item.update({k: v for k, v in pending.items() if k in _JOB_LIST_FIELDS})
+    return page
+
+
 # ---------- Generation endpoints (mock-mode) ----------
 
 @app.post("/api/generate/melody")
-async def generate_melody(req: GenerateMelodyRequest):
-    job_id = job_create('melody', req.projectId, message="Generating melody from lyrics...")
-    asyncio.create_task(_worker_melody(job_id, req))
-    return {"jobId": job_id, "status": "queued"}
+async def generate_melody(req: GenerateMelodyRequest, idempotency_key: Optional[str] = Header(None)):
+    return await submit_generation('melody', req, "Generating melody from lyrics...", 'Melody ready (cached)',
+                                   _worker_melody, idempotency_key)
 
 
 async def _worker_melody(job_id: str, req: GenerateMelodyRequest):
     try:
-        job_update(job_id, status='running', progress=5, message='Analyzing lyrics and style')
-        job_append_log(job_id, 'Parsing lyrics and estimating syllable counts')
-        await asyncio.sleep(0.5)
+        ckpt = await Checkpoint.load(job_id)
+        await job_update(job_id, status='running', progress=5, message='Analyzing lyrics and style')
+        await job_append_log(job_id, 'Parsing lyrics and estimating syllable counts')
 
         # Create dummy MIDI (text placeholder) and guide WAV
-        midi_name = f"melody_{uuid.uuid4().hex}.mid.txt"
-        midi_path = os.path.join(ASSETS_DIR, midi_name)
-        with open(midi_path, 'w') as f:
-            f.write(f"MIDI_PLACEHOLDER tempo={req.tempo} key={req.key} style={req.style}\n")
-            for i, line in enumerate(req.lyrics.splitlines()):
-                if line.strip():
-                    f.write(f"t={i*2.0:.2f}s lyric={line.strip()} note=C4 len=1.0\n")
-        job_update(job_id, progress=40, message='Draft melody created')
-        job_append_log(job_id, f'Melody file: {midi_name}')
-
-        guide_name = f"guide_{uuid.uuid4().hex}.wav"
-        guide_path = os.path.join(ASSETS_DIR, guide_name)
-        save_wav_silence(guide_path, duration_sec=max(4.0, min(60.0, req.tempo/10)))
-        job_update(job_id, progress=75, message='Rendering guide audio')
-
-        midi_asset = asset_create('midi', midi_path, req.projectId, meta={'tempo': req.tempo, 'key': req.key})
-        guide_asset = asset_create('wav', guide_path, req.projectId)
+        midi = [f"MIDI_PLACEHOLDER tempo={req.tempo} key={req.key} style={req.style}\n"]
+        for i, line in enumerate(req.lyrics.splitlines()):
+            if line.strip():
+                midi.append(f"t={i*2.0:.2f}s lyric={line.strip()} note=C4 len=1.0\n")
+
+        async def render_midi(path):
+            await asyncio.sleep(0.5)
+            await render_pool.run('file', write_text, path, ''.join(midi))
+        midi_asset = await render_asset(ckpt, 'midi', 'midi', "melody.mid.txt", req.projectId,
+                                        render_midi, meta={'tempo': req.tempo, 'key': req.key})
+        await job_update(job_id, progress=40, message='Draft melody created')
+        await job_append_log(job_id, f"Melody file: {os.path.basename(midi_asset['path'])}")
+
+        await job_update(job_id, progress=75, message='Rendering guide audio')
+        guide_asset = await render_asset(
+            ckpt, 'guide', 'wav', "guide.wav", req.projectId,
+            lambda p: render_pool.run('silence', save_wav_silence, p, duration_sec=max(4.0, min(60.0, req.tempo/10))),
+            intermediate=True)
 
         mapping = []
         t = 0.0
@@ -158,173 +724,219 @@ async def _worker_melody(job_id: str, req: GenerateMelodyRequest):
                 mapping.append({'start': round(t,2), 'end': round(t+2.0,2), 'text': line.strip()})
                 t += 2.0
         result = {"midiUrl": midi_asset['url'], "guideAudioUrl": guide_asset['url'], "timestamps": mapping}
-        job_update(job_id, status='done', progress=100, message='Melody ready', result=result)
+        # Cached before it is reported done: coalesced followers read their assets from the cache.
+        await result_cache.put(request_fingerprint('melody', req.model_dump()), 'melody', result, [midi_asset, guide_asset])
+        await job_update(job_id, status='done', progress=100, message='Melody ready', result=result)
     except Exception as e:
-        job_update(job_id, status='error', message=str(e))
+        await job_update(job_id, status='error', message=str(e))
 
 
 @app.post("/api/generate/instrumental")
-async def generate_instrumental(req: GenerateInstrumentalRequest):
-    job_id = job_create('instrumental', req.projectId, message="Generating instrumental stems...")
-    asyncio.create_task(_worker_instrumental(job_id, req))
-    return {"jobId": job_id, "status": "queued"}
+async def generate_instrumental(req: GenerateInstrumentalRequest, idempotency_key: Optional[str] = Header(None)):
+    return await submit_generation('instrumental', req, "Generating instrumental stems...",
+                                   'Instrumental stems ready (cached)', _worker_instrumental, idempotency_key)
 
 
-async def _worker_instrumental(job_id: str, req: GenerateInstrumentalRequest):
+async def _worker_instrumental(job_id: str, req: GenerateInstrumentalRequest,
+                               shared: Optional[Dict[Any, asyncio.Future]] = None):
     try:
-        job_update(job_id, status='running', progress=10, message='Preparing stems')
+        ckpt = await Checkpoint.load(job_id)
+        await job_update(job_id, status='running', progress=10, message='Preparing stems')
         await asyncio.sleep(0.5)
-        stems = []
         per = 70/max(1, len(req.instruments))
-        for i, inst in enumerate(req.instruments):
-            nm = f"stem_{inst.lower()}_{uuid.uuid4().hex}.wav"
-            pth = os.path.join(ASSETS_DIR, nm)
-            save_wav_silence(pth, duration_sec=min(30, req.length_sec))
-            asset = asset_create('wav', pth, req.projectId, meta={'instrument': inst, 'tempo': req.tempo, 'key': req.key})
-            stems.append(asset['url'])
-            job_update(job_id, progress=min(90, int(10+per*(i+1))), message=f'{inst} generated')
-        result = {"stems": stems}
-        job_update(job_id, status='done', progress=100, message='Instrumental stems ready', result=result)
+
+        async def on_stem(i, inst):
+            await job_update(job_id, progress=min(90, int(10+per*(i+1))), message=f'{inst} generated')
+        # All stems render in parallel; progress is still reported in instrument order.
+        # Batch variations share stems only when every rendering input matches.
+        stem_assets = await run_shared(
+            shared, ('stems', req.projectId, tuple(req.instruments), min(30, req.length_sec), req.tempo, req.key,
+                     req.style),
+            lambda: render_stems(ckpt, req.projectId, req.instruments, min(30, req.length_sec),
+                                 {'tempo': req.tempo, 'key': req.key, 'style': req.style}, on_stem=on_stem))
+        result = {"stems": [a['url'] for a in stem_assets]}
+        await result_cache.put(request_fingerprint('instrumental', req.model_dump()), 'instrumental', result, stem_assets)
+        await job_update(job_id, status='done', progress=100, message='Instrumental stems ready', result=result)
     except Exception as e:
-        job_update(job_id, status='error', message=str(e))
+        await job_update(job_id, status='error', message=str(e))
+
+
+UPLOAD_CHUNK_BYTES = 1024*1024
+MAX_CLIP_BYTES = 10*1024*1024
+VOICE_EXTENSIONS = ('.wav', '.mp3', '.amr')
+
+
+class ClipTooLarge(Exception):
+    pass
+
+
+def _copy_upload(src, dest_path: str, limit: int) -> int:
+    """Copy an upload to disk in fixed-size chunks, aborting as soon as it exceeds `limit`."""
+    written = 0
+    src.seek(0)
+    try:
+        with open(dest_path, 'wb') as out:
+            while True:
+                chunk = src.read(UPLOAD_CHUNK_BYTES)
+                if not chunk:
+                    break
+                written += len(chunk)
+                if written > limit:
+                    raise ClipTooLarge()
+                out.write(chunk)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(dest_path)
+        raise
+    return written
 
 
 @app.post("/api/upload/voice")
 async def upload_voice(files: List[UploadFile] = File(...), name: str = Form("Custom Voice"), locale: str = Form("bn"), gender: str = Form("female")):
     if len(files) < 1:
         raise HTTPException(status_code=400, detail="Upload at least 1 file")
-    saved = []
-    report: Dict[str, Any] = {"clips": []}
-    for f in files[:30]:
-        filename = f.filename.lower()
-        if not (filename.endswith('.wav') or filename.endswith('.mp3') or filename.endswith('.amr')):
+    files = files[:30]
+    for f in files:
+        if not (f.filename or '').lower().endswith(VOICE_EXTENSIONS):
             raise HTTPException(status_code=400, detail="Only WAV, MP3, AMR files allowed")
-        data = await f.read()
-        if len(data) > 10*1024*1024:
-            raise HTTPException(status_code=400, detail="Clip exceeds 10MB")
-        ext = os.path.splitext(filename)[1]
-        fname = f"voice_{uuid.uuid4().hex}{ext}"
-        fpath = os.path.join(ASSETS_DIR, fname)
-        with open(fpath, 'wb') as out:
-            out.write(data)
-        # basic checks (only for wav we can parse here)
-        channels = 0
-        sr = 0
-        dur = 0
-        if ext == '.wav':
+    loop = asyncio.get_running_loop()
+    saved = []
+    clips = []
+    staging = []
+    analyses = []
+    try:
+        for f in files:
+            ext = os.path.splitext(f.filename.lower())[1]
+            staged = asset_store.staging_path(f"voice{ext}")
+            staging.append(staged)
             try:
-                with contextlib.closing(wave.open(fpath, 'rb')) as wf:
-                    channels = wf.getnchannels()
-                    sr = wf.getframerate()
-                    frames = wf.getnframes()
-                    dur = frames/float(sr) if sr else 0
-            except Exception:
-                channels, sr, dur = 0, 0, 0
-        clip_report = {
-            'file': f"/assets/{fname}", 'channels': channels, 'sample_rate': sr,
-            'duration_sec': round(dur,2), 'mono_ok': channels == 1 if channels else False,
-            'sr_ok': 16000 <= sr <= 48000 if sr else False,
-            'converted': ext in ['.mp3', '.amr'],
-        }
-        report['clips'].append(clip_report)
-        saved.append(f"/assets/{fname}")
-    quality_ok = all((c['mono_ok'] and c['sr_ok']) or c['converted'] for c in report['clips'])
-    report['quality_ok'] = quality_ok
+                await loop.run_in_executor(None, _copy_upload, f.file, staged, MAX_CLIP_BYTES)
+            except ClipTooLarge:
+                raise HTTPException(status_code=400, detail="Clip exceeds 10MB")
+            stored = await store_file(staged)
+            clips.append(stored)
+            saved.append(stored['url'])
+            # Analyse this clip while the next one is still being written.
+            analyses.append(asyncio.ensure_future(render_pool.run('analysis', analyze_clip, stored['path'], stored['url'])))
+        report: Dict[str, Any] = build_report(list(await asyncio.gather(*analyses)))
+    except BaseException:
+        for t in analyses:
+            t.cancel()
+        # Stored clips may be shared with other uploads (same content); only staged leftovers are ours to delete.
+        for p in staging:
+            with contextlib.suppress(OSError):
+                os.remove(p)
+        raise
+    vid = ObjectId()
+    demo_path = asset_store.staging_path("voice_demo.wav")
+    await render_pool.run('silence', save_wav_silence, demo_path, duration_sec=2)
+    # Demo and clips are registered in one insert, then the profile is written complete.
+    demo, *_ = await asset_create_many(
+        [{'kind': 'voice', 'file_path': demo_path, 'meta': {'role': 'demo'}, 'voice_profile_id': str(vid)}]
+        + [{'kind': 'voice', 'file_path': c['path'], 'meta': {'role': 'clip'}, 'voice_profile_id': str(vid)}
+           for c in clips])
+    demo_url = demo['url']
     profile = VoiceProfile(name=name, locale=locale, gender=gender, files=saved, quality_report=report, preset=False).model_dump()
-    vid = db['voiceprofile'].insert_one(profile).inserted_id
-    demo_name = f"voice_demo_{uuid.uuid4().hex}.wav"
-    demo_path = os.path.join(ASSETS_DIR, demo_name)
-    save_wav_silence(demo_path, duration_sec=2)
-    demo_url = f"/assets/{demo_name}"
-    db['voiceprofile'].update_one({'_id': vid}, {'$set': {'demo_url': demo_url}})
+    await adb['voiceprofile'].insert_one({'_id': vid, **profile, 'demo_url': demo_url})
     return {"voiceProfileId": str(vid), "qualityReport": report, "demoUrl": demo_url}
 
 
 @app.delete("/api/voice/{voice_id}")
 async def delete_voice(voice_id: str):
-    res = db['voiceprofile'].delete_one({'_id': oid(voice_id)})
+    res = await adb['voiceprofile'].delete_one({'_id': oid(voice_id)})
     if res.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Not found")
+    # The clips themselves go with the next asset sweep, unless another profile shares them.
+    await adb['asset'].delete_many({'voice_profile_id': voice_id})
     return {"deleted": True}
 
 
 @app.post("/api/synthesize/vocal")
 async def synthesize_vocal(req: SynthesizeVocalRequest):
-    job_id = job_create('vocal', req.projectId, message='Synthesizing vocals')
-    asyncio.create_task(_worker_vocal(job_id, req))
-    return {"jobId": job_id}
+    await check_capacity('vocal')
+    job_id = await job_create('vocal', req.projectId, message='Synthesizing vocals', params=req.model_dump())
+    queue = await enqueue_job('vocal', job_id, lambda: _worker_vocal(job_id, req))
+    return {"jobId": job_id, "status": "queued", "queue": queue}
 
 
 async def _worker_vocal(job_id: str, req: SynthesizeVocalRequest):
     try:
-        job_update(job_id, status='running', progress=20, message='Adapting voice')
-        await asyncio.sleep(0.5)
-        takes = []
-        for i in range(2):
-            nm = f"vocal_take{i+1}_{uuid.uuid4().hex}.wav"
-            pth = os.path.join(ASSETS_DIR, nm)
-            save_wav_silence(pth, duration_sec=6)
-            takes.append(f"/assets/{nm}")
-        job_update(job_id, status='done', progress=100, message='Vocals ready', result={'takes': takes})
+        ckpt = await Checkpoint.load(job_id)
+        await job_update(job_id, status='running', progress=20, message='Adapting voice')
+
+        async def render_takes():
+            await asyncio.sleep(0.5)
+            paths = [asset_store.staging_path("vocal_take.wav") for _ in range(2)]
+            await asyncio.gather(*[render_pool.run('silence', save_wav_silence, p, duration_sec=6) for p in paths])
+            assets = await asset_create_many([{'kind': 'wav', 'file_path': p, 'project_id': req.projectId,
+                                               'meta': {'role': 'vocal_take'}, 'intermediate': True} for p in paths])
+            return {'paths': [a['path'] for a in assets]}
+        takes = [path_url(p) for p in (await ckpt.step('takes', render_takes))['paths']]
+        await job_update(job_id, status='done', progress=100, message='Vocals ready', result={'takes': takes})
     except Exception as e:
-        job_update(job_id, status='error', message=str(e))
+        await job_update(job_id, status='error', message=str(e))
 
 
 @app.post("/api/mix")
 async def mix(req: MixRequest):
-    job_id = job_create('mix', req.projectId, message='Mixing and mastering to -14 LUFS')
-    asyncio.create_task(_worker_mix(job_id, req))
-    return {"jobId": job_id}
+    await check_capacity('mix')
+    job_id = await job_create('mix', req.projectId, message=f'Mixing and mastering to {req.masterTargetLUFS:g} LUFS',
+                              params=req.model_dump())
+    queue = await enqueue_job('mix', job_id, lambda: _worker_mix(job_id, req))
+    return {"jobId": job_id, "status": "queued", "queue": queue}
 
 
 async def _worker_mix(job_id: str, req: MixRequest):
     try:
-        job_update(job_id, status='running', progress=30, message='Balancing tracks')
-        await asyncio.sleep(0.5)
-        master_nm = f"master_{uuid.uuid4().hex}.wav"
-        master_path = os.path.join(ASSETS_DIR, master_nm)
-        save_wav_silence(master_path, duration_sec=10)
-        master_asset = asset_create('wav', master_path, req.projectId, meta={'lufs': req.masterTargetLUFS})
-        stems_processed = []
-        for i in range(2):
-            nm = f"stem_processed_{i}_{uuid.uuid4().hex}.wav"
-            pth = os.path.join(ASSETS_DIR, nm)
-            save_wav_silence(pth, duration_sec=3)
-            asset = asset_create('wav', pth, req.projectId)
-            stems_processed.append(asset['url'])
-        job_update(job_id, status='done', progress=100, message='Master ready', result={'masterUrl': master_asset['url'], 'stemsProcessed': stems_processed})
+        ckpt = await Checkpoint.load(job_id)
+        await job_update(job_id, status='running', progress=10, message='Balancing tracks')
+        stem_paths = await asyncio.get_running_loop().run_in_executor(
+            None, stem_paths_from_urls, req.stems, asset_store.resolve_url)
+        await job_update(job_id, progress=30, message=f'Mixing {len(stem_paths)} stems')
+
+        async def render_master():
+            master_path = asset_store.staging_path("master.wav")
+            stats = await render_pool.run('mix', mix_stems, stem_paths, master_path,
+                                          gains_db=req.gains, target_lufs=req.masterTargetLUFS)
+            await job_append_log(job_id, f"Measured {stats['input_lufs']} LUFS, gain {stats['gain_db']} dB, "
+                                         f"limiter {stats['limiter_max_reduction_db']} dB")
+            asset = await asset_create('wav', master_path, req.projectId, meta={'lufs': req.masterTargetLUFS, 'mix': stats})
+            return {'asset': asset_ref(asset), 'paths': [asset['path']], 'stats': stats}
+        master = await ckpt.step('master', render_master)
+        mixed = master['stats'].get('mixed_stems', range(len(req.stems)))
+        await job_update(job_id, status='done', progress=100, message='Master ready', result={'masterUrl': master['asset']['url'], 'stemsProcessed': [req.stems[i] for i in mixed], 'loudness': master['stats']})
     except Exception as e:
-        job_update(job_id, status='error', message=str(e))
+        await job_update(job_id, status='error', message=str(e))
 
 
 @app.post("/api/generate/video")
 async def generate_video(req: GenerateVideoRequest):
-    job_id = job_create('video', req.projectId, message='Generating video with subtitles')
-    asyncio.create_task(_worker_video(job_id, req))
-    return {"jobId": job_id}
+    await check_capacity('video')
+    job_id = await job_create('video', req.projectId, message='Generating video with subtitles', params=req.model_dump())
+    queue = await enqueue_job('video', job_id, lambda: _worker_video(job_id, req))
+    return {"jobId": job_id, "status": "queued", "queue": queue}
 
 
 async def _worker_video(job_id: str, req: GenerateVideoRequest):
     try:
-        job_update(job_id, status='running', progress=25, message='Compositing scenes')
-        await asyncio.sleep(0.5)
-        # thumbnails
-        thumbs = []
-        for i in range(4):
-            name = f"thumb_{uuid.uuid4().hex}.png"
-            path = os.path.join(ASSETS_DIR, name)
-            with open(path, 'wb') as f:
-                f.write(os.urandom(128))
-            thumbs.append(f"/assets/{name}")
-        vid_name = f"video_{uuid.uuid4().hex}.mp4"
-        vid_path = os.path.join(ASSETS_DIR, vid_name)
+        ckpt = await Checkpoint.load(job_id)
+        await job_update(job_id, status='running', progress=25, message='Compositing scenes')
+
+        async def render_thumbnails():
+            await asyncio.sleep(0.5)
+            paths = [asset_store.staging_path("thumb.png") for _ in range(4)]
+            await asyncio.gather(*[render_pool.run('file', write_placeholder, p, 128) for p in paths])
+            assets = await asset_create_many([{'kind': 'image', 'file_path': p, 'project_id': req.projectId}
+                                              for p in paths])
+            return {'paths': [a['path'] for a in assets]}
+        thumbs = [path_url(p) for p in (await ckpt.step('thumbnails', render_thumbnails))['paths']]
         # placeholder mp4 (not a real mp4, but a stub file for demo)
-        with open(vid_path, 'wb') as f:
-            f.write(os.urandom(2048))
-        video_asset = asset_create('video', vid_path, req.projectId, meta={'aspectRatio': req.aspectRatio, 'style': req.style})
-        job_update(job_id, status='done', progress=100, message='Video ready', result={'videoUrl': video_asset['url'], 'thumbnails': thumbs})
+        video_asset = await render_asset(ckpt, 'video', 'video', "video.mp4", req.projectId,
+                                         lambda p: render_pool.run('file', write_placeholder, p, 2048),
+                                         meta={'aspectRatio': req.aspectRatio, 'style': req.style})
+        await job_update(job_id, status='done', progress=100, message='Video ready', result={'videoUrl': video_asset['url'], 'thumbnails': thumbs})
     except Exception as e:
-        job_update(job_id, status='error', message=str(e))
+        await job_update(job_id, status='error', message=str(e))
 
 
 @app.post("/api/generate/create")
@@ -333,84 +945,585 @@ async def generate_create(body: Dict[str, Any]):
     project_id = body.get('projectId')
     if not project_id:
         raise HTTPException(status_code=400, detail='projectId required')
-    job_id = job_create('create', project_id, message='Starting full pipeline')
-    asyncio.create_task(_worker_full(job_id, body))
-    return {"jobId": job_id}
-
-
-async def _worker_full(job_id: str, body: Dict[str, Any]):
-    try:
-        project_id = body['projectId']
-        tempo = int(body.get('tempo', 80))
-        key = body.get('key', 'C minor')
-        lyrics = body.get('lyrics', '')
-        instruments = body.get('instruments', ['Piano'])
-        style = body.get('style', 'Romantic')
-
-        # Instrumental
-        job_update(job_id, status='running', progress=5, message='Instrumental')
+    await check_capacity('create')
+    job_id = await job_create('create', project_id, message='Starting full pipeline', params=body)
+    queue = await enqueue_job('create', job_id, lambda: _worker_full(job_id, body))
+    return {"jobId": job_id, "status": "queued", "queue": queue}
+
+
+# Result keys each pipeline stage contributes, in the order they become available.
+_FULL_RESULT_KEYS = {
+    'instrumental': ('stems',),
+    'melody': ('midiUrl',),
+    'vocal': ('vocalUrl',),
+    'mix': ('masterUrl',),
+    'video_prep': ('thumbnails',),
+    'video': ('videoUrl',),
+}
+
+
+def full_pipeline(project_id: str, body: Dict[str, Any], ckpt: Checkpoint,
+                  shared: Optional[Dict[Any, asyncio.Future]] = None) -> Pipeline:
+    """Stage graph for /api/generate/create.
+
+    instrumental ─────────────┐
+    melody ──> vocal ─────────┴─> mix ──┐
+    video_prep (scenes, thumbnails) ────┴─> video
+
+    Every stage records its outputs in the job checkpoint before it counts as
+    done; stems are additionally checkpointed one by one. Within a batch
+    (`shared`), a stage runs once for all variations that give it the same
+    inputs, e.g. a grid over instrument sets renders one melody and one vocal.
+    """
+    tempo = int(body.get('tempo', 80))
+    key = body.get('key', 'C minor')
+    instruments = body.get('instruments', ['Piano'])
+    style = body.get('style', 'Romantic')
+
+    async def instrumental(_):
         await asyncio.sleep(0.5)
-        inst_urls = []
-        for inst in instruments:
-            nm = f"stem_{inst.lower()}_{uuid.uuid4().hex}.wav"
-            pth = os.path.join(ASSETS_DIR, nm)
-            save_wav_silence(pth, duration_sec=6)
-            inst_urls.append(f"/assets/{nm}")
-        # Melody
-        job_update(job_id, progress=25, message='Melody')
-        await asyncio.sleep(0.3)
-        midi_name = f"melody_{uuid.uuid4().hex}.mid.txt"
-        midi_path = os.path.join(ASSETS_DIR, midi_name)
-        with open(midi_path, 'w') as f:
-            f.write(f"MIDI_PLACEHOLDER tempo={tempo} key={key} style={style}\n")
-        midi_url = f"/assets/{midi_name}"
-        # Vocal
-        job_update(job_id, progress=45, message='Vocal Synthesis')
+        assets = await render_stems(ckpt, project_id, instruments, 6, {'tempo': tempo, 'key': key, 'style': style})
+        return {'stems': [a['url'] for a in assets], 'asset_ids': [a['id'] for a in assets],
+                'paths': [a['path'] for a in assets]}
+
+    async def melody(_):
         await asyncio.sleep(0.3)
-        vocal_nm = f"vocal_{uuid.uuid4().hex}.wav"
-        vocal_path = os.path.join(ASSETS_DIR, vocal_nm)
-        save_wav_silence(vocal_path, duration_sec=6)
-        vocal_url = f"/assets/{vocal_nm}"
-        # Mix
-        job_update(job_id, progress=70, message='Mix & Master')
+        asset = await render_asset(
+            ckpt, 'melody_midi', 'midi', "melody.mid.txt", project_id,
+            lambda p: render_pool.run('file', write_text, p, f"MIDI_PLACEHOLDER tempo={tempo} key={key} style={style}\n"),
+            meta={'tempo': tempo, 'key': key})
+        return {'midiUrl': asset['url'], 'asset_ids': [asset['id']], 'paths': [asset['path']]}
+
+    async def vocal(_):
         await asyncio.sleep(0.3)
-        master_nm = f"master_{uuid.uuid4().hex}.wav"
-        master_path = os.path.join(ASSETS_DIR, master_nm)
-        save_wav_silence(master_path, duration_sec=8)
-        master_url = f"/assets/{master_nm}"
-        # Video
-        job_update(job_id, progress=85, message='Video')
+        asset = await render_asset(ckpt, 'vocal_take', 'wav', "vocal.wav", project_id,
+                                   lambda p: render_pool.run('silence', save_wav_silence, p, duration_sec=6),
+                                   meta={'role': 'vocal'}, intermediate=True)
+        return {'vocalUrl': asset['url'], 'asset_ids': [asset['id']], 'paths': [asset['path']]}
+
+    async def mix(deps):
         await asyncio.sleep(0.3)
-        vid_name = f"video_{uuid.uuid4().hex}.mp4"
-        vid_path = os.path.join(ASSETS_DIR, vid_name)
-        with open(vid_path, 'wb') as f:
-            f.write(os.urandom(4096))
-        video_url = f"/assets/{vid_name}"
-
-        result = {
-            'stems': inst_urls,
-            'midiUrl': midi_url,
-            'vocalUrl': vocal_url,
-            'masterUrl': master_url,
-            'videoUrl': video_url,
-        }
-        job_update(job_id, status='done', progress=100, message='Done', result=result)
+        master_path = asset_store.staging_path("master.wav")
+        stems = deps['instrumental']['paths'] + deps['vocal']['paths']
+        stats = await render_pool.run('mix', mix_stems, stems, master_path)
+        asset = await asset_create('wav', master_path, project_id, meta={'lufs': stats['target_lufs'], 'mix': stats})
+        return {'masterUrl': asset['url'], 'asset_ids': [asset['id']], 'paths': [asset['path']]}
+
+    async def video_prep(_):
+        await asyncio.sleep(0.15)
+        paths = [asset_store.staging_path("thumb.png") for _ in range(4)]
+        await asyncio.gather(*[render_pool.run('file', write_placeholder, p, 128) for p in paths])
+        assets = await asset_create_many([{'kind': 'image', 'file_path': p, 'project_id': project_id} for p in paths])
+        return {'thumbnails': [a['url'] for a in assets], 'asset_ids': [a['id'] for a in assets],
+                'paths': [a['path'] for a in assets]}
+
+    async def video(_):
+        await asyncio.sleep(0.15)
+        vid_path = asset_store.staging_path("video.mp4")
+        await render_pool.run('file', write_placeholder, vid_path, 4096)
+        asset = await asset_create('video', vid_path, project_id, meta={'style': style})
+        return {'videoUrl': asset['url'], 'asset_ids': [asset['id']], 'paths': [asset['path']]}
+
+    # The parameters each stage's output depends on, including those of the stages it depends on.
+    inputs = {
+        'instrumental': (tuple(instruments), tempo, key, style),
+        'melody': (tempo, key, style),
+        'vocal': (tempo, key, style),
+        'mix': (tuple(instruments), tempo, key, style),
+        'video_prep': (),
+        'video': (tuple(instruments), tempo, key, style),
+    }
+
+    def checkpointed(name, fn):
+        def run(deps):
+            return ckpt.step(name, lambda: run_shared(shared, (name, project_id) + inputs[name], lambda: fn(deps)))
+        return run
+
+    return Pipeline([
+        Stage('instrumental', checkpointed('instrumental', instrumental), expected_sec=0.6),
+        Stage('melody', checkpointed('melody', melody), expected_sec=0.35),
+        Stage('vocal', checkpointed('vocal', vocal), ('melody',), expected_sec=0.35),
+        Stage('mix', checkpointed('mix', mix), ('instrumental', 'vocal'), expected_sec=0.4),
+        Stage('video_prep', checkpointed('video_prep', video_prep), expected_sec=0.2),
+        Stage('video', checkpointed('video', video), ('mix', 'video_prep'), expected_sec=0.2),
+    ])
+
+
+def _full_result(outputs: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    return {k: outputs[stage][k] for stage, keys in _FULL_RESULT_KEYS.items() if stage in outputs for k in keys}
+
+
+async def _worker_full(job_id: str, body: Dict[str, Any], shared: Optional[Dict[Any, asyncio.Future]] = None):
+    try:
+        ckpt = await Checkpoint.load(job_id)
+        pipeline = full_pipeline(body['projectId'], body, ckpt, shared)
+        done = {}
+        for name in pipeline.stages:
+            recorded = ckpt.get(name)
+            if recorded is not None:
+                done[name] = recorded
+        outputs: Dict[str, Dict[str, Any]] = dict(done)
+        if done:
+            await job_append_log(job_id, f"Resuming; reusing stages {', '.join(sorted(done))}")
+        await job_update(job_id, status='running', progress=1, message='Starting stages', result=_full_result(outputs))
+
+        async def on_event(kind: str, stage: str, info: Dict[str, Any]):
+            running = ', '.join(info['running'])
+            fields: Dict[str, Any] = {'progress': max(1, min(99, int(info['progress'] * 100)))}
+            if kind == 'done':
+                # Publish this stage's assets right away; clients can fetch stems before the video exists.
+                outputs[stage] = info['outputs']
+                fields['result'] = _full_result(outputs)
+                fields['message'] = f"{stage} done" + (f"; running {running}" if running else '')
+                await job_append_log(job_id, f"Stage {stage} finished in {info['elapsed_sec']}s")
+            elif kind == 'start':
+                fields['message'] = f"Running {running}"
+            await job_update(job_id, **fields)
+
+        outputs = await pipeline.run(on_event, done=done)
+        await job_update(job_id, status='done', progress=100, message='Done', result=_full_result(outputs))
+    except StageFailed as e:
+        await job_update(job_id, status='error', message=f"Stage {e.stage} failed: {e.error}")
+    except Exception as e:
+        await job_update(job_id, status='error', message=str(e))
+
+
+# ---------- Batches ----------
+
+_BATCH_KINDS = ('create', 'instrumental')
+
+
+def expand_batch(req: BatchGenerateRequest) -> List[Tuple[Dict[str, Any], Dict[str, Any]]]:
+    """(full parameters, varied parameters) of every variation: the grid's combinations, then `variations`."""
+    base = dict(req.base)
+    if req.projectId:
+        base.setdefault('projectId', req.projectId)
+    varied = [dict(zip(req.grid, values)) for values in itertools.product(*req.grid.values())] if req.grid else []
+    varied += [dict(v) for v in req.variations]
+    return [({**base, **v}, v) for v in varied]
+
+
+def _check_variation(kind: str, index: int, params: Dict[str, Any]):
+    try:
+        if kind == 'instrumental':
+            GenerateInstrumentalRequest(**params)
+        elif not params.get('projectId'):
+            raise ValueError('projectId required')
     except Exception as e:
-        job_update(job_id, status='error', message=str(e))
+        raise HTTPException(status_code=400, detail={'error': 'invalid_variation', 'index': index, 'message': str(e)})
+
+
+@app.post("/api/generate/batch")
+async def generate_batch(req: BatchGenerateRequest):
+    """Render many parameter sets (e.g. a style x tempo grid) as one parent job with a child job each.
+
+    The children run inside the parent job and share every stage whose inputs they have in common.
+    Each child has its own status URL; the parent's result aggregates them.
+    """
+    if req.kind not in _BATCH_KINDS:
+        raise HTTPException(status_code=400, detail=f"kind must be one of {', '.join(_BATCH_KINDS)}")
+    variations = expand_batch(req)
+    if not variations:
+        raise HTTPException(status_code=400, detail='Give a grid or at least one variation')
+    if len(variations) > BATCH_MAX_VARIATIONS:
+        raise HTTPException(status_code=400, detail=f'At most {BATCH_MAX_VARIATIONS} variations per batch')
+    for i, (params, _) in enumerate(variations):
+        _check_variation(req.kind, i, params)
+    for project_id in {params['projectId'] for params, _ in variations} - {req.projectId}:
+        excess = asset_sweeper.over_quota(project_id)
+        if excess:
+            raise HTTPException(status_code=507, detail={'error': 'quota_exceeded', 'projectId': project_id,
+                                                         'excessBytes': excess})
+    voice_id = req.base.get('voiceProfileId')
+    if voice_id and not await adb['voiceprofile'].find_one({'_id': oid(voice_id)}, {'_id': 1}):
+        raise HTTPException(status_code=404, detail='Voice profile not found')
+    await check_capacity('batch')
+    job_id = await job_create('batch', req.projectId, message=f'Queued {len(variations)} variations',
+                              params=req.model_dump())
+    children = [{**Job(type=req.kind, project_id=params['projectId'], message='Queued in batch', params=params,
+                       runner=INSTANCE_ID).model_dump(),
+                 'parent_id': job_id, 'batch_index': i, 'variation': varied}
+                for i, (params, varied) in enumerate(variations)]
+    child_ids = await acreate_documents('job', children)  # one round trip for the whole batch
+    for child_id, doc in zip(child_ids, children):
+        job_events.open(child_id, {k: doc[k] for k in ('type', 'project_id', 'status', 'progress', 'message')})
+    await job_update(job_id, children=child_ids)
+    queue = await enqueue_job('batch', job_id, lambda: _worker_batch(job_id, req))
+    return {"jobId": job_id, "status": "queued", "children": child_ids, "queue": queue}
+
+
+def _batch_result(children: List[Dict[str, Any]], reused: int) -> Dict[str, Any]:
+    items = []
+    for child in children:
+        item = {'jobId': str(child['_id']), 'variation': child.get('variation', {}), 'status': child.get('status')}
+        if child.get('status') == 'done':
+            item['result'] = child.get('result')
+        elif child.get('status') == 'error':
+            item['message'] = child.get('message')
+        items.append(item)
+    return {
+        'total': len(items),
+        'done': sum(1 for i in items if i['status'] == 'done'),
+        'failed': sum(1 for i in items if i['status'] == 'error'),
+        'sharedStages': reused,
+        'children': items,
+    }
+
+
+async def _worker_batch(job_id: str, req: BatchGenerateRequest):
+    try:
+        children = await adb['job'].find({'parent_id': job_id},
+                                         {'type': 1, 'project_id': 1, 'params': 1, 'variation': 1, 'status': 1,
+                                          'message': 1, 'result': 1},
+                                         sort=[('batch_index', 1)])
+        await job_update(job_id, status='running', progress=1, message=f'Rendering {len(children)} variations')
+        shared: Dict[Any, Any] = {}
+        slots = asyncio.Semaphore(max(1, BATCH_CONCURRENCY))
+        finished = 0
+
+        async def run_child(child):
+            nonlocal finished
+            child_id = str(child['_id'])
+            if child.get('status') not in TERMINAL_STATUSES:
+                async with slots:
+                    if child['type'] == 'instrumental':
+                        await _worker_instrumental(child_id, GenerateInstrumentalRequest(**child['params']), shared)
+                    else:
+                        await _worker_full(child_id, child['params'], shared)
+                # The child's final status/result/message, while its event channel is still retained.
+                child.update(job_events.snapshot(child_id) or {})
+            finished += 1
+            await job_update(job_id, progress=max(1, min(99, int(100 * finished / len(children)))),
+                             message=f'{finished}/{len(children)} variations finished',
+                             result=_batch_result(children, shared.get('_reused', 0)))
+
+        await asyncio.gather(*(run_child(c) for c in children))
+        result = _batch_result(children, shared.get('_reused', 0))
+        if result['failed'] == result['total']:
+            await job_update(job_id, status='error', message='Every variation failed', result=result)
+        else:
+            failed = f", {result['failed']} failed" if result['failed'] else ''
+            await job_update(job_id, status='done', progress=100,
+                             message=f"{result['done']} variations ready{failed}", result=result)
+    except Exception as e:
+        await job_update(job_id, status='error', message=str(e))
+
+
+# ---------- Resuming after a restart ----------
+
+# job type -> (request model or None for a plain dict body, worker)
+_RESUMABLE = {
+    'melody': (GenerateMelodyRequest, _worker_melody),
+    'instrumental': (GenerateInstrumentalRequest, _worker_instrumental),
+    'vocal': (SynthesizeVocalRequest, _worker_vocal),
+    'mix': (MixRequest, _worker_mix),
+    'video': (GenerateVideoRequest, _worker_video),
+    'create': (None, _worker_full),
+    'batch': (BatchGenerateRequest, _worker_batch),
+}
+_ACTIVE_STATUSES = ['queued', 'running']
+
+
+async def resume_orphaned_jobs() -> int:
+    """Re-queue jobs another server process left queued or running when it died.
+
+    A job's runner counts as dead once its heartbeat (see RunnerHeartbeat) is
+    stale or gone, so jobs of live sibling processes are left alone. Each job is
+    claimed with a conditional update, so two processes starting together never
+    resume the same job twice. Workers pick up from their checkpoint. Runs at
+    startup and after every heartbeat.
+    """
+    live = await runners.live()
+    # Batch children are resumed by their parent job.
+    orphans = await adb['job'].find({'status': {'$in': _ACTIVE_STATUSES}, 'runner': {'$nin': live},
+                                     'lease_until': {'$exists': False}, 'parent_id': {'$exists': False}},
+                                    {'type': 1, 'project_id': 1, 'params': 1, 'coalesced_with': 1},
+                                    sort=[('created_at', 1)])
+    # Leaders first, so coalesced followers find their leader's channel open again.
+    orphans.sort(key=lambda d: bool(d.get('coalesced_with')))
+    resumed = 0
+    for doc in orphans:
+        claimed = await adb['job'].find_one_and_update(
+            {'_id': doc['_id'], 'status': {'$in': _ACTIVE_STATUSES}, 'runner': {'$nin': live},
+             'lease_until': {'$exists': False}},
+            {'$set': {'runner': INSTANCE_ID}, '$inc': {'resumed': 1}})
+        if claimed is not None and await _resume_job(str(doc['_id']), doc):
+            resumed += 1
+    if orphans:
+        logger.info("Resumed %d of %d orphaned jobs", resumed, len(orphans))
+    return resumed
+
+
+async def _resume_job(job_id: str, doc: Dict[str, Any]) -> bool:
+    job_type = doc.get('type')
+    job_events.open(job_id, {'type': job_type, 'project_id': doc.get('project_id'), 'status': 'queued',
+                             'progress': 0, 'message': 'Resuming after restart'})
+    leader_id = doc.get('coalesced_with')
+    if leader_id:
+        fingerprint = request_fingerprint(job_type, doc.get('params') or {})
+        leader = await adb['job'].find_one({'_id': oid(leader_id)}, {'logs': 0, 'checkpoint': 0})
+        if leader and leader.get('status') in TERMINAL_STATUSES:
+            hit = None
+            if leader['status'] == 'done' and leader.get('project_id') != doc.get('project_id'):
+                hit = await result_cache.get(fingerprint)
+                if hit is None:
+                    await job_update(job_id, status='error', message='Result of the coalesced job is no longer available')
+                    return False
+                await register_cached_assets(hit, doc.get('project_id'), fingerprint)
+            await job_update(job_id, **{k: leader[k] for k in _MIRRORED_FIELDS if k in leader})
+            return True
+        if job_events.has(leader_id):
+            task = asyncio.create_task(_mirror_job(job_id, leader_id, fingerprint, doc.get('project_id')))
+            _mirror_tasks.add(task)
+            task.add_done_callback(_mirror_tasks.discard)
+            return True
+    elif job_type in _RESUMABLE and doc.get('params'):
+        model, worker = _RESUMABLE[job_type]
+        try:
+            req = model(**doc['params']) if model else doc['params']
+        except Exception as e:
+            await job_update(job_id, status='error', message=f'Cannot resume: {e}')
+            return False
+        factory = lambda: worker(job_id, req)
+        if job_type in ('melody', 'instrumental'):
+            # Let identical new submissions coalesce onto the resumed job again.
+            fingerprint = request_fingerprint(job_type, doc['params'])
+            if inflight.claim(fingerprint):
+                inflight.started(fingerprint, job_id)
+                factory = _then(factory, lambda: inflight.finish(fingerprint))
+        try:
+            scheduler.submit(job_type, job_id, factory)
+        except QueueFull:
+            await job_update(job_id, status='error', message='Interrupted by a server restart; queue full on resume')
+            return False
+        await job_update(job_id, status='queued', message='Resuming after restart')
+        return True
+    await job_update(job_id, status='error', message='Interrupted by a server restart')
+    return False
+
+
+# ---------- Distributed execution ----------
+
+async def run_leased_job(doc: Dict[str, Any]):
+    """Entry point for a job claimed through a lease (runs inside worker.py)."""
+    job_id = str(doc['_id'])
+    model, worker = _RESUMABLE.get(doc.get('type'), (None, None))
+    if worker is None or not doc.get('params'):
+        await job_update(job_id, status='error', message=f"No worker for job type '{doc.get('type')}'")
+        return
+    created = doc.get('created_at')
+    wait_ms = int((datetime.utcnow() - created.replace(tzinfo=None)).total_seconds() * 1000) if created else 0
+    lane = next((name for name, p in LANES.items() if p == doc.get('priority')), 'normal')
+    await job_update(job_id, queue={'lane': lane, 'position': 0, 'wait_ms': wait_ms,
+                                    'worker': leases.owner, 'attempt': doc.get('attempts', 1)})
+    req = model(**doc['params']) if model else doc['params']
+    await worker(job_id, req)
+
+
+async def fail_exhausted_job(doc: Dict[str, Any]):
+    await job_update(str(doc['_id']), status='error',
+                     message=f"Failed after {leases.max_attempts} attempts (worker crashed or timed out)")
+
+
+def watch_remote_job(job_id: str, on_done=None, known: Optional[Dict[str, Any]] = None):
+    """Relay a job that another process executes into this process's event channel.
+
+    `known` is the job state the channel was opened with, so it is not published twice.
+    """
+    if job_id in _watchers:
+        return
+    task = asyncio.create_task(_watch_remote_job(job_id, on_done, known or {}), name=f"watch-{job_id}")
+    _watchers[job_id] = task
+    task.add_done_callback(lambda _: _watchers.pop(job_id, None))
+
+
+_WATCHED_FIELDS = ('status', 'progress', 'message', 'result', 'queue')
+
+
+async def _watch_remote_job(job_id: str, on_done, known: Dict[str, Any]):
+    seen = {k: known[k] for k in _WATCHED_FIELDS if k in known}
+    interval = REMOTE_POLL_SEC
+    try:
+        # Lines already in `known` were published with it; relay only newer ones.
+        cursor = await job_logs.latest(job_id) if known.get('logs') else None
+        while True:
+            await asyncio.sleep(interval)
+            doc = await adb['job'].find_one({'_id': oid(job_id)}, {'checkpoint': 0, 'params': 0, 'logs': 0})
+            if doc is None:
+                return
+            lines, cursor = await job_logs.tail(job_id, after=cursor)
+            for item in lines:
+                job_events.publish(job_id, 'log', {'line': item['line']})
+            changed = {k: doc[k] for k in _WATCHED_FIELDS if k in doc and seen.get(k) != doc[k]}
+            seen.update(changed)
+            terminal = doc.get('status') in TERMINAL_STATUSES
+            if changed:
+                job_events.publish(job_id, 'end' if terminal else 'update', changed)
+            # Back off while nothing happens (e.g. waiting for a free worker).
+            interval = REMOTE_POLL_SEC if changed or lines else min(5.0, interval * 2)
+            if terminal:
+                return
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        logger.exception("Watching remote job %s failed", job_id)
+    finally:
+        if on_done is not None:
+            on_done()
+
+
+async def get_job(job_id: str) -> Optional[Dict[str, Any]]:
+    """A job as /status shows it (no checkpoint), through the document cache."""
+    async def load():
+        doc = await adb['job'].find_one({'_id': oid(job_id)}, {'checkpoint': 0})
+        return job_state.overlay(job_id, doc) if doc else None
+    return await doc_cache.get('job', job_id, load)
 
 
 @app.get("/api/job/{job_id}/status")
 async def job_status(job_id: str):
-    j = db['job'].find_one({'_id': oid(job_id)})
+    oid(job_id)
+    j = await get_job(job_id)
     if not j:
         raise HTTPException(status_code=404, detail='Job not found')
-    j['id'] = str(j['_id'])
+    j['id'] = job_id
     j.pop('_id', None)
+    if j.get('status') == 'queued':
+        live = scheduler.queue_info(j.get('type'), j['id'])
+        if live:
+            j['queue'] = live
     return j
 
 
+@app.get("/api/job/{job_id}/logs")
+async def job_log_tail(job_id: str, after: Optional[str] = None, limit: int = 200):
+    """A job's log lines after cursor `after`, oldest first; poll again with `nextCursor` to follow it."""
+    oid(job_id)
+    try:
+        items, next_cursor = await job_logs.tail(job_id, after, max(1, min(limit, 1000)))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {'items': items, 'nextCursor': next_cursor}
+
+
+@app.get("/api/job/{job_id}/events")
+async def job_events_stream(job_id: str, request: Request, lastEventId: Optional[int] = None):
+    """Server-Sent Events stream of a job's updates, log lines and final result."""
+    header_id = request.headers.get('last-event-id')
+    last_id = int(header_id) if header_id and header_id.isdigit() else lastEventId
+    if not job_events.has(job_id):
+        # Not published by this process (finished and expired, or never seen): one read.
+        j = await adb['job'].find_one({'_id': oid(job_id)})
+        if not j:
+            raise HTTPException(status_code=404, detail='Job not found')
+        j.pop('_id', None)
+        job_state.overlay(job_id, j)
+        if j.get('status') in TERMINAL_STATUSES:
+            snapshot = sse_format((0, 'snapshot', j))
+            return StreamingResponse(iter([snapshot]), media_type='text/event-stream')
+        job_events.open(job_id, j)
+        # Run by another process (a lease worker, or another server process in local mode):
+        # nothing publishes here, so relay its progress from Mongo.
+        if JOB_EXECUTION == 'distributed' or j.get('runner') != INSTANCE_ID:
+            watch_remote_job(job_id, known=j)
+    return StreamingResponse(
+        _sse_events(job_id, last_id),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+
+async def _sse_events(job_id: str, last_id: Optional[int], keepalive_sec: float = 15.0):
+    events = job_events.subscribe(job_id, last_id)
+    pending = None
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(events.__anext__())
+            done, _ = await asyncio.wait({pending}, timeout=keepalive_sec)
+            if not done:
+                yield ": keepalive\n\n"
+                continue
+            try:
+                event = pending.result()
+            except StopAsyncIteration:
+                return
+            pending = None
+            yield sse_format(event)
+    finally:
+        if pending is not None:
+            pending.cancel()
+        await events.aclose()
+
+
+@app.get("/api/cache/stats")
+async def cache_stats():
+    return {'results': result_cache.stats(), 'inflight': inflight.stats(), 'idempotency': idempotency.stats(),
+            'documents': doc_cache.stats()}
+
+
+@app.get("/api/queue/stats")
+async def queue_stats():
+    return {**scheduler.stats(), 'job_writes': job_state.stats(), 'job_events': job_events.stats(),
+            'render': render_pool.stats(), 'delivery': asset_files.stats(), 'storage': asset_store.stats(),
+            'gc': asset_sweeper.stats(), 'job_logs': job_logs.stats(), 'profiling': profiler.stats(),
+            'loop_watchdog': loop_watchdog.stats(), 'runners': runners.stats(),
+            'database': database.connection.stats()}
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics_endpoint():
+    if not metrics.ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    return PlainTextResponse(REGISTRY.render(), media_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def require_profiling(token: Optional[str]):
+    if not profiler.enabled:
+        raise HTTPException(status_code=404, detail="Profiling is disabled")
+    if not profiler.authorized(token):
+        raise HTTPException(status_code=403, detail="Invalid profile token")
+
+
+@app.post("/api/admin/profile")
+async def capture_profile(seconds: float = 10.0, x_profile_token: Optional[str] = Header(None)):
+    """Profile everything the event loop runs for the next `seconds` (capped at PROFILE_MAX_SEC)."""
+    require_profiling(x_profile_token)
+    try:
+        return await profiler.window(seconds)
+    except ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+
+@app.get("/api/admin/profiles")
+async def list_profiles(x_profile_token: Optional[str] = Header(None)):
+    require_profiling(x_profile_token)
+    return {'items': profiler.list()}
+
+
+@app.get("/api/admin/profiles/{profile_id}")
+async def download_profile(profile_id: str, format: str = 'prof', x_profile_token: Optional[str] = Header(None)):
+    """The pstats dump (`format=prof`) or the text summary (`format=txt`) of a capture."""
+    require_profiling(x_profile_token)
+    path = profiler.path(profile_id, format)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    if format == 'txt':
+        return FileResponse(path, media_type='text/plain; charset=utf-8')
+    return FileResponse(path, media_type='application/octet-stream', filename=os.path.basename(path))
+
+
+@app.post("/api/assets/gc")
+async def run_asset_gc():
+    """Run an asset sweep now instead of waiting for the next interval."""
+    report = await asset_sweeper.sweep()
+    if not report:
+        raise HTTPException(status_code=409, detail="Another process is sweeping")
+    return report
+
+
 @app.get("/test")
-def test_database():
+async def test_database():
     response = {
         "backend": "✅ Running",
         "database": "❌ Not Available",
@@ -419,26 +1532,24 @@ def test_database():
         "connection_status": "Not Connected",
         "collections": []
     }
-    try:
-        if db is not None:
-            response["database"] = "✅ Available"
-            response["database_url"] = "✅ Configured"
-            response["database_name"] = getattr(db, 'name', '✅ Connected')
-            response["connection_status"] = "Connected"
+    if database.configured():
+        # Probe and collection list are cached, so polling this page does not load the database.
+        probe = await aprobe()
+        response["database"] = "✅ Available"
+        response["connection_status"] = "Connected" if probe['ok'] else f"Not Connected (circuit {probe['circuit']})"
+        if probe['ok']:
             try:
-                collections = db.list_collection_names()
-                response["collections"] = collections[:10]
+                response["collections"] = (await acollection_names())[:10]
                 response["database"] = "✅ Connected & Working"
             except Exception as e:
                 response["database"] = f"⚠️  Connected but Error: {str(e)[:50]}"
         else:
-            response["database"] = "⚠️  Available but not initialized"
-    except Exception as e:
-        response["database"] = f"❌ Error: {str(e)[:50]}"
+            response["database"] = f"❌ Error: {probe['error'][:50]}"
+    else:
+        response["database"] = "⚠️  Available but not initialized"
 
-    import os as _os
-    response["database_url"] = "✅ Set" if _os.getenv("DATABASE_URL") else "❌ Not Set"
-    response["database_name"] = "✅ Set" if _os.getenv("DATABASE_NAME") else "❌ Not Set"
+    response["database_url"] = "✅ Set" if os.getenv("DATABASE_URL") else "❌ Not Set"
+    response["database_name"] = "✅ Set" if os.getenv("DATABASE_NAME") else "❌ Not Set"
     return response
 
 
@@ -0,0 +1,298 @@
+"""
+Metrics
+
+A small Prometheus registry, served as text exposition format at /metrics.
+It has no dependencies, so database.py, storage.py and the render pool can
+import it without pulling in the web stack.
+
+    Counter / Gauge / Histogram   labelled series, updated inline in hot
+                                  paths (one dict lookup and a bisect per
+                                  observation, no locks)
+    callback metrics              read at scrape time from counters that
+                                  components already keep (queue depth,
+                                  storage bytes, ...), so they cost nothing
+                                  between scrapes
+    LoopLagMonitor                background task measuring how late the
+                                  event loop wakes up from a short sleep
+
+Label values must come from small fixed sets (route templates, job types,
+stage names); never from ids or user input.
+
+Configuration (environment):
+    METRICS_ENABLED          false turns /metrics and all observations off (default true)
+    METRICS_LOOP_LAG_SEC     loop lag sampling interval (default 0.5)
+"""
+
+import asyncio
+import bisect
+import os
+import re
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+
+# Seconds; covers fast Mongo round trips up to long renders.
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+                   300.0, 1800.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    parts = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+def _num(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labels)
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(n, '')) for n in self.labelnames)
+
+    def header(self) -> List[str]:
+        return [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        super().__init__(name, help, labels)
+        self.values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str):
+        if ENABLED:
+            key = self._key(labels)
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        return self.header() + [f'{self.name}{_labels(self.labelnames, k)} {_num(v)}' for k, v in self.values.items()]
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def set(self, value: float, **labels: str):
+        if ENABLED:
+            self.values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts..., +Inf count, sum]
+        self.series: Dict[LabelValues, List[float]] = {}
+
+    def observe(self, value: float, **labels: str):
+        if not ENABLED:
+            return
+        key = self._key(labels)
+        s = self.series.get(key)
+        if s is None:
+            s = self.series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        s[bisect.bisect_left(self.buckets, value)] += 1
+        s[-1] += value
+
+    def time(self, **labels: str) -> '_Timer':
+        return _Timer(self, labels)
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for key, s in self.series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), s[:-1]):
+                cumulative += count
+                le = 'le="%s"' % _num(bound)
+                lines.append(f'{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.labelnames, key)} {_num(s[-1])}')
+            lines.append(f'{self.name}_count{_labels(self.labelnames, key)} {cumulative}')
+        return lines
+
+
+class _Timer:
+    __slots__ = ('hist', 'labels', 't0')
+
+    def __init__(self, hist: Histogram, labels: Dict[str, str]):
+        self.hist = hist
+        self.labels = labels
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.hist.observe(time.perf_counter() - self.t0, **self.labels)
+
+
+class CallbackMetric(_Metric):
+    """Series computed at scrape time: `fn()` yields (label values, value) pairs."""
+
+    def __init__(self, name: str, help: str, kind: str, fn: Callable[[], Iterable[Tuple[Sequence[str], float]]],
+                 labels: Sequence[str] = ()):
+        super().__init__(name, help, labels)
+        self.kind = kind
+        self.fn = fn
+
+    def render(self) -> List[str]:
+        return self.header() + [f'{self.name}{_labels(self.labelnames, k)} {_num(v)}' for k, v in self.fn()]
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: Dict[str, _Metric] = {}
+
+    def _add(self, metric):
+        existing = self.metrics.get(metric.name)
+        if existing is not None:
+            return existing
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+        return self._add(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, labels: Sequence[str] = ()) -> Gauge:
+        return self._add(Gauge(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help, labels, buckets))
+
+    def callback(self, name: str, help: str, kind: str, fn, labels: Sequence[str] = ()) -> CallbackMetric:
+        # Re-registering replaces the callback (a module reloaded by tests/benchmarks gets fresh state).
+        metric = CallbackMetric(name, help, kind, fn, labels)
+        self.metrics[name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self.metrics.values():
+            try:
+                lines.extend(metric.render())
+            except Exception as e:  # a broken callback must not take the whole scrape down
+                lines.append(f'# {metric.name} unavailable: {e!r}')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+# Shared instruments; components import these directly.
+DB_SECONDS = REGISTRY.histogram('mongo_op_seconds', 'MongoDB call latency, including the wait for an I/O thread',
+                                ('collection', 'op'))
+DB_ERRORS = REGISTRY.counter('mongo_op_errors_total', 'MongoDB calls that raised', ('collection', 'op'))
+RENDER_SECONDS = REGISTRY.histogram('render_stage_seconds', 'Render pool stage duration', ('stage', 'outcome'))
+STEP_SECONDS = REGISTRY.histogram('job_step_seconds', 'Job step (checkpointed stage) duration', ('step',))
+LOOP_LAG = REGISTRY.histogram('event_loop_lag_seconds', 'How late the event loop woke from a timed sleep',
+                              buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0))
+
+_NUMBERED = re.compile(r'_\d+$')
+
+
+def step_label(step: str) -> str:
+    """`stem_3` -> `stem`, so numbered steps share one series."""
+    return _NUMBERED.sub('', step)
+
+
+class LoopLagMonitor:
+    """Samples event-loop lag every `interval` seconds into LOOP_LAG."""
+
+    def __init__(self, interval: float = 0.5):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+
+    @classmethod
+    def from_env(cls) -> 'LoopLagMonitor':
+        return cls(float(os.getenv("METRICS_LOOP_LAG_SEC", "0.5")))
+
+    def start(self):
+        if ENABLED and self.interval > 0 and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._run(), name="loop-lag")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            t0 = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - t0 - self.interval)
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            LOOP_LAG.observe(lag)
+
+
+HTTP_SECONDS = REGISTRY.histogram('http_request_seconds', 'HTTP request latency until the response has been sent',
+                                  ('method', 'route', 'status'))
+HTTP_IN_FLIGHT = REGISTRY.gauge('http_requests_in_flight', 'HTTP requests being handled')
+
+
+class HTTPMetricsMiddleware:
+    """ASGI middleware timing every HTTP request by method, route template and status class.
+
+    The route label is the matched route's path template (`/api/job/{job_id}`),
+    the mount path for mounted apps (`/assets`), or `unmatched`, so ids never
+    become label values. Streaming responses are timed until their last chunk.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.in_flight = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not ENABLED:
+            await self.app(scope, receive, send)
+            return
+        status = {'code': 500}
+
+        async def send_wrapper(message):
+            if message['type'] == 'http.response.start':
+                status['code'] = message['status']
+            await send(message)
+
+        self.in_flight += 1
+        HTTP_IN_FLIGHT.set(self.in_flight)
+        t0 = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            self.in_flight -= 1
+            HTTP_IN_FLIGHT.set(self.in_flight)
+            HTTP_SECONDS.observe(time.perf_counter() - t0, method=scope['method'], route=_route_label(scope),
+                                 status=f"{status['code'] // 100}xx")
+
+
+def _route_label(scope) -> str:
+    route = scope.get('route')
+    path = getattr(route, 'path', None)
+    if path:
+        return path
+    if scope.get('root_path') and scope.get('app_root_path', '') != scope['root_path']:
+        return scope['root_path']
+    return 'unmatched'
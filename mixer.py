@@ -0,0 +1,195 @@
+"""
+Mix Engine
+
+Streams any number of stem WAVs into a loudness-normalized master:
+
+    pass 1  sum the stems block by block (per-track gain) and measure the
+            integrated loudness of the sum
+    pass 2  sum again, apply the make-up gain for the target LUFS, run the
+            true-peak limiter and write the master block by block
+
+Stems are read with positioned reads in fixed-size blocks (not memory-mapped,
+so touched pages do not accumulate in RSS); memory use depends on
+MIX_BLOCK_FRAMES and the stem count, never on track duration. Blocks are
+rounded up to whole limiter windows, so the limiter's gain curve (and thus
+the master) does not depend on the block size.
+"""
+
+import math
+import os
+import wave
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+import dsp
+
+MIX_BLOCK_FRAMES = int(os.getenv("MIX_BLOCK_FRAMES", "65536"))
+LIMITER_WINDOW = 64           # frames per gain-control step
+LIMITER_RELEASE_SEC = 0.05    # time to recover from full gain reduction
+
+
+def _true_peak(x: np.ndarray) -> np.ndarray:
+    """|x| including 4x oversampled inter-sample peaks (Catmull-Rom), per frame across channels."""
+    a = np.abs(x).max(axis=1)
+    if len(x) < 4:
+        return a
+    p0, p1, p2, p3 = x[:-3], x[1:-2], x[2:-1], x[3:]
+    peak = np.zeros(len(x), dtype=np.float32)
+    for t in (0.25, 0.5, 0.75):
+        t2, t3 = t * t, t * t * t
+        v = 0.5 * ((2 * p1) + (-p0 + p2) * t + (2 * p0 - 5 * p1 + 4 * p2 - p3) * t2 + (-p0 + 3 * p1 - 3 * p2 + p3) * t3)
+        np.maximum(peak[1:-2], np.abs(v).max(axis=1), out=peak[1:-2])
+    return np.maximum(a, peak)
+
+
+class TruePeakLimiter:
+    """Look-ahead gain limiter that keeps oversampled peaks under `ceiling_db`.
+
+    Gain is decided per LIMITER_WINDOW frames from the window itself and its
+    neighbours, then linearly interpolated per frame, so every frame's gain is
+    at most what its window needs. Release is a linear ramp back to unity.
+    """
+
+    def __init__(self, samplerate: int, ceiling_db: float = -1.0):
+        self.ceiling = 10 ** (ceiling_db / 20)
+        steps = max(1.0, LIMITER_RELEASE_SEC * samplerate / LIMITER_WINDOW)
+        self.release_step = 1.0 / steps
+        self.gain = 1.0
+        self.min_gain = 1.0
+
+    def process(self, block: np.ndarray, lookahead: np.ndarray) -> np.ndarray:
+        """Limit `block` in place; `lookahead` is the frames that follow it (may be empty)."""
+        w = LIMITER_WINDOW
+        frames = len(block)
+        full = np.concatenate([block, lookahead[:w]]) if len(lookahead) else block
+        n = math.ceil(len(full) / w)
+        pad = n * w - len(full)
+        tp = _true_peak(full)
+        if pad:
+            tp = np.concatenate([tp, np.zeros(pad, dtype=tp.dtype)])
+        peaks = tp.reshape(n, w).max(axis=1)
+        with np.errstate(divide='ignore'):
+            need = np.minimum(1.0, self.ceiling / np.maximum(peaks, 1e-12))
+        # Each boundary gain must satisfy the windows on both sides of it.
+        win = need.copy()
+        win[1:] = np.minimum(win[1:], need[:-1])
+        boundaries = np.empty(n + 1)
+        boundaries[0] = min(self.gain, need[0])
+        g = boundaries[0]
+        for i in range(1, n + 1):
+            target = win[i] if i < n else need[n - 1]
+            g = min(target, g + self.release_step)
+            boundaries[i] = g
+        per_frame = np.interp(np.arange(frames), np.arange(n + 1) * w, boundaries).astype(np.float32)
+        block *= per_frame[:, None]
+        steps_used = math.ceil(frames / w)
+        self.gain = float(boundaries[steps_used]) if frames % w == 0 else float(per_frame[-1])
+        self.min_gain = min(self.min_gain, float(per_frame.min()) if frames else 1.0)
+        return block
+
+
+class _StemSet:
+    def __init__(self, paths: Sequence[str], gains_db: Optional[Sequence[float]] = None):
+        self.wavs = [dsp.open_wav(p) for p in paths]
+        if not self.wavs:
+            raise ValueError("No stems to mix")
+        rates = {w.samplerate for w in self.wavs}
+        if len(rates) != 1:
+            raise ValueError(f"Stems have different sample rates {sorted(rates)}; resample before mixing")
+        self.samplerate = rates.pop()
+        self.channels = max(2 if w.channels > 2 else w.channels for w in self.wavs)
+        self.frames = max(w.frames for w in self.wavs)
+        gains_db = list(gains_db or [])
+        gains_db += [0.0] * (len(self.wavs) - len(gains_db))
+        self.gains = [10 ** (g / 20) for g in gains_db[:len(self.wavs)]]
+        # Indices of the stems that contribute to the mix (muted and empty ones are skipped).
+        self.mixed = [i for i, (w, g) in enumerate(zip(self.wavs, self.gains)) if w.frames > 0 and g != 0]
+        self._files = [open(w.path, 'rb') for w in self.wavs]
+
+    def close(self):
+        for f in self._files:
+            f.close()
+
+    def sum(self, start: int, count: int) -> np.ndarray:
+        out = np.zeros((max(0, min(count, self.frames - start)), self.channels), dtype=np.float32)
+        for wav, gain, f in zip(self.wavs, self.gains, self._files):
+            if start >= wav.frames or gain == 0:
+                continue
+            block = dsp.to_float(dsp.read_frames(f, wav, start, len(out)))
+            block *= gain
+            if wav.channels > self.channels:
+                block = block[:, :self.channels]
+            out[:len(block)] += block  # mono stems broadcast to every channel
+        return out
+
+
+def mix_stems(stem_paths: Sequence[str], out_path: str, gains_db: Optional[Sequence[float]] = None,
+              target_lufs: float = -14.0, ceiling_db: float = -1.0,
+              block_frames: int = MIX_BLOCK_FRAMES) -> Dict[str, Any]:
+    """Mix stems into a 16-bit master at `target_lufs`; returns measurement stats.
+
+    `mixed_stems` in the stats lists the indices (into `stem_paths`) of the stems that were mixed in.
+    """
+    block_frames = max(1, math.ceil(block_frames / LIMITER_WINDOW)) * LIMITER_WINDOW
+    stems = _StemSet(stem_paths, gains_db)
+    try:
+        return _mix(stems, out_path, target_lufs, ceiling_db, block_frames)
+    finally:
+        stems.close()
+
+
+def _mix(stems: _StemSet, out_path: str, target_lufs: float, ceiling_db: float,
+         block_frames: int) -> Dict[str, Any]:
+    sr, ch = stems.samplerate, stems.channels
+
+    meter = dsp.LoudnessMeter(sr, ch)
+    peak = 0.0
+    for start in range(0, stems.frames, block_frames):
+        block = stems.sum(start, block_frames)
+        meter.feed(block)
+        if len(block):
+            peak = max(peak, float(np.abs(block).max()))
+    input_lufs = meter.integrated()
+    gain_db = (target_lufs - input_lufs) if input_lufs is not None else 0.0
+    gain = np.float32(10 ** (gain_db / 20))
+
+    limiter = TruePeakLimiter(sr, ceiling_db)
+    out_meter = dsp.LoudnessMeter(sr, ch)
+    with wave.open(out_path, 'wb') as wf:
+        wf.setnchannels(ch)
+        wf.setsampwidth(2)
+        wf.setframerate(sr)
+        for start in range(0, stems.frames, block_frames):
+            block = stems.sum(start, block_frames) * gain
+            lookahead = stems.sum(start + block_frames, LIMITER_WINDOW) * gain
+            limiter.process(block, lookahead)
+            out_meter.feed(block)
+            pcm = np.clip(np.rint(block * 32767.0), -32768, 32767).astype('<i2')
+            wf.writeframes(pcm.tobytes())
+
+    output_lufs = out_meter.integrated()
+    return {
+        'samplerate': sr,
+        'channels': ch,
+        'duration_sec': round(stems.frames / float(sr), 3),
+        'stems': len(stems.wavs),
+        'mixed_stems': stems.mixed,
+        'input_lufs': round(input_lufs, 2) if input_lufs is not None else None,
+        'input_peak_dbfs': round(dsp.db(peak), 2),
+        'gain_db': round(gain_db, 2),
+        'limiter_max_reduction_db': round(0.0 - dsp.db(limiter.min_gain), 2),
+        'output_lufs': round(output_lufs, 2) if output_lufs is not None else None,
+        'target_lufs': target_lufs,
+    }
+
+
+def stem_paths_from_urls(urls: List[str], resolve: Callable[[str], str]) -> List[str]:
+    """Resolve `/assets/...` URLs to local files with `resolve` (e.g. AssetStore.resolve_url)."""
+    paths = []
+    for url in urls:
+        try:
+            paths.append(resolve(url))
+        except (ValueError, FileNotFoundError):
+            raise FileNotFoundError(f"Stem not found: {url}")
+    return paths
@@ -0,0 +1,145 @@
+"""
+Stage Graph Execution
+
+Runs a multi-stage job as a dependency graph: every stage starts as soon as
+all of its dependencies have finished, so independent stages run
+concurrently. Each stage is an async callable receiving the outputs of its
+dependencies and returning its own outputs (a dict).
+
+Progress is weighted by how long each stage is expected to take. Estimates
+start from the stage definition and are refined from observed durations
+(EWMA per stage name), so a slow video render does not make the bar sit at
+90 % for most of the job.
+"""
+
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+StageOutputs = Dict[str, Any]
+
+# stage name -> observed duration (seconds), shared across runs in this process
+_observed: Dict[str, float] = {}
+_EWMA_ALPHA = 0.3
+
+
+@dataclass
+class Stage:
+    name: str
+    run: Callable[[Dict[str, StageOutputs]], Awaitable[StageOutputs]]
+    deps: Tuple[str, ...] = ()
+    expected_sec: float = 1.0
+
+
+class StageFailed(Exception):
+    """A stage raised; the remaining stages were cancelled."""
+
+    def __init__(self, stage: str, error: BaseException):
+        super().__init__(f"{stage}: {error}")
+        self.stage = stage
+        self.error = error
+
+
+class Pipeline:
+    """A validated stage graph; `run()` executes it once."""
+
+    def __init__(self, stages: Sequence[Stage]):
+        self.stages: Dict[str, Stage] = {}
+        for s in stages:
+            if s.name in self.stages:
+                raise ValueError(f"Duplicate stage '{s.name}'")
+            self.stages[s.name] = s
+        for s in stages:
+            for d in s.deps:
+                if d not in self.stages:
+                    raise ValueError(f"Stage '{s.name}' depends on unknown stage '{d}'")
+        self.order = self._toposort()
+
+    def _toposort(self) -> List[str]:
+        order, state = [], {}
+
+        def visit(name: str):
+            if state.get(name) == 'done':
+                return
+            if state.get(name) == 'visiting':
+                raise ValueError(f"Stage graph has a cycle through '{name}'")
+            state[name] = 'visiting'
+            for d in self.stages[name].deps:
+                visit(d)
+            state[name] = 'done'
+            order.append(name)
+
+        for name in self.stages:
+            visit(name)
+        return order
+
+    def expected(self, name: str) -> float:
+        return max(0.01, _observed.get(name, self.stages[name].expected_sec))
+
+    async def run(self, on_event: Optional[Callable[[str, str, Dict[str, Any]], Awaitable[None]]] = None,
+                  done: Optional[Dict[str, StageOutputs]] = None, tick_sec: float = 0.5) -> Dict[str, StageOutputs]:
+        """Execute every stage; returns name -> outputs.
+
+        `on_event(kind, stage, info)` is awaited for 'start', 'done' and
+        'progress' (info: {'progress': 0..1, 'running': [...]}). Stages
+        already present in `done` are not run again.
+        """
+        outputs: Dict[str, StageOutputs] = dict(done or {})
+        started: Dict[str, float] = {}
+        running: Dict[asyncio.Task, str] = {}
+        weights = {n: self.expected(n) for n in self.stages}
+        total = sum(weights.values())
+
+        def progress() -> float:
+            now = time.monotonic()
+            got = sum(weights[n] for n in outputs if n in weights)
+            for name in running.values():
+                # A running stage counts up to 90 % of its weight until it really finishes.
+                got += weights[name] * min(0.9, (now - started[name]) / weights[name])
+            return min(1.0, got / total) if total else 1.0
+
+        async def emit(kind: str, stage: str, info: Optional[Dict[str, Any]] = None):
+            if on_event is None:
+                return
+            payload = {'progress': progress(), 'running': sorted(running.values()), **(info or {})}
+            try:
+                await on_event(kind, stage, payload)
+            except Exception:
+                logger.exception("Pipeline event hook failed (%s %s)", kind, stage)
+
+        try:
+            while len(outputs) < len(self.stages) or running:
+                for name in self.order:
+                    if name in outputs or name in running.values():
+                        continue
+                    stage = self.stages[name]
+                    if all(d in outputs for d in stage.deps):
+                        started[name] = time.monotonic()
+                        task = asyncio.create_task(stage.run({d: outputs[d] for d in stage.deps}), name=f"stage-{name}")
+                        running[task] = name
+                        await emit('start', name)
+                if not running:
+                    break
+                finished, _ = await asyncio.wait(running.keys(), timeout=tick_sec, return_when=asyncio.FIRST_COMPLETED)
+                if not finished:
+                    await emit('progress', '')
+                    continue
+                for task in finished:
+                    name = running.pop(task)
+                    if task.exception() is not None:
+                        raise StageFailed(name, task.exception())
+                    outputs[name] = task.result() or {}
+                    elapsed = time.monotonic() - started[name]
+                    prev = _observed.get(name)
+                    _observed[name] = elapsed if prev is None else prev + _EWMA_ALPHA * (elapsed - prev)
+                    await emit('done', name, {'outputs': outputs[name], 'elapsed_sec': round(elapsed, 3)})
+        finally:
+            for task in running:
+                task.cancel()
+            if running:
+                await asyncio.gather(*running, return_exceptions=True)
+        return outputs
@@ -0,0 +1,333 @@
+"""
+Profiling
+
+Opt-in tools for finding what holds up the event loop. Both are off by
+default and cost nothing then: no middleware is installed and no thread or
+task is started.
+
+    Profiler        cProfile captures stored as downloadable artifacts
+                    (`<id>.prof` for pstats/snakeviz, `<id>.txt` with the
+                    top functions by cumulative time). A capture covers
+                    - one request: send `X-Profile: request`
+                    - the job a request enqueues: send `X-Profile: job`
+                    - a time window: POST /api/admin/profile?seconds=N
+                    cProfile sees everything that runs on the event loop
+                    thread while it is on, including other requests and
+                    jobs interleaved with the one asked for; that is what
+                    makes it useful for finding loop hogs. Only one capture
+                    runs at a time, so later requests run unprofiled.
+    LoopWatchdog    a thread that notices when the event loop has not run
+                    its heartbeat for longer than a threshold and logs the
+                    loop thread's current stack (the code blocking it).
+
+Configuration (environment):
+    PROFILING_ENABLED          true enables captures and the admin endpoints (default false)
+    PROFILE_TOKEN              if set, required in X-Profile-Token for captures and downloads
+    PROFILE_KEEP               captures kept on disk, oldest removed first (default 50)
+    PROFILE_MAX_SEC            longest time-window capture (default 60)
+    LOOP_BLOCK_THRESHOLD_MS    log a stack when the loop is blocked this long; 0 disables (default 0)
+"""
+
+import asyncio
+import contextlib
+import contextvars
+import cProfile
+import glob
+import hmac
+import io
+import logging
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+import traceback
+import uuid
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+LOOP_BLOCKS = REGISTRY.counter('event_loop_blocked_total', 'Times the event loop was blocked past the watchdog threshold')
+
+_PROFILE_ID = re.compile(r'^[0-9]{8}T[0-9]{6}-[a-z]+-[0-9a-f]{8}$')
+
+# Set by ProfileMiddleware for a request that asked to profile the job it enqueues.
+_profile_job: contextvars.ContextVar[bool] = contextvars.ContextVar('profile_job', default=False)
+
+
+class ProfilerBusy(Exception):
+    """Another capture is running."""
+
+
+class _Capture:
+    def __init__(self, profile_id: str, label: str):
+        self.id = profile_id
+        self.label = label
+        self.profile = cProfile.Profile()
+        self.started = time.perf_counter()
+        self.duration = 0.0
+
+
+class Profiler:
+    """One-at-a-time cProfile captures of the event loop thread, saved under `directory`."""
+
+    def __init__(self, directory: str, enabled: bool = False, token: str = '', keep: int = 50,
+                 max_sec: float = 60.0, top: int = 40):
+        self.directory = directory
+        self.enabled = enabled
+        self.token = token
+        self.keep = max(1, keep)
+        self.max_sec = max_sec
+        self.top = top
+        self._active: Optional[_Capture] = None
+        self.captures = 0
+        self.skipped = 0
+
+    @classmethod
+    def from_env(cls, directory: str, **kwargs) -> 'Profiler':
+        return cls(
+            directory,
+            enabled=os.getenv("PROFILING_ENABLED", "false").lower() == "true",
+            token=os.getenv("PROFILE_TOKEN", ""),
+            keep=int(os.getenv("PROFILE_KEEP", "50")),
+            max_sec=float(os.getenv("PROFILE_MAX_SEC", "60")),
+            **kwargs,
+        )
+
+    def authorized(self, token: Optional[str]) -> bool:
+        return not self.token or hmac.compare_digest((token or '').encode(), self.token.encode())
+
+    # ---- captures ----
+
+    def begin(self, kind: str, label: str) -> _Capture:
+        """Start profiling now; raises ProfilerBusy if a capture is already running."""
+        if self._active is not None:
+            self.skipped += 1
+            raise ProfilerBusy("A profile is already being captured")
+        profile_id = f"{datetime.utcnow():%Y%m%dT%H%M%S}-{kind}-{uuid.uuid4().hex[:8]}"
+        capture = _Capture(profile_id, label)
+        try:
+            capture.profile.enable()
+        except ValueError as e:  # another profiler (a debugger, coverage) owns the thread
+            self.skipped += 1
+            raise ProfilerBusy(str(e))
+        self._active = capture
+        return capture
+
+    async def end(self, capture: _Capture) -> Dict[str, Any]:
+        capture.profile.disable()
+        capture.duration = time.perf_counter() - capture.started
+        if self._active is capture:
+            self._active = None
+        self.captures += 1
+        await asyncio.get_running_loop().run_in_executor(None, self._save, capture)
+        return self.describe(capture.id)
+
+    async def run(self, kind: str, label: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Await `fn()` under a capture (or plainly if another one is running)."""
+        try:
+            capture = self.begin(kind, label)
+        except ProfilerBusy:
+            return await fn()
+        try:
+            return await fn()
+        finally:
+            await self.end(capture)
+
+    async def window(self, seconds: float) -> Dict[str, Any]:
+        """Profile whatever the loop runs during the next `seconds`."""
+        seconds = max(0.1, min(seconds, self.max_sec))
+        capture = self.begin('window', f"{seconds:g}s window")
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            info = await self.end(capture)
+        return info
+
+    def wrap_job(self, job_id: str, factory: Callable[[], Awaitable[Any]]) -> Callable[[], Awaitable[Any]]:
+        async def run():
+            return await self.run('job', f"job {job_id}", factory)
+        return run
+
+    def job_requested(self) -> bool:
+        return self.enabled and _profile_job.get()
+
+    # ---- artifacts ----
+
+    def _save(self, capture: _Capture):
+        os.makedirs(self.directory, exist_ok=True)
+        base = os.path.join(self.directory, capture.id)
+        capture.profile.dump_stats(base + '.prof')
+        out = io.StringIO()
+        out.write(f"{capture.label}: {capture.duration * 1000:.1f} ms wall\n\n")
+        pstats.Stats(capture.profile, stream=out).sort_stats('cumulative').print_stats(self.top)
+        with open(base + '.txt', 'w') as f:
+            f.write(out.getvalue())
+        for old in self._files()[:-self.keep]:
+            for path in (old, old[:-len('.prof')] + '.txt'):
+                with contextlib.suppress(OSError):
+                    os.remove(path)
+
+    def _files(self) -> List[str]:
+        return sorted(glob.glob(os.path.join(self.directory, '*.prof')), key=os.path.getmtime)
+
+    def path(self, profile_id: str, fmt: str = 'prof') -> Optional[str]:
+        """Artifact path of a capture, or None for an unknown id or format."""
+        if fmt not in ('prof', 'txt') or not _PROFILE_ID.match(profile_id):
+            return None
+        path = os.path.join(self.directory, f"{profile_id}.{fmt}")
+        return path if os.path.isfile(path) else None
+
+    def describe(self, profile_id: str) -> Dict[str, Any]:
+        path = os.path.join(self.directory, f"{profile_id}.prof")
+        return {
+            'id': profile_id,
+            'createdAt': datetime.utcfromtimestamp(os.path.getmtime(path)).isoformat() if os.path.exists(path) else None,
+            'bytes': os.path.getsize(path) if os.path.exists(path) else 0,
+            'url': f"/api/admin/profiles/{profile_id}",
+            'summaryUrl': f"/api/admin/profiles/{profile_id}?format=txt",
+        }
+
+    def list(self) -> List[Dict[str, Any]]:
+        return [self.describe(os.path.basename(p)[:-len('.prof')]) for p in reversed(self._files())]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'enabled': self.enabled,
+            'active': self._active.label if self._active else None,
+            'captures': self.captures,
+            'skipped': self.skipped,
+        }
+
+
+class ProfileMiddleware:
+    """ASGI middleware honouring `X-Profile: request|job`; installed only when profiling is enabled.
+
+    A profiled request's response carries `X-Profile-Id`; the artifact is ready
+    once the response has been sent. `job` captures the job the request
+    enqueues instead, from the moment it starts running until it finishes.
+    """
+
+    def __init__(self, app, profiler: Profiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        mode = None
+        if scope['type'] == 'http':
+            headers = dict(scope['headers'])
+            mode = headers.get(b'x-profile', b'').decode('latin-1').lower() or None
+            if mode and not self.profiler.authorized(headers.get(b'x-profile-token', b'').decode('latin-1')):
+                mode = None
+        if mode == 'job':
+            token = _profile_job.set(True)
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                _profile_job.reset(token)
+            return
+        if mode != 'request':
+            await self.app(scope, receive, send)
+            return
+        try:
+            capture = self.profiler.begin('request', f"{scope['method']} {scope['path']}")
+        except ProfilerBusy:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_wrapper(message):
+            if message['type'] == 'http.response.start':
+                message = dict(message)
+                message['headers'] = list(message.get('headers', [])) + [(b'x-profile-id', capture.id.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            await self.profiler.end(capture)
+
+
+class LoopWatchdog:
+    """Logs the event loop thread's stack whenever the loop stays blocked past `threshold_sec`.
+
+    A heartbeat task on the loop stamps the time every threshold/4; a daemon
+    thread checks the stamp and, once it is older than the threshold, grabs
+    the loop thread's current frame. One warning per blocking episode, plus
+    how long it lasted once the loop runs again.
+    """
+
+    def __init__(self, threshold_sec: float = 0.0):
+        self.threshold_sec = threshold_sec
+        self.interval = threshold_sec / 4
+        self._beat = 0.0
+        self._loop_thread: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.blocks = 0
+        self.longest_ms = 0.0
+
+    @classmethod
+    def from_env(cls) -> 'LoopWatchdog':
+        return cls(float(os.getenv("LOOP_BLOCK_THRESHOLD_MS", "0")) / 1000)
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold_sec > 0
+
+    def start(self):
+        if not self.enabled or (self._task is not None and not self._task.done()):
+            return
+        self._loop_thread = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._heartbeat(), name="loop-watchdog")
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._stop.set()
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+            self._thread = None
+
+    async def _heartbeat(self):
+        while True:
+            self._beat = time.monotonic()
+            await asyncio.sleep(self.interval)
+
+    def _watch(self):
+        reported = None
+        while not self._stop.wait(self.interval):
+            beat = self._beat
+            blocked = time.monotonic() - beat - self.interval
+            if blocked > self.threshold_sec and reported != beat:
+                reported = beat
+                self.blocks += 1
+                LOOP_BLOCKS.inc()
+                frame = sys._current_frames().get(self._loop_thread)
+                stack = ''.join(traceback.format_stack(frame)) if frame is not None else '(no frame)\n'
+                logger.warning("Event loop blocked for %.0f ms; loop thread is at:\n%s", blocked * 1000, stack)
+            elif reported is not None and reported != beat:
+                # The loop ran again: report how long the episode lasted in total.
+                total_ms = (beat - reported - self.interval) * 1000
+                self.longest_ms = max(self.longest_ms, total_ms)
+                logger.warning("Event loop unblocked after %.0f ms", total_ms)
+                reported = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'enabled': self.enabled,
+            'threshold_ms': int(self.threshold_sec * 1000),
+            'blocks': self.blocks,
+            'longest_ms': round(self.longest_ms, 1),
+        }
@@ -0,0 +1,208 @@
+"""
+Render Execution
+
+CPU-heavy stage functions (synthesis, mixing, clip analysis, file rendering)
+run on a process pool so the event loop only orchestrates and does I/O.
+
+Stage functions are plain module-level callables taking and returning small
+picklable values. Audio always travels as file paths, never as sample
+buffers: workers read and write WAVs on disk themselves.
+
+Workers are spawned and warmed (NumPy/DSP imported) at startup. Every stage
+runs under a timeout; a stage that overruns is abandoned and the pool is
+recycled, because a process pool cannot cancel a task that is already running.
+
+Configuration (environment):
+    RENDER_WORKERS                 worker processes (default: CPUs, max 8)
+    RENDER_TIMEOUT_SEC             default stage timeout
+    RENDER_<STAGE>_TIMEOUT_SEC     per-stage override, e.g. RENDER_MIX_TIMEOUT_SEC=1800
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+import wave
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, Optional
+
+from metrics import RENDER_SECONDS
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUTS: Dict[str, float] = {
+    'silence': 60,
+    'file': 60,
+    'analysis': 120,
+    'mix': 1800,
+}
+
+
+class StageTimeout(Exception):
+    """A render stage did not finish within its timeout."""
+
+    def __init__(self, stage: str, timeout: float):
+        super().__init__(f"Render stage '{stage}' timed out after {timeout:g}s")
+        self.stage = stage
+        self.timeout = timeout
+
+
+# ---------- stage functions (run inside worker processes) ----------
+
+def save_wav_silence(path: str, duration_sec: float = 2.0, samplerate: int = 44100) -> str:
+    frames = int(duration_sec * samplerate)
+    with wave.open(path, 'w') as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(samplerate)
+        silence = (b"\x00\x00") * frames
+        wf.writeframes(silence)
+    return path
+
+
+def write_text(path: str, text: str) -> str:
+    with open(path, 'w') as f:
+        f.write(text)
+    return path
+
+
+def write_placeholder(path: str, size: int) -> str:
+    """Random bytes standing in for a binary render (thumbnails, mock video)."""
+    with open(path, 'wb') as f:
+        f.write(os.urandom(size))
+    return path
+
+
+def _init_worker():
+    # Pay the import cost once per process instead of on the first real stage.
+    import numpy  # noqa: F401
+    import dsp  # noqa: F401
+    import mixer  # noqa: F401
+
+
+def _warm(hold_sec: float) -> int:
+    time.sleep(hold_sec)  # keep this worker busy so every warm task lands on its own process
+    return os.getpid()
+
+
+# ---------- pool ----------
+
+class RenderPool:
+    """Runs stage functions on a warm process pool with per-stage timeouts."""
+
+    def __init__(self, workers: int, default_timeout: float = 300.0,
+                 timeouts: Optional[Dict[str, float]] = None):
+        self.workers = max(1, workers)
+        self.default_timeout = default_timeout
+        self.timeouts = dict(timeouts or {})
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._stats: Dict[str, Dict[str, float]] = {}
+        self.recycles = 0
+        self.warm_workers = 0
+
+    @classmethod
+    def from_env(cls, **kwargs) -> 'RenderPool':
+        workers = int(os.getenv("RENDER_WORKERS", min(8, os.cpu_count() or 2)))
+        timeouts = {}
+        for stage, default in DEFAULT_TIMEOUTS.items():
+            timeouts[stage] = float(os.getenv(f"RENDER_{stage.upper()}_TIMEOUT_SEC", default))
+        return cls(workers, float(os.getenv("RENDER_TIMEOUT_SEC", "300")), timeouts, **kwargs)
+
+    # ---- lifecycle ----
+
+    def _new_pool(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'),
+                                   initializer=_init_worker)
+
+    @property
+    def pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = self._new_pool()
+        return self._pool
+
+    async def start(self, warm: bool = True):
+        """Create the pool and spawn every worker up front."""
+        pool = self.pool
+        if not warm:
+            return
+        loop = asyncio.get_running_loop()
+        t0 = time.monotonic()
+        try:
+            pids = await asyncio.gather(*[loop.run_in_executor(pool, _warm, 0.05) for _ in range(self.workers)])
+            self.warm_workers = len(set(pids))
+            logger.info("Render pool warm: %d workers in %.2fs", self.warm_workers, time.monotonic() - t0)
+        except Exception:
+            logger.exception("Render pool warm-up failed")
+
+    async def stop(self):
+        pool, self._pool = self._pool, None
+        if pool is not None:
+            await asyncio.get_running_loop().run_in_executor(None, lambda: pool.shutdown(wait=True, cancel_futures=True))
+
+    def _recycle(self, broken: ProcessPoolExecutor):
+        """Replace a pool whose worker is stuck or dead; running stages on it are retried by their callers."""
+        if self._pool is not broken:
+            return
+        self._pool = self._new_pool()
+        self.recycles += 1
+        for proc in list((getattr(broken, '_processes', None) or {}).values()):
+            proc.terminate()
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    # ---- execution ----
+
+    def timeout_for(self, stage: str) -> float:
+        return self.timeouts.get(stage, self.default_timeout)
+
+    async def run(self, stage: str, fn: Callable[..., Any], *args, timeout: Optional[float] = None, **kwargs) -> Any:
+        """Run `fn(*args, **kwargs)` in a worker process; raises StageTimeout on overrun."""
+        timeout = self.timeout_for(stage) if timeout is None else timeout
+        loop = asyncio.get_running_loop()
+        st = self._stats.setdefault(stage, {'runs': 0, 'failures': 0, 'timeouts': 0, 'total_sec': 0.0})
+        t0 = time.monotonic()
+        for attempt in (0, 1):
+            pool = self.pool
+            fut = loop.run_in_executor(pool, _call, fn, args, kwargs)
+            try:
+                result = await asyncio.wait_for(fut, timeout=max(0.001, timeout - (time.monotonic() - t0)))
+            except asyncio.TimeoutError:
+                st['timeouts'] += 1
+                RENDER_SECONDS.observe(time.monotonic() - t0, stage=stage, outcome='timeout')
+                logger.warning("Render stage %s timed out after %.1fs; recycling pool", stage, timeout)
+                self._recycle(pool)
+                raise StageTimeout(stage, timeout) from None
+            except BrokenProcessPool:
+                # Collateral of another stage's timeout (or a crashed worker): retry once on a fresh pool.
+                self._recycle(pool)
+                if attempt == 0:
+                    continue
+                st['failures'] += 1
+                RENDER_SECONDS.observe(time.monotonic() - t0, stage=stage, outcome='error')
+                raise
+            except Exception:
+                st['failures'] += 1
+                RENDER_SECONDS.observe(time.monotonic() - t0, stage=stage, outcome='error')
+                raise
+            elapsed = time.monotonic() - t0
+            st['runs'] += 1
+            st['total_sec'] += elapsed
+            RENDER_SECONDS.observe(elapsed, stage=stage, outcome='ok')
+            return result
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'workers': self.workers,
+            'warm_workers': self.warm_workers,
+            'recycles': self.recycles,
+            'stages': {
+                s: {'runs': int(v['runs']), 'failures': int(v['failures']), 'timeouts': int(v['timeouts']),
+                    'avg_ms': int(1000 * v['total_sec'] / v['runs']) if v['runs'] else 0}
+                for s, v in self._stats.items()
+            },
+        }
+
+
+def _call(fn: Callable[..., Any], args, kwargs) -> Any:
+    return fn(*args, **kwargs)
@@ -0,0 +1,156 @@
+"""
+Generation Result Cache
+
+Content-addressed cache of finished generation results.
+
+A request is normalized (project id dropped, lyrics lines stripped and
+trailing blank lines removed; nothing else, since every other field ends up
+in the output verbatim) and hashed together with its job type and
+CACHE_VERSION. The hash maps to the result payload and the assets that produced it, so an
+identical re-submission completes instantly instead of re-rendering.
+
+Two tiers:
+    memory      LRU, bounded by RESULT_CACHE_MAX_ENTRIES
+    persistent  the `result_cache` collection, shared by every process
+Both expire entries after RESULT_CACHE_TTL_SEC. Entries whose files have
+disappeared from disk are treated as misses and dropped.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+from database import adb
+
+logger = logging.getLogger(__name__)
+
+# Bump when renderer output or the normalization changes so stale results are never served.
+# 2: key/style/instruments are no longer case-folded and blank lyric lines are kept.
+CACHE_VERSION = 2
+
+_IGNORED_FIELDS = ('projectId',)
+
+
+def _norm_lyrics(text: Any) -> Any:
+    """Lyrics as the melody renderer sees them.
+
+    It writes `line.strip()` for each non-blank line, timed by the line's index,
+    so surrounding whitespace does not matter but blank lines in between (which
+    shift every later line) do; blank lines at the end change nothing.
+    """
+    if not isinstance(text, str):
+        return text
+    return '\n'.join(line.strip() for line in text.splitlines()).rstrip('\n')
+
+
+def request_fingerprint(job_type: str, params: Dict[str, Any]) -> str:
+    """Stable hash of a generation request, independent of project and lyrics formatting."""
+    normalized = {k: _norm_lyrics(v) if k == 'lyrics' else v
+                  for k, v in sorted(params.items()) if k not in _IGNORED_FIELDS}
+    blob = json.dumps([CACHE_VERSION, job_type, normalized], sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(blob.encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+    """Two-tier (memory LRU + Mongo) cache of job results keyed by request fingerprint."""
+
+    def __init__(self, max_entries: int = 1024, ttl_sec: float = 7 * 86400, collection: str = 'result_cache',
+                 is_valid: Optional[Callable[[Dict[str, Any]], bool]] = None):
+        self.max_entries = max_entries
+        self.ttl_sec = ttl_sec
+        self.collection = collection
+        self.is_valid = is_valid or _assets_exist
+        self._mem: 'OrderedDict[str, Dict[str, Any]]' = OrderedDict()
+        self.hits_memory = 0
+        self.hits_persistent = 0
+        self.misses = 0
+        self.stale = 0
+        self.stores = 0
+        self.store_errors = 0
+        self.evictions = 0
+
+    @classmethod
+    def from_env(cls, **kwargs) -> 'ResultCache':
+        return cls(
+            max_entries=int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "1024")),
+            ttl_sec=float(os.getenv("RESULT_CACHE_TTL_SEC", str(7 * 86400))),
+            **kwargs,
+        )
+
+    def _remember(self, key: str, entry: Dict[str, Any]):
+        self._mem[key] = entry
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.max_entries:
+            self._mem.popitem(last=False)
+            self.evictions += 1
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return {'result': ..., 'assets': [...]} for a fingerprint, or None."""
+        entry = self._mem.get(key)
+        if entry is not None:
+            if entry['expires'] > time.time() and self.is_valid(entry):
+                self._mem.move_to_end(key)
+                self.hits_memory += 1
+                return entry
+            self._mem.pop(key, None)
+            self.stale += 1
+        doc = await adb[self.collection].find_one({'_id': key})
+        if doc is not None:
+            expires_at = doc['expires_at']
+            if expires_at.tzinfo is None:
+                expires_at = expires_at.replace(tzinfo=timezone.utc)
+            entry = {'result': doc['result'], 'assets': doc.get('assets', []), 'expires': expires_at.timestamp()}
+            if entry['expires'] > time.time() and self.is_valid(entry):
+                self._remember(key, entry)
+                self.hits_persistent += 1
+                return entry
+            await adb[self.collection].delete_one({'_id': key})
+            self.stale += 1
+        self.misses += 1
+        return None
+
+    async def put(self, key: str, job_type: str, result: Dict[str, Any], assets: List[Dict[str, Any]]):
+        assets = [{k: a.get(k) for k in ('id', 'kind', 'path', 'url', 'meta', 'retention')} for a in assets]
+        now = datetime.now(timezone.utc)
+        expires_at = now + timedelta(seconds=self.ttl_sec)
+        self._remember(key, {'result': result, 'assets': assets, 'expires': expires_at.timestamp()})
+        self.stores += 1
+        try:
+            await adb[self.collection].update_one(
+                {'_id': key},
+                {'$set': {'job_type': job_type, 'result': result, 'assets': assets,
+                          'created_at': now, 'expires_at': expires_at}},
+                upsert=True,
+            )
+        except Exception:
+            # The job already succeeded; losing the persistent copy only costs a re-render.
+            logger.exception("Failed to persist cache entry %s", key)
+            self.store_errors += 1
+
+    async def ensure_indexes(self):
+        await adb[self.collection].create_index('expires_at', expireAfterSeconds=0)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits_memory + self.hits_persistent + self.misses
+        return {
+            'entries_memory': len(self._mem),
+            'max_entries': self.max_entries,
+            'ttl_sec': self.ttl_sec,
+            'hits_memory': self.hits_memory,
+            'hits_persistent': self.hits_persistent,
+            'misses': self.misses,
+            'stale': self.stale,
+            'stores': self.stores,
+            'store_errors': self.store_errors,
+            'evictions': self.evictions,
+            'hit_ratio': round((lookups - self.misses) / lookups, 4) if lookups else 0.0,
+        }
+
+
+def _assets_exist(entry: Dict[str, Any]) -> bool:
+    return all(os.path.exists(a['path']) for a in entry.get('assets', []) if a.get('path'))
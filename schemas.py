@@ -43,8 +43,12 @@ class Job(BaseModel):
     status: str = Field("queued", description="queued | running | done | error")
     progress: int = 0
     message: str = "Queued"
-    logs: List[str] = Field(default_factory=list)
+    logs: List[str] = Field(default_factory=list, description="Newest log lines only; the full log is served by /api/job/{id}/logs")
     result: Dict[str, Any] = Field(default_factory=dict)
+    queue: Dict[str, Any] = Field(default_factory=dict)  # lane, position, wait_ms
+    params: Dict[str, Any] = Field(default_factory=dict)  # request body, used to resume the job
+    checkpoint: Dict[str, Any] = Field(default_factory=dict)  # step -> outputs (asset ids, paths)
+    runner: Optional[str] = None  # server process that queued/runs the job
 
 class Asset(BaseModel):
     project_id: Optional[str] = None
@@ -84,6 +88,7 @@ class SynthesizeVocalRequest(BaseModel):
 class MixRequest(BaseModel):
     projectId: str
     stems: List[str]
+    gains: List[float] = Field(default_factory=list, description="Per-stem gain in dB, same order as stems")
     masterTargetLUFS: float = -14.0
 
 class GenerateVideoRequest(BaseModel):
@@ -91,3 +96,11 @@ class GenerateVideoRequest(BaseModel):
     audioUrl: str
     style: str
     aspectRatio: str = Field("16:9")
+
+class BatchGenerateRequest(BaseModel):
+    projectId: Optional[str] = Field(None, description="Default project of every variation")
+    kind: str = Field("create", description="create | instrumental")
+    base: Dict[str, Any] = Field(default_factory=dict, description="Parameters shared by every variation")
+    grid: Dict[str, List[Any]] = Field(default_factory=dict,
+                                       description="Every combination of these values is a variation, e.g. {'style': [...], 'tempo': [...]}")
+    variations: List[Dict[str, Any]] = Field(default_factory=list, description="Explicit parameter sets, in addition to the grid")
@@ -0,0 +1,168 @@
+"""
+In-flight Request Coalescing
+
+Singleflight for generation jobs: while a job for a given request fingerprint
+is queued or running, identical submissions get their own job ids but are
+attached to that leader instead of being scheduled again. Followers mirror the
+leader's progress and receive its result.
+
+The `Idempotency-Key` store extends the same guarantee across client retries:
+a key maps to the job created by its first use (memory + the `idempotency`
+collection, expiring after IDEMPOTENCY_TTL_SEC). The key is reserved for a
+pre-assigned job id before that job is created, so of two processes racing on
+the same key only the winner creates a job. Reusing a key for a different
+request is rejected.
+"""
+
+import asyncio
+import os
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+from pymongo.errors import DuplicateKeyError
+
+from database import adb
+
+
+class InFlight:
+    """Fingerprint -> leader job id for jobs that are queued or running."""
+
+    def __init__(self):
+        # The future resolves to the leader's job id once its document exists.
+        self._leaders: Dict[str, asyncio.Future] = {}
+        self._followers: Dict[str, List[str]] = {}
+        self.coalesced = 0
+
+    def active(self, fingerprint: str) -> bool:
+        return fingerprint in self._leaders
+
+    def claim(self, fingerprint: str) -> bool:
+        """Become the leader for a fingerprint; False if one already exists."""
+        if fingerprint in self._leaders:
+            return False
+        self._leaders[fingerprint] = asyncio.get_running_loop().create_future()
+        self._followers[fingerprint] = []
+        return True
+
+    def started(self, fingerprint: str, job_id: str):
+        fut = self._leaders.get(fingerprint)
+        if fut is not None and not fut.done():
+            fut.set_result(job_id)
+
+    async def attach(self, fingerprint: str) -> str:
+        """Wait for the leader's job id; raises if the leader failed to start."""
+        fut = self._leaders[fingerprint]
+        self.coalesced += 1
+        return await asyncio.shield(fut)
+
+    def follow(self, fingerprint: str, job_id: str):
+        followers = self._followers.get(fingerprint)
+        if followers is not None:
+            followers.append(job_id)
+
+    def finish(self, fingerprint: str, error: Optional[BaseException] = None) -> List[str]:
+        fut = self._leaders.pop(fingerprint, None)
+        if fut is not None and not fut.done():
+            fut.set_exception(error or RuntimeError("Leader job did not start"))
+            fut.exception()  # mark retrieved when nobody is attached
+        return self._followers.pop(fingerprint, [])
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'leaders': len(self._leaders),
+            'followers': sum(len(f) for f in self._followers.values()),
+            'coalesced': self.coalesced,
+        }
+
+
+class IdempotencyConflict(Exception):
+    """An Idempotency-Key was reused with different request parameters."""
+
+
+class IdempotencyStore:
+    """Maps (scope, Idempotency-Key) to the job created by the key's first use."""
+
+    def __init__(self, ttl_sec: float = 86400, collection: str = 'idempotency'):
+        self.ttl_sec = ttl_sec
+        self.collection = collection
+        self._mem: Dict[str, Tuple[str, str, float]] = {}
+        self._locks: Dict[str, Tuple[asyncio.Lock, int]] = {}
+        self.replays = 0
+
+    @classmethod
+    def from_env(cls, **kwargs) -> 'IdempotencyStore':
+        return cls(ttl_sec=float(os.getenv("IDEMPOTENCY_TTL_SEC", "86400")), **kwargs)
+
+    @staticmethod
+    def _id(scope: str, key: str) -> str:
+        return f"{scope}:{key}"
+
+    @asynccontextmanager
+    async def lock(self, scope: str, key: str):
+        """Serialize concurrent requests carrying the same key within this process."""
+        _id = self._id(scope, key)
+        lock, users = self._locks.get(_id, (asyncio.Lock(), 0))
+        self._locks[_id] = (lock, users + 1)
+        try:
+            async with lock:
+                yield
+        finally:
+            lock, users = self._locks[_id]
+            if users == 1:
+                del self._locks[_id]
+            else:
+                self._locks[_id] = (lock, users - 1)
+
+    async def lookup(self, scope: str, key: str, fingerprint: str) -> Optional[str]:
+        """Job id previously created for this key, or None. Raises IdempotencyConflict."""
+        _id = self._id(scope, key)
+        hit = self._mem.get(_id)
+        if hit is None or hit[2] < time.time():
+            doc = await adb[self.collection].find_one({'_id': _id})
+            if doc is None:
+                return None
+            self._remember(_id, doc['job_id'], doc['fingerprint'])
+            hit = self._mem[_id]
+        job_id, stored_fp, _ = hit
+        if stored_fp != fingerprint:
+            raise IdempotencyConflict(f"Idempotency-Key '{key}' was already used with different parameters")
+        self.replays += 1
+        return job_id
+
+    async def reserve(self, scope: str, key: str, fingerprint: str, job_id: str) -> str:
+        """Claim the key for `job_id` before creating the job; returns the winner's job id if another
+        process claimed it first (raises IdempotencyConflict if that was for different parameters)."""
+        _id = self._id(scope, key)
+        now = datetime.now(timezone.utc)
+        try:
+            await adb[self.collection].insert_one({
+                '_id': _id, 'job_id': job_id, 'fingerprint': fingerprint,
+                'created_at': now, 'expires_at': now + timedelta(seconds=self.ttl_sec),
+            })
+        except DuplicateKeyError:
+            winner = await self.lookup(scope, key, fingerprint)
+            if winner:
+                return winner
+        self._remember(_id, job_id, fingerprint)
+        return job_id
+
+    async def release(self, scope: str, key: str, job_id: str):
+        """Give up a reservation whose job could not be submitted, so a retry can try again."""
+        _id = self._id(scope, key)
+        if self._mem.get(_id, (None,))[0] == job_id:
+            del self._mem[_id]
+        await adb[self.collection].delete_one({'_id': _id, 'job_id': job_id})
+
+    def _remember(self, _id: str, job_id: str, fingerprint: str):
+        now = time.time()
+        if len(self._mem) >= 10000:
+            self._mem = {k: v for k, v in self._mem.items() if v[2] > now}
+        self._mem[_id] = (job_id, fingerprint, now + self.ttl_sec)
+
+    async def ensure_indexes(self):
+        await adb[self.collection].create_index('expires_at', expireAfterSeconds=0)
+
+    def stats(self) -> Dict[str, int]:
+        return {'keys_memory': len(self._mem), 'replays': self.replays}
@@ -0,0 +1,358 @@
+"""
+Asset Storage
+
+Rendered and uploaded files are content-addressed: a file is stored under
+the SHA-256 of its bytes, fanned out over hashed subdirectories,
+
+    ab/cd/abcd1234...ef.wav
+
+so no directory grows past a few hundred entries and identical outputs
+(silence, placeholders, re-rendered stems) are stored exactly once. The key
+is the same for every backend, and so is the public URL (`/assets/<key>`).
+
+Renders are written to a staging directory first and handed to `put()`,
+which hashes the file and moves it into place (or drops it when the content
+is already stored).
+
+Backends:
+    local   files below ASSETS_DIR
+    s3      an S3-compatible bucket (AWS, MinIO, moto server, ...). Every
+            object also lives in a local cache below ASSETS_DIR, which is
+            what render workers read and /assets serves; objects missing
+            from the cache are downloaded on first use.
+
+Files written before this layout (flat, uuid-named) keep working: they are
+resolved by name, never moved.
+
+Files are only ever deleted by the garbage collector (assetgc.py), once no
+asset document refers to them any more. A put() that lands on content which
+is already stored (including a file put() again from its place in the store)
+refreshes its modification time, so a file that was just deduplicated onto is
+never mistaken for an old orphan.
+
+The s3 backend needs boto3 (requirements-s3.txt).
+
+Configuration (environment):
+    ASSET_STORAGE            local | s3 (default local)
+    ASSET_STAGING_DIR        where renders are written before put() (default <ASSETS_DIR>/.staging)
+    ASSET_SHARD_DEPTH        levels of fan-out directories (default 2)
+    ASSET_S3_BUCKET          bucket name (s3)
+    ASSET_S3_PREFIX          key prefix inside the bucket (s3, default "assets/")
+    ASSET_S3_ENDPOINT_URL    endpoint of an S3-compatible server (s3, optional)
+"""
+
+import abc
+import contextlib
+import hashlib
+import logging
+import os
+import re
+import shutil
+import uuid
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+URL_PREFIX = '/assets/'
+_HASH_CHUNK = 1 << 20
+_KEY_RE = re.compile(r'^(?:[0-9a-f]{2}/)*([0-9a-f]{64})((?:\.[A-Za-z0-9]{1,5})*)$')
+_LEGACY_RE = re.compile(r'^[A-Za-z0-9][A-Za-z0-9_.-]*$')
+
+
+def file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(_HASH_CHUNK)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def suffix_of(name: str) -> str:
+    """Every extension of a file name (`melody_x.mid.txt` -> `.mid.txt`)."""
+    base = os.path.basename(name)
+    dot = base.find('.', 1)
+    return base[dot:].lower() if dot > 0 else ''
+
+
+def shard_key(digest: str, suffix: str = '', depth: int = 2) -> str:
+    parts = [digest[2 * i:2 * i + 2] for i in range(depth)]
+    return '/'.join(parts + [digest + suffix])
+
+
+def key_from_url(url: str) -> str:
+    """Storage key of an `/assets/...` URL; raises ValueError for anything else."""
+    key = url.split('?', 1)[0]
+    if key.startswith(URL_PREFIX):
+        key = key[len(URL_PREFIX):]
+    if not (_KEY_RE.match(key) or _LEGACY_RE.match(key)) or '..' in key:
+        raise ValueError(f"Not an asset URL: {url}")
+    return key
+
+
+class AssetStore(abc.ABC):
+    """Content-addressed file store; subclasses provide the backend."""
+
+    backend = 'abstract'
+
+    def __init__(self, root: str, staging_dir: Optional[str] = None, depth: int = 2):
+        self.root = os.path.realpath(root)
+        self.staging_dir = staging_dir or os.path.join(self.root, '.staging')
+        self.depth = max(0, depth)
+        os.makedirs(self.staging_dir, exist_ok=True)
+        self.counters = {'puts': 0, 'deduplicated': 0, 'bytes_stored': 0, 'bytes_deduplicated': 0, 'fetches': 0}
+
+    @classmethod
+    def from_env(cls, root: str) -> 'AssetStore':
+        backend = os.getenv("ASSET_STORAGE", "local").lower()
+        kwargs = {
+            'staging_dir': os.getenv("ASSET_STAGING_DIR") or None,
+            'depth': int(os.getenv("ASSET_SHARD_DEPTH", "2")),
+        }
+        if backend == 'local':
+            return LocalAssetStore(root, **kwargs)
+        if backend == 's3':
+            return S3AssetStore(
+                root,
+                bucket=os.environ["ASSET_S3_BUCKET"],
+                prefix=os.getenv("ASSET_S3_PREFIX", "assets/"),
+                endpoint_url=os.getenv("ASSET_S3_ENDPOINT_URL") or None,
+                **kwargs,
+            )
+        raise ValueError(f"Unknown ASSET_STORAGE backend: {backend}")
+
+    # ---------- paths ----------
+
+    def staging_path(self, name: str) -> str:
+        """A fresh path to render `name` into before it is put()."""
+        return os.path.join(self.staging_dir, f"{uuid.uuid4().hex}{suffix_of(name)}")
+
+    def url(self, key: str) -> str:
+        return URL_PREFIX + key
+
+    def cache_path(self, key: str) -> str:
+        return os.path.join(self.root, *key.split('/'))
+
+    def key_for_path(self, path: str) -> Optional[str]:
+        """The key of a file that already sits at its place in the store, else None."""
+        rel = os.path.relpath(os.path.realpath(path), self.root)
+        if rel.startswith('..') or os.sep + '.' in os.sep + rel:
+            return None
+        key = rel.replace(os.sep, '/')
+        return key if _KEY_RE.match(key) or _LEGACY_RE.match(key) else None
+
+    # ---------- operations ----------
+
+    def put(self, src_path: str, suffix: Optional[str] = None) -> Dict[str, Any]:
+        """Store a staged file by content and consume it.
+
+        Returns {'key', 'url', 'path', 'digest', 'size', 'deduplicated'}; `path`
+        is a local file with the content, valid for render workers to read.
+        """
+        key = self.key_for_path(src_path)
+        if key is not None:
+            path = self.cache_path(key)
+            self._touch(key)
+            return {'key': key, 'url': self.url(key), 'path': path, 'digest': _digest_of(key),
+                    'size': os.path.getsize(path), 'deduplicated': True}
+        digest = file_sha256(src_path)
+        size = os.path.getsize(src_path)
+        key = shard_key(digest, suffix_of(src_path) if suffix is None else suffix, self.depth)
+        stored = self._store(src_path, key)
+        self.counters['puts'] += 1
+        if stored:
+            self.counters['bytes_stored'] += size
+        else:
+            self.counters['deduplicated'] += 1
+            self.counters['bytes_deduplicated'] += size
+        return {'key': key, 'url': self.url(key), 'path': self.cache_path(key), 'digest': digest,
+                'size': size, 'deduplicated': not stored}
+
+    def local_path(self, key: str) -> str:
+        """A readable local file for `key`; raises FileNotFoundError when it is not stored."""
+        path = self.cache_path(key)
+        if not os.path.isfile(path):
+            self._fetch(key, path)
+            self.counters['fetches'] += 1
+        return path
+
+    def resolve_url(self, url: str) -> str:
+        """Local file behind an `/assets/...` URL (ValueError / FileNotFoundError otherwise)."""
+        return self.local_path(key_from_url(url))
+
+    def _place(self, src_path: str, dest: str) -> bool:
+        """Move a staged file into the local tree; False when identical content was already there."""
+        if os.path.exists(dest):
+            with contextlib.suppress(OSError):
+                os.utime(dest)
+            with contextlib.suppress(OSError):
+                os.remove(src_path)
+            return False
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        try:
+            os.replace(src_path, dest)
+        except OSError:
+            # Staging on another filesystem: copy next to the destination, then rename atomically.
+            tmp = f"{dest}.{uuid.uuid4().hex}.part"
+            shutil.copyfile(src_path, tmp)
+            os.replace(tmp, dest)
+            os.remove(src_path)
+        return True
+
+    def _walk_local(self, include_legacy: bool) -> Iterator[Tuple[str, float]]:
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+            rel_dir = os.path.relpath(dirpath, self.root)
+            for name in filenames:
+                key = name if rel_dir == '.' else f"{rel_dir.replace(os.sep, '/')}/{name}"
+                if not (_KEY_RE.match(key) or (include_legacy and rel_dir == '.' and _LEGACY_RE.match(key))):
+                    continue
+                with contextlib.suppress(FileNotFoundError):
+                    yield key, os.stat(os.path.join(dirpath, name)).st_mtime
+
+    def sweep_staging(self, older_than: float) -> int:
+        """Delete staged renders abandoned before `older_than` (a timestamp); returns how many."""
+        removed = 0
+        with os.scandir(self.staging_dir) as entries:
+            for entry in entries:
+                with contextlib.suppress(FileNotFoundError):
+                    if entry.is_file() and entry.stat().st_mtime < older_than:
+                        os.remove(entry.path)
+                        removed += 1
+        return removed
+
+    @abc.abstractmethod
+    def _store(self, src_path: str, key: str) -> bool:
+        """Store a staged file under `key` (consuming it); False when the content was already stored."""
+
+    def _touch(self, key: str):
+        """Mark a stored key as just referenced (see assetgc's grace period)."""
+        with contextlib.suppress(FileNotFoundError):
+            os.utime(self.cache_path(key))
+
+    @abc.abstractmethod
+    def iter_keys(self, include_legacy: bool = False) -> Iterator[Tuple[str, float]]:
+        """Every stored key with its last-modified timestamp (legacy flat files only if asked)."""
+
+    def _fetch(self, key: str, dest: str):
+        raise FileNotFoundError(key)
+
+    @abc.abstractmethod
+    def exists(self, key: str) -> bool:
+        """Whether `key` is stored in the backend (not just in the local cache)."""
+
+    @abc.abstractmethod
+    def delete(self, key: str):
+        """Remove `key` from the backend and the local cache."""
+
+    def stats(self) -> Dict[str, Any]:
+        return {'backend': self.backend, 'shard_depth': self.depth, **self.counters}
+
+
+def _digest_of(key: str) -> Optional[str]:
+    m = _KEY_RE.match(key)
+    return m.group(1) if m else None
+
+
+class LocalAssetStore(AssetStore):
+    """Stores files on the local filesystem below `root`."""
+
+    backend = 'local'
+
+    def _store(self, src_path: str, key: str) -> bool:
+        return self._place(src_path, self.cache_path(key))
+
+    def exists(self, key: str) -> bool:
+        return os.path.isfile(self.cache_path(key))
+
+    def iter_keys(self, include_legacy: bool = False) -> Iterator[Tuple[str, float]]:
+        return self._walk_local(include_legacy)
+
+    def delete(self, key: str):
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(self.cache_path(key))
+
+
+class S3AssetStore(AssetStore):
+    """Stores objects in an S3-compatible bucket, with a local read cache below `root`.
+
+    Needs boto3. Point `endpoint_url` at MinIO or `moto_server` to run
+    against a local stand-in.
+    """
+
+    backend = 's3'
+
+    def __init__(self, root: str, bucket: str, prefix: str = 'assets/', endpoint_url: Optional[str] = None,
+                 client=None, **kwargs):
+        super().__init__(root, **kwargs)
+        if client is None:
+            import boto3
+            client = boto3.client('s3', endpoint_url=endpoint_url)
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def _object(self, key: str) -> str:
+        return self.prefix + key
+
+    def exists(self, key: str) -> bool:
+        if not _KEY_RE.match(key):
+            return os.path.isfile(self.cache_path(key))  # legacy files only exist locally
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._object(key))
+            return True
+        except self.client.exceptions.ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+
+    def _store(self, src_path: str, key: str) -> bool:
+        uploaded = False
+        if not self.exists(key):
+            self.client.upload_file(src_path, self.bucket, self._object(key))
+            uploaded = True
+        else:
+            self._touch_object(key)
+        self._place(src_path, self.cache_path(key))
+        return uploaded
+
+    def _touch_object(self, key: str):
+        # Server-side self-copy: refreshes LastModified without re-uploading.
+        self.client.copy_object(Bucket=self.bucket, Key=self._object(key), MetadataDirective='REPLACE',
+                                CopySource={'Bucket': self.bucket, 'Key': self._object(key)})
+
+    def _touch(self, key: str):
+        if _KEY_RE.match(key):
+            self._touch_object(key)
+        super()._touch(key)
+
+    def iter_keys(self, include_legacy: bool = False) -> Iterator[Tuple[str, float]]:
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+            for obj in page.get('Contents', []):
+                key = obj['Key'][len(self.prefix):]
+                if _KEY_RE.match(key):
+                    yield key, obj['LastModified'].timestamp()
+        if include_legacy:
+            # Legacy files were never uploaded; they only exist in the local tree.
+            for key, mtime in self._walk_local(True):
+                if not _KEY_RE.match(key):
+                    yield key, mtime
+
+    def _fetch(self, key: str, dest: str):
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        tmp = f"{dest}.{uuid.uuid4().hex}.part"
+        try:
+            self.client.download_file(self.bucket, self._object(key), tmp)
+        except self.client.exceptions.ClientError as e:
+            with contextlib.suppress(OSError):
+                os.remove(tmp)
+            raise FileNotFoundError(key) from e
+        os.replace(tmp, dest)
+
+    def delete(self, key: str):
+        self.client.delete_object(Bucket=self.bucket, Key=self._object(key))
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(self.cache_path(key))
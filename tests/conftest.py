@@ -0,0 +1,33 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+@pytest.fixture
+def mongo(monkeypatch):
+    """An in-memory database behind `database.adb` and the `a*` helpers."""
+    mongomock = pytest.importorskip('mongomock')
+    import database
+    db = mongomock.MongoClient().test
+    monkeypatch.setattr(database, 'db', db)
+    return db
+
+
+@pytest.fixture
+def app(mongo, tmp_path, monkeypatch):
+    """The `main` module on the in-memory database, storing assets under tmp_path."""
+    import main
+    from storage import LocalAssetStore
+    monkeypatch.setattr(main, 'asset_store', LocalAssetStore(str(tmp_path / 'assets')))
+    monkeypatch.setattr(main, 'result_cache', main.ResultCache())
+    # Fresh per-test state; these hold asyncio primitives tied to the previous test's loop.
+    monkeypatch.setattr(main, 'job_events', main.JobEventBroker())
+    monkeypatch.setattr(main, 'job_state', main.JobStateBuffer(push_limits=main.LOG_LIMITS))
+    monkeypatch.setattr(main, 'inflight', main.InFlight())
+    monkeypatch.setattr(main, 'idempotency', main.IdempotencyStore())
+    return main
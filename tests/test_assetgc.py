@@ -0,0 +1,144 @@
+import asyncio
+import os
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from assetgc import AssetSweeper
+from storage import LocalAssetStore
+
+HOUR = 3600
+
+
+@pytest.fixture
+def store(tmp_path):
+    return LocalAssetStore(str(tmp_path / 'assets'))
+
+
+def _sweeper(store, owner='a', **kwargs):
+    return AssetSweeper(store, owner, grace_sec=60, batch_size=2, batch_pause_sec=0, **kwargs)
+
+
+def _put(store, data: bytes, age_sec: float = 0):
+    stored = store.put(_staged(store, data))
+    t = time.time() - age_sec
+    os.utime(stored['path'], (t, t))
+    return stored
+
+
+def _staged(store, data: bytes):
+    path = store.staging_path('x.wav')
+    with open(path, 'wb') as f:
+        f.write(data)
+    return path
+
+
+def _asset(mongo, stored, age_sec: float = 0, **fields):
+    doc = {'url': stored['url'], 'storage_key': stored['key'], 'size': stored['size'],
+           'created_at': datetime.utcnow() - timedelta(seconds=age_sec), **fields}
+    return mongo.asset.insert_one(doc).inserted_id
+
+
+def test_orphans_are_deleted_after_the_grace_period(mongo, store):
+    kept = [_put(store, b'referenced', HOUR), _put(store, b'young')]
+    _asset(mongo, kept[0], HOUR)
+    in_profile = _put(store, b'voice', HOUR)
+    mongo.voiceprofile.insert_one({'files': [in_profile['url']]})
+    orphans = [_put(store, b'orphan-%d' % i, HOUR) for i in range(3)]
+    stale = _staged(store, b'abandoned')
+    os.utime(stale, (time.time() - HOUR,) * 2)
+
+    report = asyncio.run(_sweeper(store).delete_orphans())
+    assert report == {'orphan_files': 3, 'orphan_bytes': sum(o['size'] for o in orphans), 'staging_files': 1}
+    assert all(store.exists(s['key']) for s in kept + [in_profile])
+    assert not any(store.exists(o['key']) for o in orphans)
+
+
+def test_intermediates_expire(mongo, store):
+    stem = _asset(mongo, _put(store, b'stem'), 2 * HOUR, retention='intermediate')
+    young = _asset(mongo, _put(store, b'stem2'), 60, retention='intermediate')
+    master = _asset(mongo, _put(store, b'master'), 2 * HOUR, retention='final')
+    assert asyncio.run(_sweeper(store, intermediate_ttl_sec=HOUR).expire_intermediates()) == 1
+    assert {d['_id'] for d in mongo.asset.find()} == {young, master}
+    assert not mongo.asset.find_one({'_id': stem})
+
+
+def test_dangling_documents_are_deleted(mongo, store):
+    gone = _put(store, b'gone')
+    store.delete(gone['key'])
+    _asset(mongo, gone, HOUR)
+    alive = _asset(mongo, _put(store, b'alive'), HOUR)
+    foreign = mongo.asset.insert_one({'url': 'https://cdn.example/x.wav', 'created_at': datetime(2000, 1, 1)}).inserted_id
+    assert asyncio.run(_sweeper(store).delete_dangling()) == 1
+    assert {d['_id'] for d in mongo.asset.find()} == {alive, foreign}
+
+
+def test_quota_evicts_oldest_intermediates(mongo, store):
+    old = _asset(mongo, _put(store, b'a' * 400), 3 * HOUR, project_id='p', retention='intermediate')
+    newer = _asset(mongo, _put(store, b'b' * 400), 2 * HOUR, project_id='p', retention='intermediate')
+    final = _asset(mongo, _put(store, b'c' * 400), 3 * HOUR, project_id='p', retention='final')
+    sweeper = _sweeper(store, project_quota_bytes=800)
+    assert asyncio.run(sweeper.enforce_quotas()) == 1
+    assert {d['_id'] for d in mongo.asset.find()} == {newer, final}
+    assert not mongo.asset.find_one({'_id': old})
+    assert sweeper.over_quota('p') == 0
+
+    sweeper.project_quota_bytes = 300
+    asyncio.run(sweeper.enforce_quotas())
+    assert sweeper.over_quota('p') == 100
+
+
+def test_one_sweeper_at_a_time(mongo, store):
+    async def run():
+        a, b = _sweeper(store, 'a'), _sweeper(store, 'b')
+        assert await a._acquire()
+        assert await b.sweep() == {}
+        await a._release()
+        return await b.sweep(), b
+    report, b = asyncio.run(run())
+    assert 'orphan_files' in report and b.skipped == 1 and b.sweeps == 1
+
+
+def test_dangling_pass_rotates_through_the_collection(mongo, store, monkeypatch):
+    ids = [_asset(mongo, _put(store, b'%d' % i), HOUR) for i in range(7)]
+    gone = mongo.asset.find_one({'_id': ids[5]})
+    store.delete(gone['storage_key'])
+    checked = []
+    exists = store.exists
+    monkeypatch.setattr(store, 'exists', lambda key: checked.append(key) or exists(key))
+    sweeper = _sweeper(store, dangling_per_sweep=3)
+
+    async def sweep():
+        checked.clear()
+        await sweeper.sweep()
+        return list(checked)
+    first = asyncio.run(sweep())
+    second = asyncio.run(sweep())
+    third = asyncio.run(sweep())
+    assert len(first) == len(second) == len(third) == 3
+    assert len(set(first + second + third)) == 7  # the third sweep wrapped around
+    assert third[1:] == first[:2]
+    assert mongo.asset.find_one({'_id': ids[5]}) is None
+
+
+def test_lock_is_extended_and_a_lost_lock_stops_the_sweep(mongo, store, monkeypatch):
+    sweeper = _sweeper(store)
+
+    async def run():
+        assert await sweeper._acquire()
+        mongo.sweeper.update_one({'_id': 'asset_gc'}, {'$set': {'locked_until': datetime.utcnow()}})
+        sweeper._renewed_at = 0
+        await sweeper._pause()
+        extended = mongo.sweeper.find_one()['locked_until']
+        await sweeper._release()
+
+        async def stolen():
+            mongo.sweeper.update_one({'_id': 'asset_gc'}, {'$set': {'owner': 'b'}})
+            sweeper._renewed_at = 0
+            await sweeper._pause()
+        monkeypatch.setattr(sweeper, 'expire_intermediates', stolen)
+        return extended, await sweeper.sweep()
+    extended, report = asyncio.run(run())
+    assert extended > datetime.utcnow() + timedelta(seconds=sweeper.lock_ttl_sec - 60)
+    assert report == {} and sweeper.sweeps == 0
@@ -0,0 +1,69 @@
+import wave
+
+import numpy as np
+import pytest
+
+import audio_analysis
+import dsp
+
+SR = 44100
+
+
+@pytest.fixture
+def clip(tmp_path):
+    def write(samples: np.ndarray) -> dsp.WavData:
+        path = tmp_path / f'clip{len(list(tmp_path.iterdir()))}.wav'
+        with wave.open(str(path), 'wb') as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(SR)
+            f.writeframes((np.clip(samples, -1, 1) * 32767).astype('<i2').tobytes())
+        return dsp.open_wav(str(path))
+    return write
+
+
+def _tone(sec=3.0, amp=0.5):
+    t = np.arange(int(SR * sec)) / SR
+    return amp * np.sin(2 * np.pi * 440 * t)
+
+
+def _noise(n, amp):
+    return amp * np.random.default_rng(0).standard_normal(n)
+
+
+def test_clean_continuous_tone_is_not_noisy(clip):
+    m = audio_analysis.measure(clip(_tone()))
+    assert m['snr_db'] > 60
+    assert 'noisy' not in audio_analysis._issues(m)
+
+
+def test_tone_buried_in_noise_is_noisy(clip):
+    tone = _tone(amp=0.3)
+    m = audio_analysis.measure(clip(tone + _noise(len(tone), 0.15)))
+    assert m['snr_db'] < audio_analysis.MIN_SNR_DB
+    assert 'noisy' in audio_analysis._issues(m)
+
+
+def test_noise_floor_comes_from_the_gaps(clip):
+    tone = _tone()
+    gated = tone * (np.floor(np.arange(len(tone)) / SR * 2) % 2 == 0)
+    clean = audio_analysis.measure(clip(gated + _noise(len(tone), 0.0005)))
+    noisy = audio_analysis.measure(clip(gated + _noise(len(tone), 0.1)))
+    assert clean['noise_floor_dbfs'] == pytest.approx(-66, abs=2)
+    assert clean['snr_db'] > 40
+    assert noisy['snr_db'] < audio_analysis.MIN_SNR_DB
+
+
+def test_clip_shorter_than_a_frame_is_not_judged(clip):
+    m = audio_analysis.measure(clip(_tone(sec=0.01)))
+    assert m['snr_db'] is None and m['noise_floor_dbfs'] is None
+    assert audio_analysis._issues(m) == []
+
+
+def test_report_summary_skips_unmeasured_snr():
+    clips = [{'mono_ok': True, 'sr_ok': True, 'converted': False, 'issues': [], 'duration_sec': 1.0,
+              'metrics': {'snr_db': snr, 'clipping_ratio': 0.0, 'silence_ratio': 0.0, 'loudness_lufs': -20.0}}
+             for snr in (None, 30.0)]
+    report = audio_analysis.build_report(clips)
+    assert report['quality_ok']
+    assert report['summary']['min_snr_db'] == 30.0
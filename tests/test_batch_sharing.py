@@ -0,0 +1,50 @@
+import asyncio
+
+import pytest
+
+from checkpoint import Checkpoint
+
+
+class _InlinePool:
+    async def run(self, stage, fn, *args, **kwargs):
+        return fn(*args, **kwargs)
+
+
+@pytest.fixture
+def pipelines(app, mongo, monkeypatch):
+    monkeypatch.setattr(app, 'render_pool', _InlinePool())
+    real_sleep = asyncio.sleep
+    monkeypatch.setattr(asyncio, 'sleep', lambda d: real_sleep(0))
+
+    def build(shared, **body):
+        job_id = str(mongo.job.insert_one({'status': 'running'}).inserted_id)
+        return app.full_pipeline('p1', {'tempo': 90, 'key': 'C minor', **body}, Checkpoint(job_id), shared)
+    return build
+
+
+def _run(pipeline, stage):
+    return pipeline.stages[stage].run({})
+
+
+def test_instrumental_not_shared_across_styles(pipelines):
+    async def run():
+        shared = {}
+        a = pipelines(shared, style='Jazz', instruments=['Piano'])
+        b = pipelines(shared, style='Folk', instruments=['Piano'])
+        ra, rb = await asyncio.gather(_run(a, 'instrumental'), _run(b, 'instrumental'))
+        return shared, ra, rb
+    shared, ra, rb = asyncio.run(run())
+    assert ra['asset_ids'] != rb['asset_ids']
+    assert shared.get('_reused', 0) == 0
+
+
+def test_melody_shared_across_instrument_sets(pipelines):
+    async def run():
+        shared = {}
+        a = pipelines(shared, style='Jazz', instruments=['Piano'])
+        b = pipelines(shared, style='Jazz', instruments=['Guitar'])
+        ra, rb = await asyncio.gather(_run(a, 'melody'), _run(b, 'melody'))
+        return shared, ra, rb
+    shared, ra, rb = asyncio.run(run())
+    assert ra['asset_ids'] == rb['asset_ids']
+    assert shared['_reused'] == 1
@@ -0,0 +1,94 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from pymongo.errors import DuplicateKeyError
+
+import database
+from database import adb
+from metrics import DB_ERRORS
+
+
+class _SpyDb:
+    """Wraps a database so every collection call records the thread it ran on."""
+
+    def __init__(self, db, delay=0.0):
+        self.db = db
+        self.delay = delay
+        self.threads = []
+        self.active = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def __getitem__(self, name):
+        spy = self
+        col = self.db[name]
+
+        class _Col:
+            def __getattr__(self, op):
+                fn = getattr(col, op)
+
+                def call(*args, **kwargs):
+                    with spy._lock:
+                        spy.threads.append(threading.current_thread().name)
+                        spy.active += 1
+                        spy.peak = max(spy.peak, spy.active)
+                    try:
+                        time.sleep(spy.delay)
+                        return fn(*args, **kwargs)
+                    finally:
+                        with spy._lock:
+                            spy.active -= 1
+                return call
+        return _Col()
+
+
+def test_calls_run_on_the_io_pool_not_the_loop(mongo, monkeypatch):
+    spy = _SpyDb(mongo)
+    monkeypatch.setattr(database, 'db', spy)
+
+    async def run():
+        await adb.item.insert_one({'_id': 1, 'n': 1})
+        return threading.current_thread().name, await adb.item.find_one({'_id': 1})
+    loop_thread, doc = asyncio.run(run())
+
+    assert doc == {'_id': 1, 'n': 1}
+    assert len(spy.threads) == 2
+    assert all(t.startswith('db-io') and t != loop_thread for t in spy.threads)
+
+
+def test_pool_bounds_concurrent_calls_without_blocking_the_loop(mongo, monkeypatch):
+    spy = _SpyDb(mongo, delay=0.05)
+    monkeypatch.setattr(database, 'db', spy)
+    monkeypatch.setattr(database, '_io_executor', ThreadPoolExecutor(max_workers=2, thread_name_prefix='db-io'))
+
+    async def run():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.01)
+        t = asyncio.create_task(ticker())
+        await asyncio.gather(*(adb.item.count_documents({}) for _ in range(6)))
+        t.cancel()
+        return ticks
+    ticks = asyncio.run(run())
+
+    assert spy.peak == 2
+    assert ticks >= 10  # ~150 ms of queued calls; the loop kept running throughout
+
+
+def test_errors_propagate_to_the_awaiting_caller(mongo):
+    before = DB_ERRORS.values.get(('item', 'insert_one'), 0)
+
+    async def run():
+        await adb.item.insert_one({'_id': 1})
+        await adb.item.insert_one({'_id': 1})
+    with pytest.raises(DuplicateKeyError):
+        asyncio.run(run())
+    assert DB_ERRORS.values.get(('item', 'insert_one'), 0) == before + 1
+    assert database.connection.breaker.stats()['state'] == 'closed'
@@ -0,0 +1,90 @@
+import asyncio
+
+import pytest
+
+from dbconn import CircuitBreaker, DatabaseUnavailable, MongoConnection
+
+
+def test_breaker_opens_half_opens_and_closes(monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr('dbconn.time.monotonic', lambda: clock[0])
+    b = CircuitBreaker(failures=2, cooldown_sec=10)
+    b.record(False)
+    assert b.state == 'closed'
+    b.record(False)
+    assert b.state == 'open' and b.opened == 1
+    with pytest.raises(DatabaseUnavailable) as e:
+        b.allow()
+    assert e.value.retry_after == 10
+
+    clock[0] += 10
+    assert b.state == 'half-open'
+    b.allow()  # the trial call
+    with pytest.raises(DatabaseUnavailable):
+        b.allow()  # only one at a time
+    b.record(False)  # trial failed: open again for a full cooldown
+    assert b.state == 'open' and b.opened == 1
+
+    clock[0] += 10
+    b.allow()
+    b.record(True)
+    assert b.state == 'closed' and b.stats()['consecutive_failures'] == 0
+    b.allow()
+    assert b.rejected == 2
+
+
+def test_released_trial_lets_another_caller_probe(monkeypatch):
+    clock = [0.0]
+    monkeypatch.setattr('dbconn.time.monotonic', lambda: clock[0])
+    b = CircuitBreaker(failures=1, cooldown_sec=1)
+    b.record(False)
+    clock[0] += 1
+    b.allow()
+    b.release()
+    b.allow()
+
+
+def _conn():
+    return MongoConnection(None, None, probe_ttl_sec=60)
+
+
+def test_concurrent_probes_share_one_ping():
+    conn = _conn()
+    pings = []
+
+    async def ping():
+        pings.append(1)
+        await asyncio.sleep(0.01)
+
+    async def run():
+        results = await asyncio.gather(*(conn.probe(ping) for _ in range(5)))
+        return results + [await conn.probe(ping)]
+    results = asyncio.run(run())
+    assert len(pings) == 1 and all(r['ok'] for r in results)
+
+
+def test_cancelled_prober_hands_over_to_a_waiter():
+    conn = _conn()
+    pings = []
+
+    async def ping():
+        pings.append(1)
+        await asyncio.sleep(0.05)
+
+    async def run():
+        first = asyncio.ensure_future(conn.probe(ping))
+        await asyncio.sleep(0)
+        waiter = asyncio.ensure_future(conn.probe(ping))
+        await asyncio.sleep(0)
+        first.cancel()
+        return await waiter
+    assert asyncio.run(run())['ok'] and len(pings) == 2
+
+
+def test_failed_ping_reports_error():
+    conn = _conn()
+
+    async def ping():
+        raise RuntimeError("auth failed")
+    result = asyncio.run(conn.probe(ping))
+    assert not result['ok'] and 'auth failed' in result['error'] and result['circuit'] == 'closed'
@@ -0,0 +1,74 @@
+import asyncio
+
+import httpx
+import pytest
+
+from delivery import AssetFiles, parse_range
+
+
+@pytest.mark.parametrize('header, expected', [
+    ('bytes=0-99', (0, 99)),
+    ('bytes=10-', (10, 999)),
+    ('bytes=-100', (900, 999)),
+    ('bytes=-5000', (0, 999)),
+    ('bytes=990-5000', (990, 999)),
+    ('BYTES = 5-6', (5, 6)),
+    ('bytes=0-1,5-6', None),
+    ('items=0-1', None),
+    ('bytes=abc', None),
+    ('bytes=-', None),
+    ('bytes=9-3', None),
+])
+def test_parse_range(header, expected):
+    assert parse_range(header, 1000) == expected
+
+
+@pytest.mark.parametrize('header, size', [('bytes=1000-', 1000), ('bytes=-0', 1000), ('bytes=-1', 0), ('bytes=0-', 0)])
+def test_unsatisfiable_ranges(header, size):
+    with pytest.raises(ValueError):
+        parse_range(header, size)
+
+
+@pytest.fixture
+def files(tmp_path):
+    (tmp_path / 'clip.wav').write_bytes(bytes(range(256)) * 4)
+    return AssetFiles(str(tmp_path))
+
+
+def _get(app, path, **headers):
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://t') as c:
+            return await c.get(path, headers=headers)
+    return asyncio.run(run())
+
+
+def test_range_request(files):
+    r = _get(files, '/clip.wav', range='bytes=10-19')
+    assert r.status_code == 206
+    assert r.headers['content-range'] == 'bytes 10-19/1024'
+    assert r.content == bytes(range(10, 20))
+
+
+def test_unsatisfiable_range_is_416(files):
+    r = _get(files, '/clip.wav', range='bytes=5000-')
+    assert r.status_code == 416
+    assert r.headers['content-range'] == 'bytes */1024'
+
+
+def test_if_range_mismatch_sends_whole_file(files):
+    r = _get(files, '/clip.wav', range='bytes=0-9', **{'if-range': '"stale"'})
+    assert r.status_code == 200 and len(r.content) == 1024
+
+
+def test_conditional_get(files):
+    etag = _get(files, '/clip.wav').headers['etag']
+    assert _get(files, '/clip.wav', **{'if-none-match': etag}).status_code == 304
+
+
+def test_paths_outside_the_tree_are_not_served(files, tmp_path):
+    (tmp_path / '.staging').mkdir()
+    (tmp_path / '.staging' / 'x.wav').write_bytes(b'x')
+    assert files._resolve('/../clip.wav') is None
+    assert files._resolve('/.staging/x.wav') is None
+    assert files._resolve('/clip.wav') is not None
+    assert _get(files, '/missing.wav').status_code == 404
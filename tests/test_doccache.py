@@ -0,0 +1,88 @@
+import asyncio
+
+from doccache import DocumentCache
+
+
+def _loader(docs, calls, gate=None):
+    async def load():
+        calls.append(1)
+        if gate is not None:
+            await gate.wait()
+        return docs.get('j1')
+    return load
+
+
+def test_concurrent_misses_load_once():
+    cache = DocumentCache('a', poll_sec=0)
+    calls = []
+
+    async def run():
+        gate = asyncio.Event()
+        load = _loader({'j1': {'status': 'running'}}, calls, gate)
+        tasks = [asyncio.ensure_future(cache.get('job', 'j1', load)) for _ in range(3)]
+        await asyncio.sleep(0)
+        gate.set()
+        return await asyncio.gather(*tasks)
+    docs = asyncio.run(run())
+    assert docs == [{'status': 'running'}] * 3 and len(calls) == 1
+    assert cache.stats()['coalesced'] == 2
+
+
+def test_load_racing_a_write_is_not_cached():
+    cache = DocumentCache('a', poll_sec=0)
+    calls = []
+
+    async def run():
+        gate = asyncio.Event()
+        task = asyncio.ensure_future(cache.get('job', 'j1', _loader({'j1': {'status': 'queued'}}, calls, gate)))
+        await asyncio.sleep(0)
+        cache.update('job', 'j1', sets={'status': 'running'})
+        gate.set()
+        await task
+        return cache.peek('job', 'j1')
+    assert asyncio.run(run()) is None
+
+
+def test_write_through_and_invalidation():
+    cache = DocumentCache('a', poll_sec=0)
+    load = _loader({'j1': {'status': 'running', 'logs': ['a']}}, [])
+    asyncio.run(cache.get('job', 'j1', load))
+    cache.update('job', 'j1', sets={'progress': 50}, pushes={'logs': ['b', 'c']}, limits={'logs': 2})
+    assert cache.peek('job', 'j1') == {'status': 'running', 'logs': ['b', 'c'], 'progress': 50}
+    cache.invalidate('job', ['j1'])
+    assert cache.peek('job', 'j1') is None
+    assert cache.stats()['invalidations_local'] == 1 and cache.bytes == 0
+
+
+def test_lru_and_ttl():
+    cache = DocumentCache('a', max_entries=2, ttl_sec=60, poll_sec=0)
+    for i in range(3):
+        cache._store(('job', str(i)), {'n': i})
+    assert cache.peek('job', '0') is None and cache.peek('job', '2') == {'n': 2}
+    assert cache.evictions == 1
+
+    cache.ttl_sec = 0
+    cache._store(('job', 'short'), {'status': 'running'})
+    cache._store(('job', 'done'), {'status': 'done'})
+    assert cache.peek('job', 'short') is None and cache.expirations == 1
+    assert cache.peek('job', 'done') == {'status': 'done'}
+
+
+def test_remote_invalidation(mongo):
+    a = DocumentCache('a', poll_sec=0.01)
+    b = DocumentCache('b', poll_sec=0.01)
+
+    async def run():
+        for cache in (a, b):
+            cache._store(('job', 'j1'), {'status': 'running'})
+            cache.start()
+        await asyncio.sleep(0.02)
+        await a.broadcast('job', ['j1'])
+        for _ in range(100):
+            if b.peek('job', 'j1') is None:
+                break
+            await asyncio.sleep(0.01)
+        await asyncio.gather(a.stop(), b.stop())
+    asyncio.run(run())
+    assert b.peek('job', 'j1') is None and b.invalidations_remote == 1
+    assert a.peek('job', 'j1') == {'status': 'running'}
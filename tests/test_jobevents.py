@@ -0,0 +1,120 @@
+import asyncio
+import types
+
+from jobevents import JobEventBroker
+
+
+def _age(broker, *job_ids, sec=120):
+    """Pretend `job_ids` (and the last sweep) happened `sec` seconds ago."""
+    for job_id in job_ids:
+        broker._channels[job_id].touched -= sec
+    broker._swept -= sec
+
+
+async def _take(agen, n):
+    out = []
+    async for item in agen:
+        out.append(item)
+        if len(out) == n:
+            break
+    await agen.aclose()
+    return out
+
+
+def test_replay_after_last_event_id():
+    async def scenario():
+        broker = JobEventBroker()
+        broker.open('j', {'status': 'queued'})
+        first = broker.publish('j', 'update', {'progress': 10})
+        broker.publish('j', 'update', {'progress': 20})
+        broker.publish('j', 'log', {'line': 'hello'})
+        return first, await _take(broker.subscribe('j', first), 2)
+
+    first, events = asyncio.run(scenario())
+    assert [e[0] for e in events] == [first + 1, first + 2]
+    assert [e[1] for e in events] == ['update', 'log']
+
+
+def test_snapshot_log_tail_is_capped():
+    async def scenario():
+        broker = JobEventBroker(state_logs=3)
+        broker.open('j', {'logs': [f'old {i}' for i in range(10)]})
+        assert broker.snapshot('j')['logs'] == ['old 7', 'old 8', 'old 9']
+        for i in range(5):
+            broker.publish('j', 'log', {'line': f'new {i}'})
+        return broker.snapshot('j')['logs']
+
+    assert asyncio.run(scenario()) == ['new 2', 'new 3', 'new 4']
+
+
+def test_ids_keep_increasing_across_reopen_and_stale_ids_get_a_snapshot():
+    async def scenario():
+        broker = JobEventBroker(idle_sec=60)
+        broker.open('j', {'status': 'running'})
+        stale = broker.publish('j', 'update', {'progress': 50})
+        _age(broker, 'j')
+        broker._sweep()
+        assert not broker.has('j')
+        broker.open('j', {'status': 'running', 'progress': 60})
+        fresh = broker.publish('j', 'update', {'progress': 70})
+        assert fresh > stale
+        return await _take(broker.subscribe('j', stale), 1)
+
+    (event,) = asyncio.run(scenario())
+    assert event[1] == 'snapshot' and event[2]['progress'] == 70
+
+
+def test_idle_channels_are_evicted_but_watched_ones_stay():
+    async def scenario():
+        broker = JobEventBroker(idle_sec=60)
+        broker.open('idle', {'status': 'running'})
+        broker.open('watched', {'status': 'running'})
+        broker.open('recent', {'status': 'running'})
+        sub = broker.subscribe('watched')
+        await sub.__anext__()  # snapshot; now subscribed
+        _age(broker, 'idle', 'watched')
+        broker._sweep()
+        present = broker.has('idle'), broker.has('watched'), broker.has('recent')
+        await sub.aclose()
+        return present, broker.stats()['evicted']
+
+    present, evicted = asyncio.run(scenario())
+    assert present == (False, True, True)
+    assert evicted == 1
+
+
+def test_terminal_event_ends_subscriptions():
+    async def scenario():
+        broker = JobEventBroker()
+        broker.open('j', {'status': 'running'})
+        sub = broker.subscribe('j')
+        received = [await sub.__anext__()]
+
+        async def rest():
+            async for item in sub:
+                received.append(item)
+        task = asyncio.create_task(rest())
+        await asyncio.sleep(0)
+        broker.publish('j', 'end', {'status': 'done', 'result': {'ok': 1}})
+        await asyncio.wait_for(task, 1)
+        return received
+
+    kinds = [k for _, k, _ in asyncio.run(scenario())]
+    assert kinds == ['snapshot', 'end']
+
+
+def test_stream_relays_jobs_run_by_another_local_process(mongo):
+    import main
+
+    async def scenario():
+        job_id = str(mongo['job'].insert_one({'type': 'melody', 'status': 'running', 'progress': 5,
+                                              'runner': 'another-process'}).inserted_id)
+        request = types.SimpleNamespace(headers={})
+        await main.job_events_stream(job_id, request)
+        watched = job_id in main._watchers
+        main._watchers[job_id].cancel()
+        await asyncio.sleep(0)
+        return watched
+
+    assert main.JOB_EXECUTION == 'local'
+    assert asyncio.run(scenario())
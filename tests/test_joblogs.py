@@ -0,0 +1,113 @@
+import asyncio
+
+import pytest
+from pymongo.errors import AutoReconnect
+
+import joblogs
+from database import adb
+from joblogs import JobLogStore
+
+
+def _store(**kwargs):
+    return JobLogStore(interval=3600, **kwargs)
+
+
+def test_tail_merges_buffered_and_stored_lines_in_order(mongo):
+    store = _store()
+
+    async def run():
+        ids = [store.append('j1', f'line {i}') for i in range(3)]
+        store.append('other', 'not ours')
+        await store.flush()
+        ids += [store.append('j1', f'line {i}') for i in range(3, 5)]
+        everything, cursor = await store.tail('j1')
+        rest, _ = await store.tail('j1', after=ids[1])
+        page, page_cursor = await store.tail('j1', limit=2)
+        return ids, everything, cursor, rest, page, page_cursor, await store.latest('j1')
+    ids, everything, cursor, rest, page, page_cursor, latest = asyncio.run(run())
+    assert [d['line'] for d in everything] == [f'line {i}' for i in range(5)]
+    assert cursor == ids[-1] == latest
+    assert [d['id'] for d in rest] == ids[2:]
+    assert [d['id'] for d in page] == ids[:2] and page_cursor == ids[1]
+
+
+def test_tail_without_new_lines_keeps_the_cursor(mongo):
+    store = _store()
+
+    async def run():
+        cursor = store.append('j1', 'only')
+        assert await store.tail('j1', after=cursor) == ([], cursor)
+        with pytest.raises(ValueError):
+            await store.tail('j1', after='bogus')
+    asyncio.run(run())
+
+
+class _FlakyDb:
+    """adb stand-in whose insert_many fails `failures` times before going through."""
+
+    def __init__(self, failures):
+        self.failures = failures
+
+    def __getitem__(self, name):
+        flaky = self
+
+        class Collection:
+            def __getattr__(self, attr):
+                return getattr(adb[name], attr)
+
+            async def insert_many(self, docs, **kwargs):
+                if flaky.failures:
+                    flaky.failures -= 1
+                    raise AutoReconnect("connection reset")
+                return await adb[name].insert_many(docs, **kwargs)
+        return Collection()
+
+
+def test_failed_flush_is_retried_without_losing_or_reordering_lines(mongo, monkeypatch):
+    monkeypatch.setattr(joblogs, 'adb', _FlakyDb(failures=1))
+    store = _store()
+
+    async def run():
+        for i in range(3):
+            store.append('j1', f'line {i}')
+        with pytest.raises(AutoReconnect):
+            await store.flush()
+        assert store.stats()['pending'] == 3
+        buffered, _ = await store.tail('j1')
+        store.append('j1', 'line 3')
+        await store.flush()
+        return buffered
+    buffered = asyncio.run(run())
+    assert len(buffered) == 3
+    stored = [d['line'] for d in mongo.job_log.find(sort=[('_id', 1)])]
+    assert stored == [f'line {i}' for i in range(4)]
+    assert store.stats()['failures'] == 1 and store.stats()['pending'] == 0
+
+
+def test_retry_skips_lines_an_earlier_attempt_wrote(mongo):
+    store = _store()
+
+    async def run():
+        ids = [store.append('j1', f'line {i}') for i in range(3)]
+        # A write that timed out client-side but reached the server.
+        mongo.job_log.insert_one({**store._pending[0]})
+        await store.flush()
+        return ids
+    ids = asyncio.run(run())
+    assert [str(d['_id']) for d in mongo.job_log.find(sort=[('_id', 1)])] == ids
+    assert store.stats()['pending'] == 0
+
+
+def test_job_document_keeps_only_the_tail(app, mongo):
+    job_id = mongo.job.insert_one({'status': 'running', 'logs': []}).inserted_id
+    tail = app.job_logs.tail_lines
+
+    async def run():
+        for i in range(tail + 10):
+            await app.record_log(str(job_id), f'line {i}')
+        await app.job_state.flush()
+        await app.job_logs.flush()
+    asyncio.run(run())
+    logs = mongo.job.find_one({'_id': job_id})['logs']
+    assert logs == [f'line {i}' for i in range(10, tail + 10)]
+    assert mongo.job_log.count_documents({'job_id': str(job_id)}) == tail + 10
@@ -0,0 +1,111 @@
+import asyncio
+
+import pytest
+
+from jobqueue import JobScheduler, QueueFull, _SlotGate
+
+
+def test_gate_serves_waiters_by_priority():
+    async def scenario():
+        gate = _SlotGate(1)
+        await gate.acquire(1)
+        order = []
+
+        async def waiter(name, priority):
+            await gate.acquire(priority)
+            order.append(name)
+            gate.release()
+
+        tasks = [asyncio.create_task(waiter('low', 2)), asyncio.create_task(waiter('high', 0))]
+        await asyncio.sleep(0)
+        gate.release()
+        await asyncio.gather(*tasks)
+        return order
+
+    assert asyncio.run(scenario()) == ['high', 'low']
+
+
+def test_cancelled_waiter_does_not_block_later_acquirers():
+    async def scenario():
+        gate = _SlotGate(1)
+        await gate.acquire(1)
+        stuck = asyncio.create_task(gate.acquire(1))
+        await asyncio.sleep(0)
+        stuck.cancel()
+        await asyncio.gather(stuck, return_exceptions=True)
+        assert not gate._waiters
+        gate.release()
+        # A free slot and nobody waiting: this must not queue behind the cancelled waiter.
+        await asyncio.wait_for(gate.acquire(1), timeout=1)
+
+    asyncio.run(scenario())
+
+
+def test_queue_full_is_rejected_with_retry_hint():
+    async def scenario():
+        sched = JobScheduler({'melody': ('high', 1, 1)}, max_active=1)
+        release = asyncio.Event()
+        sched.submit('melody', 'a', release.wait)
+        await asyncio.sleep(0.01)  # 'a' is running, the queue is empty again
+        sched.submit('melody', 'b', release.wait)
+        with pytest.raises(QueueFull) as exc:
+            sched.submit('melody', 'c', release.wait)
+        assert exc.value.retry_after >= 1
+        release.set()
+        await sched.stop()
+
+    asyncio.run(scenario())
+
+
+def test_lane_override_is_reported():
+    async def scenario():
+        started = {}
+
+        async def on_start(job_id, info):
+            started[job_id] = info
+
+        sched = JobScheduler({'create': ('low', 1, 10)}, max_active=1, on_start=on_start)
+        release = asyncio.Event()
+        sched.submit('create', 'a', release.wait)
+        await asyncio.sleep(0.01)
+        info = sched.submit('create', 'b', release.wait, lane='high')
+        assert info['lane'] == 'high'
+        assert sched.queue_info('create', 'b')['lane'] == 'high'
+        release.set()
+        for _ in range(100):
+            if 'b' in started:
+                break
+            await asyncio.sleep(0.01)
+        await sched.stop()
+        return started
+
+    started = asyncio.run(scenario())
+    assert started['a']['lane'] == 'low'
+    assert started['b']['lane'] == 'high'
+
+
+def test_higher_lane_runs_first_when_slots_are_scarce():
+    async def scenario():
+        order = []
+        sched = JobScheduler({'melody': ('high', 1, 10), 'video': ('low', 1, 10)}, max_active=1)
+        release = asyncio.Event()
+        sched.submit('video', 'blocker', release.wait)
+        await asyncio.sleep(0.01)
+
+        def job(name):
+            async def run():
+                order.append(name)
+            return run
+
+        sched.submit('video', 'video', job('video'))
+        sched.submit('melody', 'melody', job('melody'))
+        await asyncio.sleep(0.01)
+        release.set()
+        for _ in range(100):
+            if len(order) == 2:
+                break
+            await asyncio.sleep(0.01)
+        await sched.stop()
+        return order
+
+    assert asyncio.run(scenario()) == ['melody', 'video']
@@ -0,0 +1,69 @@
+import asyncio
+
+from bson import ObjectId
+
+import database
+from jobstate import JobStateBuffer
+
+
+def _job(mongo):
+    return str(mongo['job'].insert_one({'status': 'queued', 'progress': 0, 'logs': []}).inserted_id)
+
+
+def test_updates_are_coalesced_into_one_write(mongo):
+    async def scenario(job_id):
+        buf = JobStateBuffer(interval=60, push_limits={'logs': 2})
+        for i in range(10):
+            await buf.set(job_id, {'progress': i})
+            await buf.push(job_id, 'logs', f'line {i}')
+        assert mongo['job'].find_one({'_id': ObjectId(job_id)})['progress'] == 0
+        await buf.stop()
+        return buf
+
+    job_id = _job(mongo)
+    buf = asyncio.run(scenario(job_id))
+    doc = mongo['job'].find_one({'_id': ObjectId(job_id)})
+    assert doc['progress'] == 9
+    assert doc['logs'] == ['line 8', 'line 9']
+    assert buf.writes == 1 and buf.updates == 20
+
+
+def test_terminal_status_flushes_immediately(mongo):
+    async def scenario(job_id):
+        buf = JobStateBuffer(interval=60)
+        await buf.set(job_id, {'progress': 50})
+        await buf.set(job_id, {'status': 'done', 'progress': 100})
+        doc = mongo['job'].find_one({'_id': ObjectId(job_id)})
+        await buf.stop()
+        return doc
+
+    doc = asyncio.run(scenario(_job(mongo)))
+    assert doc['status'] == 'done' and doc['progress'] == 100
+
+
+def test_failed_flush_is_retried_under_newer_updates(mongo, monkeypatch):
+    async def scenario(job_id):
+        buf = JobStateBuffer(interval=60)
+        await buf.set(job_id, {'progress': 10, 'message': 'old'})
+        await buf.push(job_id, 'logs', 'a')
+        real = database.AsyncCollection.bulk_write
+
+        async def failing(self, *args, **kwargs):
+            raise RuntimeError('down')
+        monkeypatch.setattr(database.AsyncCollection, 'bulk_write', failing)
+        try:
+            await buf.flush()
+        except RuntimeError:
+            pass
+        await buf.set(job_id, {'progress': 20})
+        await buf.push(job_id, 'logs', 'b')
+        assert buf.overlay(job_id, {'logs': []}) == {'logs': ['a', 'b'], 'progress': 20, 'message': 'old'}
+        monkeypatch.setattr(database.AsyncCollection, 'bulk_write', real)
+        await buf.stop()
+        return buf
+
+    job_id = _job(mongo)
+    buf = asyncio.run(scenario(job_id))
+    doc = mongo['job'].find_one({'_id': ObjectId(job_id)})
+    assert (doc['progress'], doc['message'], doc['logs']) == (20, 'old', ['a', 'b'])
+    assert buf.failures == 1
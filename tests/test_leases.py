@@ -0,0 +1,266 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import httpx
+from bson import ObjectId
+
+from leases import JobLeases, LeaseWorker, RunnerHeartbeat
+
+
+def _job(mongo, job_type='melody', priority=1, status='queued'):
+    job_id = mongo['job'].insert_one({'type': job_type, 'status': status, 'created_at': datetime.utcnow()}).inserted_id
+    return str(job_id)
+
+
+def _expire(mongo, job_id):
+    mongo['job'].update_one({'_id': ObjectId(job_id)},
+                            {'$set': {'lease_until': datetime.utcnow() - timedelta(seconds=1)}})
+
+
+def test_claim_is_exclusive_and_priority_ordered(mongo):
+    async def scenario():
+        a, b = JobLeases('a'), JobLeases('b')
+        low, high = _job(mongo), _job(mongo)
+        await a.make_leasable(low, priority=2)
+        await a.make_leasable(high, priority=0)
+        first = await a.claim()
+        second = await b.claim()
+        third = await b.claim()
+        return high, low, first, second, third
+
+    high, low, first, second, third = asyncio.run(scenario())
+    assert str(first['_id']) == high and first['lease_owner'] == 'a' and first['attempts'] == 1
+    assert str(second['_id']) == low and second['lease_owner'] == 'b'
+    assert third is None
+
+
+def test_claim_filters_by_job_type(mongo):
+    async def scenario():
+        leases = JobLeases('a')
+        await leases.make_leasable(_job(mongo, 'video'))
+        return await leases.claim(['melody']), await leases.claim(['video'])
+
+    none, video = asyncio.run(scenario())
+    assert none is None and video['type'] == 'video'
+
+
+def test_expired_lease_is_stolen_and_the_old_owner_loses_its_heartbeat(mongo):
+    async def scenario():
+        a, b = JobLeases('a'), JobLeases('b')
+        job_id = _job(mongo, status='running')
+        await a.make_leasable(job_id)
+        await a.claim()
+        assert await b.claim() is None  # still leased to a
+        assert await a.heartbeat(job_id)
+        _expire(mongo, job_id)
+        stolen = await b.claim()
+        return job_id, stolen, await a.heartbeat(job_id), await b.heartbeat(job_id), a, b
+
+    job_id, stolen, a_beat, b_beat, a, b = asyncio.run(scenario())
+    assert str(stolen['_id']) == job_id and stolen['attempts'] == 2
+    assert (a_beat, b_beat) == (False, True)
+    assert a.lost == 1 and b.reclaimed == 1
+
+
+def test_release_and_abandon(mongo):
+    async def scenario():
+        a, b = JobLeases('a'), JobLeases('b')
+        job_id = _job(mongo)
+        await a.make_leasable(job_id)
+        await a.claim()
+        await b.release(job_id)  # not b's lease: no effect
+        assert mongo['job'].find_one({'_id': ObjectId(job_id)})['lease_owner'] == 'a'
+        await a.abandon(job_id)
+        reclaimed = await b.claim()
+        await b.release(job_id)
+        return reclaimed, mongo['job'].find_one({'_id': ObjectId(job_id)})
+
+    reclaimed, doc = asyncio.run(scenario())
+    assert reclaimed['attempts'] == 1  # the abandoned claim did not count
+    assert doc['lease_owner'] is None
+
+
+def test_worker_runs_jobs_and_releases_them(mongo):
+    async def scenario():
+        ran = []
+
+        async def runner(doc):
+            ran.append(str(doc['_id']))
+            mongo['job'].update_one({'_id': doc['_id']}, {'$set': {'status': 'done'}})
+
+        leases = JobLeases('w')
+        ids = [_job(mongo) for _ in range(3)]
+        for job_id in ids:
+            await leases.make_leasable(job_id)
+        worker = LeaseWorker(leases, runner, concurrency=2, poll_sec=0.01)
+        worker.start()
+        for _ in range(200):
+            if worker.completed == 3:
+                break
+            await asyncio.sleep(0.01)
+        await worker.stop()
+        return ids, ran, worker
+
+    ids, ran, worker = asyncio.run(scenario())
+    assert sorted(ran) == sorted(ids)
+    assert worker.completed == 3
+
+
+def test_worker_cancels_a_job_whose_lease_was_taken(mongo):
+    async def scenario():
+        cancelled = asyncio.Event()
+
+        async def runner(doc):
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        a = JobLeases('a', lease_sec=30)
+        job_id = _job(mongo)
+        await a.make_leasable(job_id)
+        worker = LeaseWorker(a, runner, concurrency=1, heartbeat_sec=0.05, poll_sec=0.01)
+        worker.start()
+        for _ in range(100):
+            if worker.running:
+                break
+            await asyncio.sleep(0.01)
+        _expire(mongo, job_id)
+        assert await JobLeases('b').claim() is not None
+        await asyncio.wait_for(cancelled.wait(), 2)
+        await worker.stop()
+        return a
+
+    assert asyncio.run(scenario()).lost >= 1
+
+
+def test_worker_stop_hands_running_jobs_back(mongo):
+    async def scenario():
+        started = asyncio.Event()
+
+        async def runner(doc):
+            started.set()
+            await asyncio.sleep(10)
+
+        leases = JobLeases('a')
+        job_id = _job(mongo)
+        await leases.make_leasable(job_id)
+        worker = LeaseWorker(leases, runner, concurrency=1, poll_sec=0.01)
+        worker.start()
+        await asyncio.wait_for(started.wait(), 2)
+        await worker.stop()
+        return await JobLeases('b').claim()
+
+    doc = asyncio.run(scenario())
+    assert doc is not None and doc['lease_owner'] == 'b' and doc['attempts'] == 1
+
+
+def test_exhausted_jobs_are_failed(mongo):
+    async def scenario():
+        exhausted = []
+
+        async def on_exhausted(doc):
+            exhausted.append(str(doc['_id']))
+
+        async def runner(doc):
+            raise AssertionError('must not run')
+
+        leases = JobLeases('a', max_attempts=1)
+        job_id = _job(mongo, status='running')
+        await leases.make_leasable(job_id)
+        mongo['job'].update_one({'_id': ObjectId(job_id)}, {'$set': {'attempts': 1}})
+        worker = LeaseWorker(leases, runner, concurrency=1, poll_sec=0.01, on_exhausted=on_exhausted)
+        worker.start()
+        for _ in range(100):
+            if exhausted:
+                break
+            await asyncio.sleep(0.01)
+        await worker.stop()
+        return job_id, exhausted
+
+    job_id, exhausted = asyncio.run(scenario())
+    assert exhausted == [job_id]
+
+
+def test_several_workers_run_each_job_exactly_once(mongo):
+    async def scenario():
+        runs = []
+
+        async def runner(doc):
+            runs.append(str(doc['_id']))
+            await asyncio.sleep(0.01)
+
+        ids = [_job(mongo) for _ in range(8)]
+        setup = JobLeases('setup')
+        for job_id in ids:
+            await setup.make_leasable(job_id)
+        workers = [LeaseWorker(JobLeases(f'w{i}'), runner, concurrency=2, poll_sec=0.01) for i in range(3)]
+        for w in workers:
+            w.start()
+        for _ in range(300):
+            if sum(w.completed for w in workers) == len(ids):
+                break
+            await asyncio.sleep(0.01)
+        for w in workers:
+            await w.stop()
+        return ids, runs
+
+    ids, runs = asyncio.run(scenario())
+    assert sorted(runs) == sorted(ids)
+
+
+def _running_job(mongo, runner):
+    return mongo['job'].insert_one({'type': 'legacy', 'status': 'running', 'runner': runner,
+                                    'created_at': datetime.utcnow()}).inserted_id
+
+
+def test_jobs_of_a_live_sibling_are_not_resumed(app, mongo):
+    first = RunnerHeartbeat('first')
+    job_id = _running_job(mongo, 'first')
+
+    async def second_instance_starts():
+        await first.beat()
+        await app.runners.beat()
+        return await app.resume_orphaned_jobs()
+    asyncio.run(second_instance_starts())
+    doc = mongo['job'].find_one({'_id': job_id})
+    assert doc['runner'] == 'first' and 'resumed' not in doc
+
+    mongo['runner'].update_one({'_id': 'first'}, {'$set': {'seen_at': datetime.utcnow() - timedelta(hours=1)}})
+    asyncio.run(app.resume_orphaned_jobs())
+    doc = mongo['job'].find_one({'_id': job_id})
+    assert doc['runner'] == app.INSTANCE_ID and doc['resumed'] == 1
+
+
+def test_clean_shutdown_deregisters(mongo):
+    hb = RunnerHeartbeat('gone')
+
+    async def run():
+        await hb.beat()
+        assert 'gone' in await RunnerHeartbeat('other').live()
+        await hb.stop()
+        return await RunnerHeartbeat('other').live()
+    assert asyncio.run(run()) == ['other']
+
+
+def test_distributed_submissions_are_rejected_once_the_fleet_queue_is_full(app, mongo, monkeypatch):
+    monkeypatch.setattr(app, 'JOB_EXECUTION', 'distributed')
+    monkeypatch.setattr(app.scheduler.queues['melody'], 'maxsize', 2)
+    leases = JobLeases('w')
+
+    async def fill():
+        for job_type in ('melody', 'melody', 'melody', 'video'):
+            await leases.make_leasable(_job(mongo, job_type))
+        await leases.claim(['melody'])  # running on a worker; no longer queued
+        return await leases.queued('melody')
+    assert asyncio.run(fill()) == 2
+
+    async def submit():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app.app), base_url='http://t') as c:
+            return await c.post('/api/generate/melody', json={'projectId': str(ObjectId()), 'lyrics': 'la',
+                                                              'style': 'pop', 'tempo': 100, 'key': 'C'})
+    r = asyncio.run(submit())
+    assert r.status_code == 503 and r.headers['Retry-After']
+    assert r.json()['detail'] == {'error': 'queue_full', 'jobType': 'melody', 'queueDepth': 2, 'maxQueue': 2}
+    assert mongo['job'].count_documents({}) == 4
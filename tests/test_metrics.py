@@ -0,0 +1,63 @@
+import asyncio
+
+import httpx
+from bson import ObjectId
+
+import metrics
+from metrics import HTTP_SECONDS, Histogram
+
+
+def _get(app, paths):
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app.app), base_url='http://t') as c:
+            return [await c.get(p) for p in paths]
+    return asyncio.run(run())
+
+
+def _count(labels):
+    s = HTTP_SECONDS.series.get(labels)
+    return sum(s[:-1]) if s else 0  # bucket counts, without the trailing sum
+
+
+def test_route_label_is_the_template_not_the_path(app, monkeypatch):
+    monkeypatch.setattr(metrics, 'ENABLED', True)
+    monkeypatch.setattr(HTTP_SECONDS, 'series', {})
+    job_ids = [str(ObjectId()) for _ in range(3)]
+    responses = _get(app, [f'/api/job/{j}/status' for j in job_ids] + ['/assets/missing.wav', '/nope'])
+    assert [r.status_code for r in responses] == [404] * 5
+
+    assert _count(('GET', '/api/job/{job_id}/status', '4xx')) == 3
+    assert _count(('GET', '/assets', '4xx')) == 1
+    assert _count(('GET', 'unmatched', '4xx')) == 1
+    assert not any(j in route for _, route, _ in HTTP_SECONDS.series for j in job_ids)
+
+
+def test_scrape_exposes_the_request_series(app, monkeypatch):
+    monkeypatch.setattr(metrics, 'ENABLED', True)
+    monkeypatch.setattr(HTTP_SECONDS, 'series', {})
+    _get(app, [f'/api/job/{ObjectId()}/status'])
+    body = _get(app, ['/metrics'])[0].text
+    assert ('http_request_seconds_count{method="GET",route="/api/job/{job_id}/status",status="4xx"} 1'
+            in body.splitlines())
+
+
+def test_histogram_bounds_are_inclusive_and_cumulative(monkeypatch):
+    monkeypatch.setattr(metrics, 'ENABLED', True)
+    h = Histogram('t_seconds', 'test', ('stage',), buckets=(1.0, 0.1))
+    for v in (0.05, 0.1, 0.5, 1.0, 2.0):
+        h.observe(v, stage='mix')
+    lines = h.render()
+    assert lines[2:] == [
+        't_seconds_bucket{stage="mix",le="0.1"} 2',
+        't_seconds_bucket{stage="mix",le="1"} 4',
+        't_seconds_bucket{stage="mix",le="+Inf"} 5',
+        't_seconds_sum{stage="mix"} 3.65',
+        't_seconds_count{stage="mix"} 5',
+    ]
+
+
+def test_disabled_metrics_record_nothing(monkeypatch):
+    monkeypatch.setattr(metrics, 'ENABLED', False)
+    h = Histogram('t_seconds', 'test')
+    h.observe(0.2)
+    assert h.series == {} and h.render()[2:] == []
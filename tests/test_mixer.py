@@ -0,0 +1,92 @@
+import asyncio
+import wave
+
+import numpy as np
+import pytest
+from bson import ObjectId
+
+import dsp
+import mixer
+from schemas import MixRequest
+
+SR = 44100
+
+
+@pytest.fixture
+def stem(tmp_path):
+    def write(samples: np.ndarray, name=None) -> str:
+        path = str(tmp_path / (name or f'stem{len(list(tmp_path.iterdir()))}.wav'))
+        with wave.open(path, 'wb') as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(SR)
+            f.writeframes((np.clip(samples, -1, 1) * 32767).astype('<i2').tobytes())
+        return path
+    return write
+
+
+def _tone(sec=4.0, amp=0.3, freq=220):
+    t = np.arange(int(SR * sec)) / SR
+    return amp * np.sin(2 * np.pi * freq * t)
+
+
+def _hits(sec=4.0, amp=0.95):
+    x = np.zeros(int(SR * sec))
+    decay = amp * np.exp(-np.arange(400) / 80)
+    for i, k in enumerate(range(0, len(x) - 400, SR // 2)):
+        x[k:k + 400] = decay * (1 if i % 2 else -1)
+    return x
+
+
+def _read(path):
+    wav = dsp.open_wav(path)
+    with open(path, 'rb') as f:
+        return dsp.to_float(dsp.read_frames(f, wav, 0, wav.frames))
+
+
+def test_master_hits_target_under_the_ceiling(stem, tmp_path):
+    out = str(tmp_path / 'master.wav')
+    stats = mixer.mix_stems([stem(_tone()), stem(_hits())], out, target_lufs=-14, ceiling_db=-1)
+    assert stats['limiter_max_reduction_db'] > 0  # the hits had to be limited
+    assert abs(stats['output_lufs'] - (-14)) < 0.5
+    assert dsp.db(float(mixer._true_peak(_read(out)).max())) <= -1 + 0.05
+    assert stats['mixed_stems'] == [0, 1]
+
+
+@pytest.mark.parametrize('block_frames', [64, 1000, 4096])
+def test_output_does_not_depend_on_block_size(stem, tmp_path, block_frames):
+    stems = [stem(_tone(), 'tone.wav'), stem(_hits(), 'hits.wav')]
+    mixer.mix_stems(stems, str(tmp_path / 'whole.wav'), block_frames=1 << 24)
+    mixer.mix_stems(stems, str(tmp_path / 'blocks.wav'), block_frames=block_frames)
+    assert np.array_equal(_read(str(tmp_path / 'whole.wav')), _read(str(tmp_path / 'blocks.wav')))
+
+
+def test_limiter_gain_is_continuous_across_blocks():
+    limiter = mixer.TruePeakLimiter(SR, ceiling_db=-1)
+    signal = np.full((SR, 1), 0.5, dtype=np.float32)
+    signal[SR // 2 - 10:SR // 2 + 10] = 2.0  # spike straddling a block boundary
+    out = signal.copy()
+    block = 4096
+    for start in range(0, len(out), block):
+        limiter.process(out[start:start + block], out[start + block:start + block + mixer.LIMITER_WINDOW].copy())
+    gain = out[:, 0] / signal[:, 0]
+    assert np.abs(gain * signal[:, 0]).max() <= 10 ** (-1 / 20) + 1e-6
+    assert np.abs(np.diff(gain)).max() < 0.02
+    assert gain[0] == 1.0 and gain[-1] == 1.0
+
+
+def test_worker_reports_stems_actually_mixed(app, stem, monkeypatch):
+    class InlinePool:
+        async def run(self, stage, fn, *args, **kwargs):
+            return fn(*args, **kwargs)
+    monkeypatch.setattr(app, 'render_pool', InlinePool())
+    updates = []
+
+    async def job_update(job_id, **fields):
+        updates.append(fields)
+    monkeypatch.setattr(app, 'job_update', job_update)
+    urls = [app.asset_store.put(stem(x))['url'] for x in (_tone(), np.zeros(0), _hits())]
+    req = MixRequest(projectId='p', stems=urls)
+    asyncio.run(app._worker_mix(str(ObjectId()), req))
+    assert updates[-1]['status'] == 'done'
+    assert updates[-1]['result']['stemsProcessed'] == [urls[0], urls[2]]
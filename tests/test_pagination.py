@@ -0,0 +1,69 @@
+import asyncio
+import base64
+import json
+from datetime import datetime, timedelta
+
+import pytest
+from bson import ObjectId
+from fastapi import HTTPException
+
+from database import apaginate, encode_cursor
+
+
+@pytest.fixture
+def assets(mongo):
+    t0 = datetime(2026, 1, 1)
+    # Three documents share a timestamp, so only _id breaks the tie.
+    stamps = [t0, t0 + timedelta(seconds=1), t0 + timedelta(seconds=1), t0 + timedelta(seconds=1),
+              t0 + timedelta(seconds=2), t0 + timedelta(seconds=3), t0 + timedelta(seconds=4)]
+    for i, t in enumerate(stamps):
+        mongo.asset.insert_one({'_id': ObjectId(), 'n': i, 'kind': 'wav' if i % 2 else 'midi', 'created_at': t})
+    return sorted(mongo.asset.find(), key=lambda d: (d['created_at'], d['_id']), reverse=True)
+
+
+def _all_pages(limit, query=None, fields=None):
+    async def run():
+        pages, cursor = [], None
+        while True:
+            docs, cursor = await apaginate('asset', query or {}, fields, limit, cursor)
+            pages.append(docs)
+            if cursor is None:
+                return pages
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize('limit', [1, 2, 3, 7, 50])
+def test_pages_cover_everything_once_in_order(assets, limit):
+    pages = _all_pages(limit)
+    assert [d['_id'] for page in pages for d in page] == [d['_id'] for d in assets]
+    assert all(len(page) == limit for page in pages[:-1]) and 0 < len(pages[-1]) <= limit
+
+
+def test_last_full_page_has_no_next_cursor(assets):
+    docs, cursor = asyncio.run(apaginate('asset', {}, None, len(assets)))
+    assert len(docs) == len(assets) and cursor is None
+
+
+def test_cursor_round_trips_with_projection_and_filter(assets):
+    pages = _all_pages(1, {'$or': [{'kind': 'wav'}, {'n': 0}]}, {'n': 1})
+    got = [d['n'] for page in pages for d in page]
+    assert got == [d['n'] for d in assets if d['kind'] == 'wav' or d['n'] == 0]
+    assert set(pages[0][0]) == {'_id', 'n', 'created_at'}
+
+
+@pytest.mark.parametrize('cursor', [
+    'not-a-cursor!',
+    base64.urlsafe_b64encode(b'{"t": "yesterday", "id": "x"}').decode(),
+    base64.urlsafe_b64encode(json.dumps({'t': '2026-01-01T00:00:00', 'id': 'nope'}).encode()).decode(),
+    base64.urlsafe_b64encode(b'[1, 2]').decode(),
+])
+def test_malformed_cursors_are_rejected(mongo, cursor):
+    with pytest.raises(ValueError):
+        asyncio.run(apaginate('asset', {}, None, 10, cursor))
+
+
+def test_tampered_cursor_is_a_400(app, assets):
+    good = encode_cursor(assets[0])
+    with pytest.raises(HTTPException) as e:
+        asyncio.run(app.list_page('asset', {}, {'n': 1}, 10, good[:-3] + '!!!'))
+    assert e.value.status_code == 400
@@ -0,0 +1,85 @@
+import asyncio
+import time
+
+import pytest
+
+from pipeline import Pipeline, Stage, StageFailed
+
+
+def _stage(name, log, deps=(), sec=0.0, result=None, error=None):
+    async def run(inputs):
+        log.append(('start', name, sorted(inputs)))
+        await asyncio.sleep(sec)
+        if error is not None:
+            raise error
+        log.append(('done', name))
+        return result if result is not None else {'from': name}
+    return Stage(name, run, tuple(deps))
+
+
+def test_dependencies_run_first_and_receive_outputs():
+    log = []
+    p = Pipeline([_stage('mix', log, ('vocal', 'instrumental')), _stage('vocal', log, ('melody',)),
+                  _stage('melody', log), _stage('instrumental', log)])
+    outputs = asyncio.run(p.run())
+    assert set(outputs) == {'mix', 'vocal', 'melody', 'instrumental'}
+    done = [e[1] for e in log if e[0] == 'done']
+    assert done.index('melody') < done.index('vocal') < done.index('mix')
+    assert ('start', 'mix', ['instrumental', 'vocal']) in log
+
+
+def test_independent_stages_run_concurrently():
+    log = []
+    p = Pipeline([_stage(n, log, sec=0.2) for n in ('a', 'b', 'c')])
+    t0 = time.monotonic()
+    asyncio.run(p.run())
+    assert time.monotonic() - t0 < 0.5
+
+
+def test_failure_cancels_the_rest():
+    log = []
+    cancelled = []
+
+    async def slow(_):
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.append('slow')
+            raise
+    p = Pipeline([_stage('bad', log, sec=0.01, error=RuntimeError('boom')), Stage('slow', slow),
+                  _stage('after', log, ('bad',))])
+    with pytest.raises(StageFailed) as e:
+        asyncio.run(p.run())
+    assert e.value.stage == 'bad' and isinstance(e.value.error, RuntimeError)
+    assert cancelled == ['slow']
+    assert not any(entry[1] == 'after' for entry in log)
+
+
+def test_completed_stages_are_skipped():
+    log = []
+    p = Pipeline([_stage('a', log), _stage('b', log, ('a',))])
+    outputs = asyncio.run(p.run(done={'a': {'cached': True}}))
+    assert outputs['a'] == {'cached': True}
+    assert [e[1] for e in log] == ['b', 'b']
+
+
+def test_events_report_progress():
+    events = []
+
+    async def on_event(kind, stage, info):
+        events.append((kind, stage, info['progress']))
+    log = []
+    asyncio.run(Pipeline([_stage('a', log), _stage('b', log, ('a',))]).run(on_event=on_event))
+    assert [(k, s) for k, s, _ in events] == [('start', 'a'), ('done', 'a'), ('start', 'b'), ('done', 'b')]
+    assert events[-1][2] == 1.0
+
+
+@pytest.mark.parametrize('stages, message', [
+    ([Stage('a', None, ('b',)), Stage('b', None, ('a',))], 'cycle'),
+    ([Stage('a', None, ('a',))], 'cycle'),
+    ([Stage('a', None, ('missing',))], 'unknown stage'),
+    ([Stage('a', None), Stage('a', None)], 'Duplicate'),
+])
+def test_invalid_graphs_are_rejected(stages, message):
+    with pytest.raises(ValueError, match=message):
+        Pipeline(stages)
@@ -0,0 +1,100 @@
+import asyncio
+import logging
+import time
+
+import httpx
+from fastapi import FastAPI
+
+from profiling import LoopWatchdog, ProfileMiddleware, Profiler
+
+
+def _profiled_app(profiler):
+    api = FastAPI()
+
+    @api.get('/work')
+    async def work():
+        return {'job': profiler.job_requested()}
+
+    api.add_middleware(ProfileMiddleware, profiler=profiler)
+    return api
+
+
+def _get(api, headers):
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=api), base_url='http://t') as c:
+            return await c.get('/work', headers=headers)
+    return asyncio.run(run())
+
+
+def test_request_capture_requires_the_token(tmp_path):
+    profiler = Profiler(str(tmp_path), enabled=True, token='s3cret')
+    api = _profiled_app(profiler)
+
+    for headers in ({'X-Profile': 'request'}, {'X-Profile': 'request', 'X-Profile-Token': 'wrong'}):
+        r = _get(api, headers)
+        assert r.status_code == 200 and 'x-profile-id' not in r.headers
+    assert profiler.captures == 0 and profiler.list() == []
+
+    r = _get(api, {'X-Profile': 'request', 'X-Profile-Token': 's3cret'})
+    profile_id = r.headers['x-profile-id']
+    assert profiler.captures == 1
+    assert profiler.path(profile_id) and profiler.path(profile_id, 'txt')
+    assert open(profiler.path(profile_id, 'txt')).read().startswith('GET /work:')
+
+
+def test_job_mode_marks_the_request_without_capturing_it(tmp_path):
+    profiler = Profiler(str(tmp_path), enabled=True, token='s3cret')
+    api = _profiled_app(profiler)
+    assert _get(api, {'X-Profile': 'job', 'X-Profile-Token': 's3cret'}).json() == {'job': True}
+    assert _get(api, {'X-Profile': 'job'}).json() == {'job': False}
+    assert _get(api, {}).json() == {'job': False}
+    assert profiler.captures == 0
+
+
+def test_path_rejects_ids_outside_the_capture_pattern(tmp_path):
+    profiler = Profiler(str(tmp_path), enabled=True)
+    (tmp_path / 'x.prof').write_text('')
+    assert profiler.path('x') is None
+    assert profiler.path('../x') is None
+    assert profiler.path('20260101T000000-request-0123abcd', 'py') is None
+
+
+def _blocking(threshold, block_sec):
+    watchdog = LoopWatchdog(threshold)
+
+    async def run():
+        watchdog.start()
+        await asyncio.sleep(threshold)
+        time.sleep(block_sec)  # holds the loop
+        await asyncio.sleep(threshold * 2)
+        await watchdog.stop()
+    asyncio.run(run())
+    return watchdog
+
+
+def test_watchdog_reports_a_block_with_the_loop_stack_then_the_recovery(caplog):
+    caplog.set_level(logging.WARNING, logger='profiling')
+    watchdog = _blocking(0.05, 0.3)
+    assert watchdog.blocks == 1
+    assert 250 <= watchdog.longest_ms < 1000
+
+    blocked, unblocked = [r.getMessage() for r in caplog.records]
+    assert blocked.startswith('Event loop blocked for ')
+    assert 'time.sleep(block_sec)' in blocked
+    assert unblocked.startswith('Event loop unblocked after ')
+
+
+def test_watchdog_stays_quiet_on_a_responsive_loop(caplog):
+    caplog.set_level(logging.WARNING, logger='profiling')
+    watchdog = _blocking(0.2, 0.0)
+    assert watchdog.blocks == 0 and watchdog.longest_ms == 0
+    assert caplog.records == []
+
+
+def test_watchdog_is_off_without_a_threshold():
+    watchdog = LoopWatchdog(0)
+
+    async def run():
+        watchdog.start()
+        return watchdog._task, watchdog._thread
+    assert asyncio.run(run()) == (None, None)
@@ -0,0 +1,76 @@
+import asyncio
+import os
+import time
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+from render import RenderPool, StageTimeout
+
+
+def _crash_once(marker: str) -> str:
+    if not os.path.exists(marker):
+        open(marker, 'w').close()
+        os._exit(1)
+    return 'ok'
+
+
+def _crash() -> None:
+    os._exit(1)
+
+
+def _fail() -> None:
+    raise ValueError("bad stem")
+
+
+def _with_pool(scenario):
+    async def run():
+        pool = RenderPool(1, default_timeout=30)
+        await pool.start(warm=False)
+        try:
+            return await scenario(pool)
+        finally:
+            await pool.stop()
+    return asyncio.run(run())
+
+
+def test_timeout_recycles_the_pool():
+    async def scenario(pool):
+        first = pool.pool
+        t0 = time.monotonic()
+        with pytest.raises(StageTimeout) as e:
+            await pool.run('mix', time.sleep, 30, timeout=1)
+        assert time.monotonic() - t0 < 10 and e.value.stage == 'mix'
+        assert pool.pool is not first
+        assert await pool.run('mix', abs, -3) == 3
+        return pool.stats()
+    stats = _with_pool(scenario)
+    assert stats['recycles'] == 1
+    mix = stats['stages']['mix']
+    assert (mix['runs'], mix['timeouts'], mix['failures']) == (1, 1, 0)
+
+
+def test_crashed_worker_is_retried_on_a_fresh_pool(tmp_path):
+    async def scenario(pool):
+        return await pool.run('file', _crash_once, str(tmp_path / 'crashed')), pool.stats()
+    result, stats = _with_pool(scenario)
+    assert result == 'ok' and stats['recycles'] == 1
+    assert stats['stages']['file']['runs'] == 1 and stats['stages']['file']['failures'] == 0
+
+
+def test_repeated_crash_gives_up_after_one_retry():
+    async def scenario(pool):
+        with pytest.raises(BrokenProcessPool):
+            await pool.run('file', _crash)
+        return pool.stats()
+    stats = _with_pool(scenario)
+    assert stats['recycles'] == 2 and stats['stages']['file']['failures'] == 1
+
+
+def test_stage_errors_propagate_without_recycling():
+    async def scenario(pool):
+        with pytest.raises(ValueError):
+            await pool.run('analysis', _fail)
+        return pool.stats()
+    stats = _with_pool(scenario)
+    assert stats['recycles'] == 0 and stats['stages']['analysis']['failures'] == 1
@@ -0,0 +1,51 @@
+import asyncio
+
+import pytest
+from bson import ObjectId
+
+from checkpoint import Checkpoint
+
+
+class _InlinePool:
+    async def run(self, stage, fn, *args, **kwargs):
+        return fn(*args, **kwargs)
+
+
+@pytest.fixture
+def job(app, mongo, monkeypatch):
+    monkeypatch.setattr(app, 'render_pool', _InlinePool())
+    monkeypatch.setattr(app, 'STEM_FLUSH_BATCH', 2)
+    return str(mongo.job.insert_one({'status': 'running'}).inserted_id)
+
+
+def _checkpointed(mongo, job_id):
+    return sorted((mongo.job.find_one({'_id': ObjectId(job_id)}).get('checkpoint') or {}))
+
+
+def test_stems_flush_in_batches(app, mongo, job):
+    seen = []
+
+    async def on_stem(i, inst):
+        seen.append(_checkpointed(mongo, job))
+
+    instruments = ['Piano', 'Strings', 'Bass', 'Drums', 'Flute']
+    refs = asyncio.run(app.render_stems(Checkpoint(job), None, instruments, 0.1, {}, on_stem=on_stem))
+    assert [r['meta']['instrument'] for r in refs] == instruments
+    assert seen[2] == ['stem_0', 'stem_1']
+    assert _checkpointed(mongo, job) == [f'stem_{i}' for i in range(5)]
+    assert mongo.asset.count_documents({}) == 5
+
+
+def test_finished_stems_survive_a_failure(app, mongo, job):
+    async def on_stem(i, inst):
+        if i == 2:
+            raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(app.render_stems(Checkpoint(job), None, ['Piano', 'Strings', 'Bass'], 0.1, {}, on_stem=on_stem))
+    assert _checkpointed(mongo, job) == ['stem_0', 'stem_1', 'stem_2']
+
+    resumed = asyncio.run(Checkpoint.load(job))
+    asyncio.run(app.render_stems(resumed, None, ['Piano', 'Strings', 'Bass'], 0.1, {}))
+    assert resumed.reused == 3
+    assert mongo.asset.count_documents({}) == 3
@@ -0,0 +1,68 @@
+import asyncio
+import os
+
+from resultcache import ResultCache, request_fingerprint
+
+
+def test_fingerprint_ignores_project_and_lyrics_whitespace():
+    a = request_fingerprint('melody', {'projectId': 'p1', 'lyrics': 'la la \n  da\n\n', 'key': 'C minor'})
+    b = request_fingerprint('melody', {'projectId': 'p2', 'lyrics': 'la la\nda', 'key': 'C minor'})
+    assert a == b
+
+
+def test_fingerprint_keeps_everything_that_reaches_the_output():
+    base = {'lyrics': 'a\n\nb', 'key': 'C minor', 'style': 'Romantic', 'instruments': ['Piano']}
+    fp = request_fingerprint('melody', base)
+    # A blank line shifts the timing of every later line.
+    assert request_fingerprint('melody', {**base, 'lyrics': 'a\nb'}) != fp
+    # Key, style and instrument names are written out verbatim.
+    assert request_fingerprint('melody', {**base, 'key': 'C MINOR'}) != fp
+    assert request_fingerprint('melody', {**base, 'style': 'romantic'}) != fp
+    assert request_fingerprint('melody', {**base, 'instruments': ['piano']}) != fp
+    assert request_fingerprint('instrumental', base) != fp
+
+
+def test_memory_and_persistent_tiers(mongo, tmp_path):
+    path = tmp_path / 'out.wav'
+    path.write_bytes(b'x')
+
+    async def scenario():
+        writer = ResultCache()
+        await writer.put('fp', 'melody', {'url': '/assets/out.wav'},
+                         [{'id': '1', 'kind': 'wav', 'path': str(path), 'url': '/assets/out.wav', 'meta': {},
+                           'retention': 'intermediate'}])
+        memory = await writer.get('fp')
+        persistent = await ResultCache().get('fp')  # another process: empty memory tier
+        os.remove(path)
+        gone = await ResultCache().get('fp')
+        return writer, memory, persistent, gone
+
+    writer, memory, persistent, gone = asyncio.run(scenario())
+    assert writer.hits_memory == 1
+    assert persistent['result'] == {'url': '/assets/out.wav'}
+    assert persistent['assets'][0]['retention'] == 'intermediate'
+    assert gone is None  # its file disappeared
+
+
+def test_cache_hit_keeps_intermediate_retention(app, tmp_path):
+    from schemas import GenerateMelodyRequest
+
+    guide = tmp_path / 'guide.wav'
+    guide.write_bytes(b'guide')
+    midi = tmp_path / 'melody.mid.txt'
+    midi.write_text('midi')
+    req = GenerateMelodyRequest(projectId='p2', lyrics='la', style='Pop', tempo=90, key='C minor')
+    fingerprint = request_fingerprint('melody', req.model_dump())
+
+    async def scenario():
+        await app.result_cache.put(fingerprint, 'melody', {'midiUrl': '/assets/m'}, [
+            {'kind': 'midi', 'path': str(midi), 'url': '/assets/m', 'meta': {}, 'retention': 'final'},
+            {'kind': 'wav', 'path': str(guide), 'url': '/assets/g', 'meta': {}, 'retention': 'intermediate'},
+        ])
+        return await app.serve_cached('melody', req, fingerprint, 'cached')
+
+    resp = asyncio.run(scenario())
+    assert resp['cached']
+    docs = {d['kind']: d for d in app.database.db['asset'].find({'project_id': 'p2'})}
+    assert docs['midi']['retention'] == 'final'
+    assert docs['wav']['retention'] == 'intermediate'
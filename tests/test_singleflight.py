@@ -0,0 +1,101 @@
+import asyncio
+
+import pytest
+
+from singleflight import IdempotencyConflict, IdempotencyStore, InFlight
+
+
+def test_followers_attach_to_the_leader():
+    async def scenario():
+        flight = InFlight()
+        assert flight.claim('fp')
+        assert not flight.claim('fp')
+        waiter = asyncio.create_task(flight.attach('fp'))
+        await asyncio.sleep(0)
+        flight.started('fp', 'leader')
+        leader = await waiter
+        flight.follow('fp', 'follower')
+        return leader, flight.finish('fp'), flight.active('fp')
+
+    assert asyncio.run(scenario()) == ('leader', ['follower'], False)
+
+
+def test_attach_fails_when_the_leader_never_starts():
+    async def scenario():
+        flight = InFlight()
+        flight.claim('fp')
+        waiter = asyncio.create_task(flight.attach('fp'))
+        await asyncio.sleep(0)
+        flight.finish('fp', RuntimeError('queue full'))
+        with pytest.raises(RuntimeError):
+            await waiter
+
+    asyncio.run(scenario())
+
+
+def test_reservation_race_across_processes(mongo):
+    async def scenario():
+        a, b = IdempotencyStore(), IdempotencyStore()  # separate memory tiers, shared collection
+        first = await a.reserve('melody', 'key', 'fp', 'job-a')
+        second = await b.reserve('melody', 'key', 'fp', 'job-b')
+        with pytest.raises(IdempotencyConflict):
+            await b.reserve('melody', 'key', 'other-fp', 'job-c')
+        await a.release('melody', 'key', 'job-a')
+        third = await b.reserve('melody', 'key', 'fp', 'job-d')
+        return first, second, third
+
+    assert asyncio.run(scenario()) == ('job-a', 'job-a', 'job-d')
+
+
+def test_release_only_drops_its_own_reservation(mongo):
+    async def scenario():
+        store = IdempotencyStore()
+        await store.reserve('melody', 'key', 'fp', 'job-a')
+        await store.release('melody', 'key', 'job-other')
+        return await IdempotencyStore().lookup('melody', 'key', 'fp')
+
+    assert asyncio.run(scenario()) == 'job-a'
+
+
+def test_losing_the_key_race_creates_no_job(app, monkeypatch):
+    from schemas import GenerateMelodyRequest
+
+    req = GenerateMelodyRequest(projectId='p1', lyrics='la', style='Pop', tempo=90, key='C minor')
+    fingerprint = app.request_fingerprint('melody', req.model_dump())
+
+    async def scenario():
+        # Another process reserves the key between our lookup and our reservation.
+        real_lookup = app.idempotency.lookup
+
+        async def lookup(*args):
+            monkeypatch.setattr(app.idempotency, 'lookup', real_lookup)
+            await IdempotencyStore().reserve('melody', 'key', fingerprint, 'aaaaaaaaaaaaaaaaaaaaaaaa')
+            return None
+        monkeypatch.setattr(app.idempotency, 'lookup', lookup)
+        return await app.submit_generation('melody', req, 'm', 'c', app._worker_melody, 'key')
+
+    resp = asyncio.run(scenario())
+    assert resp['jobId'] == 'aaaaaaaaaaaaaaaaaaaaaaaa' and resp['idempotentReplay']
+    assert app.database.db['job'].count_documents({}) == 0
+
+
+def test_follower_on_another_project_gets_its_own_assets(app, tmp_path):
+    path = tmp_path / 'melody.mid.txt'
+    path.write_text('midi')
+
+    async def scenario():
+        leader = await app.job_create('melody', 'p1')
+        follower = await app.job_create('melody', 'p2')
+        mirror = asyncio.create_task(app._mirror_job(follower, leader, 'fp', 'p2'))
+        await asyncio.sleep(0.01)
+        result = {'midiUrl': '/assets/m'}
+        await app.result_cache.put('fp', 'melody', result, [
+            {'kind': 'midi', 'path': str(path), 'url': '/assets/m', 'meta': {}, 'retention': 'final'}])
+        await app.job_update(leader, status='done', progress=100, result=result)
+        await asyncio.wait_for(mirror, 1)
+        return app.job_events.snapshot(follower)
+
+    state = asyncio.run(scenario())
+    assert state['status'] == 'done' and state['result'] == {'midiUrl': '/assets/m'}
+    assets = list(app.database.db['asset'].find({'project_id': 'p2'}))
+    assert [a['kind'] for a in assets] == ['midi']
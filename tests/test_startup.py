@@ -0,0 +1,33 @@
+import asyncio
+
+import pytest
+
+from dbconn import DatabaseUnavailable
+
+
+def test_index_setup_error_fails_startup(app, monkeypatch):
+    async def broken():
+        raise RuntimeError("index options conflict")
+    monkeypatch.setattr(app, 'ensure_collections', broken)
+    with pytest.raises(RuntimeError):
+        asyncio.run(app._setup_database())
+
+
+def test_unreachable_database_retries_in_background(app, monkeypatch):
+    calls = []
+
+    async def flaky():
+        calls.append(1)
+        if len(calls) == 1:
+            raise DatabaseUnavailable("down")
+    monkeypatch.setattr(app, 'ensure_collections', flaky)
+    monkeypatch.setattr(app, '_setup_task', None)
+
+    async def run():
+        await app._setup_database()
+        assert app._setup_task is not None
+        await asyncio.wait_for(app._setup_task, 5)
+    real_sleep = asyncio.sleep
+    monkeypatch.setattr(asyncio, 'sleep', lambda d: real_sleep(0))
+    asyncio.run(run())
+    assert len(calls) == 2
@@ -0,0 +1,163 @@
+import os
+import shutil
+import time
+from datetime import datetime, timezone
+
+import pytest
+
+from storage import AssetStore, LocalAssetStore, S3AssetStore, key_from_url
+
+
+def _stage(store, data: bytes, name='x.wav'):
+    path = store.staging_path(name)
+    with open(path, 'wb') as f:
+        f.write(data)
+    return path
+
+
+def _age(path, sec=86400):
+    t = time.time() - sec
+    os.utime(path, (t, t))
+
+
+@pytest.fixture
+def local(tmp_path):
+    return LocalAssetStore(str(tmp_path / 'assets'))
+
+
+def test_put_is_content_addressed(local):
+    a = local.put(_stage(local, b'same'))
+    staged = _stage(local, b'same')
+    b = local.put(staged)
+    assert a['key'] == b['key'] and a['key'].endswith('.wav')
+    assert not a['deduplicated'] and b['deduplicated']
+    assert not os.path.exists(staged)
+    assert local.stats()['deduplicated'] == 1
+    assert local.key_for_path(a['path']) == a['key']
+
+
+def test_dedup_refreshes_mtime(local):
+    first = local.put(_stage(local, b'blob'))
+    _age(first['path'])
+    local.put(_stage(local, b'blob'))
+    assert os.stat(first['path']).st_mtime > time.time() - 60
+
+
+def test_put_of_stored_file_refreshes_mtime(local):
+    first = local.put(_stage(local, b'blob'))
+    _age(first['path'])
+    again = local.put(first['path'])
+    assert again['key'] == first['key'] and again['deduplicated']
+    assert os.stat(first['path']).st_mtime > time.time() - 60
+
+
+def test_key_from_url_rejects_traversal():
+    with pytest.raises(ValueError):
+        key_from_url('/assets/../main.py')
+    assert key_from_url('/assets/legacy.wav?x=1') == 'legacy.wav'
+
+
+class _ClientError(Exception):
+    def __init__(self, code):
+        super().__init__(code)
+        self.response = {'Error': {'Code': code}}
+
+
+class _StubS3:
+    """The slice of the boto3 S3 client S3AssetStore uses, backed by a dict."""
+
+    class exceptions:
+        ClientError = _ClientError
+
+    def __init__(self):
+        self.objects = {}
+        self.calls = []
+
+    def _get(self, key):
+        if key not in self.objects:
+            raise _ClientError('404')
+        return self.objects[key]
+
+    def head_object(self, Bucket, Key):
+        self.calls.append('head')
+        return self._get(Key)
+
+    def upload_file(self, src, bucket, key):
+        self.calls.append('upload')
+        with open(src, 'rb') as f:
+            self.objects[key] = {'Body': f.read(), 'LastModified': datetime.now(timezone.utc)}
+
+    def copy_object(self, Bucket, Key, CopySource, MetadataDirective):
+        self.calls.append('copy')
+        src = self._get(CopySource['Key'])
+        self.objects[Key] = {**src, 'LastModified': datetime.now(timezone.utc)}
+
+    def download_file(self, bucket, key, dest):
+        self.calls.append('download')
+        body = self._get(key)['Body']
+        with open(dest, 'wb') as f:
+            f.write(body)
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop(Key, None)
+
+    def get_paginator(self, name):
+        client = self
+
+        class _Paginator:
+            def paginate(self, Bucket, Prefix):
+                yield {'Contents': [{'Key': k, 'LastModified': o['LastModified']}
+                                    for k, o in client.objects.items() if k.startswith(Prefix)]}
+        return _Paginator()
+
+
+@pytest.fixture
+def s3(tmp_path):
+    return S3AssetStore(str(tmp_path / 'cache'), bucket='b', prefix='assets/', client=_StubS3())
+
+
+def test_s3_uploads_once_and_touches_duplicates(s3):
+    a = s3.put(_stage(s3, b'stem'))
+    obj = s3.client.objects['assets/' + a['key']]
+    obj['LastModified'] = datetime(2000, 1, 1, tzinfo=timezone.utc)
+    b = s3.put(_stage(s3, b'stem'))
+    assert b['deduplicated'] and s3.client.calls.count('upload') == 1
+    assert s3.client.objects['assets/' + a['key']]['LastModified'].year > 2000
+    assert [k for k, _ in s3.iter_keys()] == [a['key']]
+
+
+def test_s3_put_of_cached_file_touches_object(s3):
+    a = s3.put(_stage(s3, b'stem'))
+    s3.client.calls.clear()
+    s3.put(a['path'])
+    assert s3.client.calls == ['copy']
+
+
+def test_s3_fetches_missing_cache_entries(s3, tmp_path):
+    a = s3.put(_stage(s3, b'stem'))
+    shutil.rmtree(tmp_path / 'cache' / a['key'].split('/')[0])
+    path = s3.local_path(a['key'])
+    with open(path, 'rb') as f:
+        assert f.read() == b'stem'
+    assert s3.stats()['fetches'] == 1
+
+    s3.delete(a['key'])
+    assert not s3.exists(a['key'])
+    with pytest.raises(FileNotFoundError):
+        s3.local_path(a['key'])
+
+
+def test_incomplete_backend_fails_at_construction(tmp_path):
+
+    class NoDelete(AssetStore):
+        def _store(self, src_path, key):
+            return True
+
+        def iter_keys(self, include_legacy=False):
+            return iter(())
+
+        def exists(self, key):
+            return False
+
+    with pytest.raises(TypeError, match='delete'):
+        NoDelete(str(tmp_path))
@@ -0,0 +1,57 @@
+import asyncio
+import io
+import os
+import wave
+
+import httpx
+import numpy as np
+
+
+class _InlinePool:
+    async def run(self, stage, fn, *args, **kwargs):
+        return fn(*args, **kwargs)
+
+
+def _wav(sec=1.0, sr=16000):
+    buf = io.BytesIO()
+    with wave.open(buf, 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sr)
+        t = np.arange(int(sr * sec)) / sr
+        f.writeframes((0.3 * np.sin(2 * np.pi * 220 * t) * 32767).astype('<i2').tobytes())
+    return buf.getvalue()
+
+
+def _upload(app, files):
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app.app), base_url='http://t') as c:
+            return await c.post('/api/upload/voice', files=[('files', f) for f in files], data={'name': 'Me'})
+    return asyncio.run(run())
+
+
+def _staged(app):
+    return os.listdir(app.asset_store.staging_dir)
+
+
+def test_oversized_clip_is_rejected_and_cleaned_up(app, mongo, monkeypatch):
+    monkeypatch.setattr(app, 'render_pool', _InlinePool())
+    monkeypatch.setattr(app, 'UPLOAD_CHUNK_BYTES', 4096)
+    monkeypatch.setattr(app, 'MAX_CLIP_BYTES', 20000)
+    ok = _wav(0.5)
+    r = _upload(app, [('ok.wav', ok, 'audio/wav'), ('big.wav', b'\0' * 50000, 'audio/wav')])
+    assert r.status_code == 400 and 'exceeds' in r.json()['detail']
+    assert _staged(app) == []
+    assert mongo.voiceprofile.count_documents({}) == 0
+
+
+def test_clip_is_streamed_to_the_store(app, mongo, monkeypatch):
+    monkeypatch.setattr(app, 'render_pool', _InlinePool())
+    monkeypatch.setattr(app, 'UPLOAD_CHUNK_BYTES', 4096)
+    data = _wav(1.0)
+    r = _upload(app, [('clip.wav', data, 'audio/wav')])
+    assert r.status_code == 200, r.text
+    profile = mongo.voiceprofile.find_one()
+    with open(app.asset_store.resolve_url(profile['files'][0]), 'rb') as f:
+        assert f.read() == data
+    assert _staged(app) == []
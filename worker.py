@@ -0,0 +1,70 @@
+"""
+Standalone Job Worker
+
+Executes jobs claimed through Mongo leases (see leases.py), separately from
+the API processes. Run the API with JOB_EXECUTION=distributed so it only
+queues jobs, then start as many workers as needed, on any host that shares
+the database and the assets directory:
+
+    python worker.py                      # every job type
+    python worker.py --types mix,video    # a dedicated render box
+    python worker.py --concurrency 8
+
+SIGINT/SIGTERM stop claiming, cancel running jobs and hand them back so
+another worker resumes them from their checkpoint right away.
+"""
+
+import argparse
+import asyncio
+import logging
+import signal
+
+import main
+from leases import LeaseWorker
+
+logger = logging.getLogger("worker")
+
+
+async def serve(job_types, concurrency):
+    main.job_state.start()
+    main.job_logs.start()
+    main.loop_watchdog.start()
+    await main.render_pool.start()
+    try:
+        await main.leases.ensure_indexes()
+    except Exception:
+        logger.exception("Could not ensure lease indexes")
+    kwargs = {'job_types': job_types, 'on_exhausted': main.fail_exhausted_job}
+    if concurrency:
+        kwargs['concurrency'] = concurrency
+    worker = LeaseWorker.from_env(main.leases, main.run_leased_job, **kwargs)
+    worker.start()
+    logger.info("Worker %s running %s (concurrency %d)", main.leases.owner,
+                ', '.join(job_types) if job_types else 'all job types', worker.concurrency)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await stop.wait()
+
+    logger.info("Stopping worker %s: %s", main.leases.owner, worker.stats())
+    await worker.stop()
+    await main.job_state.stop()
+    await main.job_logs.stop()
+    await main.loop_watchdog.stop()
+    await main.render_pool.stop()
+
+
+def cli():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--types', default='', help='comma-separated job types to run (default: all)')
+    ap.add_argument('--concurrency', type=int, default=0, help='jobs to run at once (default: JOB_WORKER_CONCURRENCY)')
+    args = ap.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(levelname)s %(message)s')
+    types = [t.strip() for t in args.types.split(',') if t.strip()] or None
+    asyncio.run(serve(types, args.concurrency))
+
+
+if __name__ == '__main__':
+    cli()